@@ -0,0 +1,373 @@
+# Broker AMQP em processo com a mesma interface de pika usada pelos serviços
+# (BlockingConnection para consumir, SelectConnection com confirmações para publicar).
+# Implementa exchanges topic e a exchange padrão (''), filas exclusivas ou nomeadas com
+# consumidores concorrentes, prefetch, ack/nack com reentrega e message properties.
+#
+# Não é um RabbitMQ: nada é persistido e não há rede. Serve para rodar todos os serviços
+# num único processo no benchmark ponta a ponta (benchmarks/bench_pipeline.py), que
+# instala este módulo como `pika` antes de importar os serviços.
+
+import itertools
+import queue
+import threading
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+from comum.transporte import topico_confere
+
+###################################################################
+# Tipos da interface do pika
+
+class PlainCredentials:
+    def __init__(self, username: str, password: str):
+        self.username = username
+        self.password = password
+
+class ConnectionParameters:
+    def __init__(self, host: str = 'localhost', credentials: Optional[PlainCredentials] = None, **kwargs):
+        self.host = host
+        self.credentials = credentials
+
+class BasicProperties:
+    def __init__(self, content_type: Optional[str] = None, message_id: Optional[str] = None,
+                 headers: Optional[dict] = None, delivery_mode: Optional[int] = None, **kwargs):
+        self.content_type = content_type
+        self.message_id = message_id
+        self.headers = headers
+        self.delivery_mode = delivery_mode
+
+class _Metodo:
+    def __init__(self, **campos):
+        self.__dict__.update(campos)
+
+class spec:
+    class Basic:
+        class Ack:
+            def __init__(self, delivery_tag: int, multiple: bool = False):
+                self.delivery_tag = delivery_tag
+                self.multiple = multiple
+
+        class Nack(Ack):
+            pass
+
+    class PERSISTENT_DELIVERY_MODE:
+        pass
+
+class _Frame:
+    def __init__(self, method):
+        self.method = method
+
+class _Resultado:
+    def __init__(self, fila: str):
+        self.method = _Metodo(queue=fila, message_count=0, consumer_count=0)
+
+###################################################################
+# Broker
+
+class _Entrega:
+    __slots__ = ("routing_key", "corpo", "propriedades", "reentregue")
+
+    def __init__(self, routing_key: str, corpo: bytes, propriedades, reentregue: bool = False):
+        self.routing_key = routing_key
+        self.corpo = corpo
+        self.propriedades = propriedades
+        self.reentregue = reentregue
+
+class _Consumidor:
+    def __init__(self, canal: "BlockingChannel", callback: Callable, auto_ack: bool):
+        self.canal = canal
+        self.callback = callback
+        self.auto_ack = auto_ack
+
+    def disponivel(self) -> bool:
+        return self.auto_ack or self.canal.prefetch == 0 or len(self.canal.sem_ack) < self.canal.prefetch
+
+class _Fila:
+    def __init__(self, nome: str, exclusiva: bool):
+        self.nome = nome
+        self.exclusiva = exclusiva
+        self.mensagens: deque = deque()
+        self.consumidores: List[_Consumidor] = []
+        self._proximo = 0
+
+    def escolher_consumidor(self) -> Optional[_Consumidor]:
+        # Round-robin entre os consumidores com espaço no prefetch
+        for _ in range(len(self.consumidores)):
+            consumidor = self.consumidores[self._proximo % len(self.consumidores)]
+            self._proximo += 1
+            if consumidor.disponivel():
+                return consumidor
+        return None
+
+class BrokerLocal:
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._filas: Dict[str, _Fila] = {}
+        self._ligacoes: List[tuple] = []  # (exchange, padrao, nome_fila)
+        self._nomes = itertools.count(1)
+        self.publicadas = 0
+
+    def declarar_fila(self, nome: str, exclusiva: bool) -> str:
+        with self._lock:
+            if not nome:
+                nome = f"amq.gen-{next(self._nomes)}"
+            if nome not in self._filas:
+                self._filas[nome] = _Fila(nome, exclusiva)
+            return nome
+
+    def ligar(self, exchange: str, fila: str, padrao: str):
+        with self._lock:
+            ligacao = (exchange, padrao, fila)
+            if ligacao not in self._ligacoes:
+                self._ligacoes.append(ligacao)
+
+    def consumidores(self, routing_key: str) -> int:
+        # Filas com consumidor que recebem esta chave na exchange topic
+        with self._lock:
+            return sum(
+                1 for exchange, padrao, fila in self._ligacoes
+                if exchange and topico_confere(padrao, routing_key) and self._filas[fila].consumidores
+            )
+
+    def publicar(self, exchange: str, routing_key: str, corpo: bytes, propriedades):
+        with self._lock:
+            self.publicadas += 1
+            if exchange == '':
+                destinos = [routing_key] if routing_key in self._filas else []
+            else:
+                destinos = {
+                    fila for ex, padrao, fila in self._ligacoes
+                    if ex == exchange and topico_confere(padrao, routing_key)
+                }
+            for nome in destinos:
+                fila = self._filas[nome]
+                fila.mensagens.append(_Entrega(routing_key, corpo, propriedades))
+                self._despachar(fila)
+
+    def consumir(self, fila: str, consumidor: _Consumidor):
+        with self._lock:
+            self._filas[fila].consumidores.append(consumidor)
+            self._despachar(self._filas[fila])
+
+    def remover_canal(self, canal: "BlockingChannel"):
+        # Conexão fechada: filas exclusivas somem e as mensagens sem ack voltam para a fila
+        with self._lock:
+            for nome, fila in list(self._filas.items()):
+                fila.consumidores = [c for c in fila.consumidores if c.canal is not canal]
+                if fila.exclusiva and not fila.consumidores:
+                    del self._filas[nome]
+                    self._ligacoes = [l for l in self._ligacoes if l[2] != nome]
+            for nome_fila, entrega in canal.sem_ack.values():
+                if nome_fila in self._filas:
+                    entrega.reentregue = True
+                    self._filas[nome_fila].mensagens.appendleft(entrega)
+                    self._despachar(self._filas[nome_fila])
+            canal.sem_ack.clear()
+
+    def confirmar(self, canal: "BlockingChannel", delivery_tag: int, multiple: bool, requeue: Optional[bool]):
+        # requeue None: ack; True/False: nack
+        with self._lock:
+            tags = [t for t in canal.sem_ack if t <= delivery_tag] if multiple else [delivery_tag]
+            for tag in tags:
+                item = canal.sem_ack.pop(tag, None)
+                if item is None:
+                    continue
+                nome_fila, entrega = item
+                if requeue and nome_fila in self._filas:
+                    entrega.reentregue = True
+                    self._filas[nome_fila].mensagens.appendleft(entrega)
+            # O prefetch é do canal: a vaga aberta pode ser de qualquer fila que ele consome
+            for fila in self._filas.values():
+                if any(c.canal is canal for c in fila.consumidores):
+                    self._despachar(fila)
+
+    def _despachar(self, fila: _Fila):
+        while fila.mensagens:
+            consumidor = fila.escolher_consumidor()
+            if consumidor is None:
+                return
+            entrega = fila.mensagens.popleft()
+            consumidor.canal.entregar(fila.nome, consumidor, entrega)
+
+broker_padrao = BrokerLocal()
+
+###################################################################
+# Conexão bloqueante (consumidores)
+
+class BlockingChannel:
+    def __init__(self, conexao: "BlockingConnection"):
+        self.connection = conexao
+        self.prefetch = 0
+        self.sem_ack: Dict[int, tuple] = {}  # delivery_tag -> (fila, entrega)
+        self._tags = itertools.count(1)
+        self.is_open = True
+
+    def exchange_declare(self, exchange: str, exchange_type: str = 'direct', **kwargs):
+        pass
+
+    def queue_declare(self, queue: str = '', exclusive: bool = False, durable: bool = False, **kwargs):
+        return _Resultado(self.connection.broker.declarar_fila(queue, exclusive))
+
+    def queue_bind(self, exchange: str, queue: str, routing_key: str, **kwargs):
+        self.connection.broker.ligar(exchange, queue, routing_key)
+
+    def basic_qos(self, prefetch_count: int = 0, **kwargs):
+        self.prefetch = prefetch_count
+
+    def basic_consume(self, queue: str, on_message_callback: Callable, auto_ack: bool = False, **kwargs):
+        self.connection.broker.consumir(queue, _Consumidor(self, on_message_callback, auto_ack))
+
+    def basic_ack(self, delivery_tag: int = 0, multiple: bool = False):
+        self.connection.broker.confirmar(self, delivery_tag, multiple, None)
+
+    def basic_nack(self, delivery_tag: int = 0, multiple: bool = False, requeue: bool = True):
+        self.connection.broker.confirmar(self, delivery_tag, multiple, requeue)
+
+    def basic_publish(self, exchange: str, routing_key: str, body, properties=None, **kwargs):
+        corpo = body.encode() if isinstance(body, str) else body
+        self.connection.broker.publicar(exchange, routing_key, corpo, properties or BasicProperties())
+
+    def entregar(self, fila: str, consumidor: _Consumidor, entrega: _Entrega):
+        # Chamado pelo broker com o lock tomado; a callback roda na thread do consumidor
+        tag = next(self._tags)
+        if not consumidor.auto_ack:
+            self.sem_ack[tag] = (fila, entrega)
+        metodo = _Metodo(delivery_tag=tag, routing_key=entrega.routing_key,
+                         redelivered=entrega.reentregue, exchange='')
+        self.connection.add_callback_threadsafe(
+            lambda: consumidor.callback(self, metodo, entrega.propriedades, entrega.corpo))
+
+    def start_consuming(self):
+        self.connection.executar()
+
+    def stop_consuming(self):
+        self.connection.add_callback_threadsafe(self.connection.parar)
+
+    def close(self):
+        self.connection.close()
+
+class BlockingConnection:
+    def __init__(self, parameters: Optional[ConnectionParameters] = None, broker: Optional[BrokerLocal] = None):
+        self.broker = broker or broker_padrao
+        self._tarefas: queue.Queue = queue.Queue()
+        self._canais: List[BlockingChannel] = []
+        self._parando = False
+        self.is_open = True
+        self.is_closed = False
+
+    def channel(self) -> BlockingChannel:
+        canal = BlockingChannel(self)
+        self._canais.append(canal)
+        return canal
+
+    def add_callback_threadsafe(self, callback: Callable[[], None]):
+        self._tarefas.put(callback)
+
+    def process_data_events(self, time_limit: float = 0):
+        try:
+            while True:
+                self._tarefas.get(timeout=time_limit)()
+                time_limit = 0
+        except queue.Empty:
+            pass
+
+    def executar(self):
+        while not self._parando:
+            self._tarefas.get()()
+
+    def parar(self):
+        self._parando = True
+
+    def close(self):
+        self._parando = True
+        self.is_open = False
+        self.is_closed = True
+        for canal in self._canais:
+            canal.is_open = False
+            self.broker.remover_canal(canal)
+        self._tarefas.put(lambda: None)
+
+###################################################################
+# Conexão assíncrona (publicador com confirmações)
+
+class _IOLoop:
+    def __init__(self):
+        self._tarefas: queue.Queue = queue.Queue()
+        self._parando = False
+
+    def add_callback_threadsafe(self, callback: Callable[[], None]):
+        self._tarefas.put(callback)
+
+    def call_later(self, atraso: float, callback: Callable[[], None]):
+        threading.Timer(atraso, self.add_callback_threadsafe, args=(callback,)).start()
+
+    def start(self):
+        self._parando = False
+        while not self._parando:
+            self._tarefas.get()()
+
+    def stop(self):
+        self._parando = True
+        self._tarefas.put(lambda: None)
+
+class _CanalAssincrono:
+    def __init__(self, conexao: "SelectConnection"):
+        self._conexao = conexao
+        self._confirmacao: Optional[Callable] = None
+        self._tags = itertools.count(1)
+        self._ao_fechar: List[Callable] = []
+        self.is_open = True
+
+    def add_on_close_callback(self, callback: Callable):
+        self._ao_fechar.append(callback)
+
+    def exchange_declare(self, exchange: str, exchange_type: str = 'direct', callback: Optional[Callable] = None, **kwargs):
+        if callback is not None:
+            self._conexao.ioloop.add_callback_threadsafe(lambda: callback(_Frame(_Metodo())))
+
+    def confirm_delivery(self, ack_nack_callback: Callable):
+        self._confirmacao = ack_nack_callback
+
+    def basic_publish(self, exchange: str, routing_key: str, body, properties=None, **kwargs):
+        corpo = body.encode() if isinstance(body, str) else body
+        self._conexao.broker.publicar(exchange, routing_key, corpo, properties or BasicProperties())
+        if self._confirmacao is not None:
+            tag = next(self._tags)
+            callback = self._confirmacao
+            self._conexao.ioloop.add_callback_threadsafe(lambda: callback(_Frame(spec.Basic.Ack(tag))))
+
+class SelectConnection:
+    def __init__(self, parameters: Optional[ConnectionParameters] = None, on_open_callback: Optional[Callable] = None,
+                 on_open_error_callback: Optional[Callable] = None, on_close_callback: Optional[Callable] = None,
+                 broker: Optional[BrokerLocal] = None):
+        self.broker = broker or broker_padrao
+        self.ioloop = _IOLoop()
+        self._ao_fechar = on_close_callback
+        self._canais: List[_CanalAssincrono] = []
+        self.is_closing = False
+        self.is_closed = False
+        if on_open_callback is not None:
+            self.ioloop.add_callback_threadsafe(lambda: on_open_callback(self))
+
+    def channel(self, on_open_callback: Optional[Callable] = None):
+        canal = _CanalAssincrono(self)
+        self._canais.append(canal)
+        if on_open_callback is not None:
+            self.ioloop.add_callback_threadsafe(lambda: on_open_callback(canal))
+        return canal
+
+    def close(self):
+        self.is_closing = True
+
+        def fechar():
+            for canal in self._canais:
+                canal.is_open = False
+            self.is_closing = False
+            self.is_closed = True
+            if self._ao_fechar is not None:
+                self._ao_fechar(self, "Conexão fechada")
+            else:
+                self.ioloop.stop()
+
+        self.ioloop.add_callback_threadsafe(fechar)
@@ -0,0 +1,74 @@
+# Compara o JSON original (dict serializado + validação com all(key in ...)) com o
+# codec de eventos em JSON e em msgpack: tempo de codificação, de decodificação e
+# tamanho do corpo.
+#
+# Uso (a partir de backend/):
+#   python -m benchmarks.bench_codec --repeticoes 200000
+
+import argparse
+import json
+import timeit
+
+from comum import codec
+from comum.codec import EventoPedido, FORMATO_JSON, FORMATO_MSGPACK, codificar, decodificar
+
+CAMPOS_OBRIGATORIOS = ["id", "client_id", "product_id", "product_name", "quantity", "status"]
+
+EVENTO = {
+    "id": 123456789012345,
+    "client_id": 42,
+    "product_id": 7,
+    "product_name": "Produto A",
+    "quantity": 3,
+    "status": "pendente",
+}
+
+###################################################################
+
+def codificar_original(evento):
+    return json.dumps(evento).encode()
+
+def decodificar_original(corpo):
+    pedido = json.loads(corpo)
+    if not all(key in pedido for key in CAMPOS_OBRIGATORIOS):
+        raise ValueError("Formato de pedido inválido")
+    return pedido
+
+def medir(nome, codificar_fn, decodificar_fn, repeticoes):
+    corpo = codificar_fn()
+    decodificar_fn(corpo)
+    tempo_codificacao = min(timeit.repeat(codificar_fn, number=repeticoes, repeat=3)) / repeticoes
+    tempo_decodificacao = min(timeit.repeat(lambda: decodificar_fn(corpo), number=repeticoes, repeat=3)) / repeticoes
+    resultado = {
+        "bytes": len(corpo),
+        "codificacao_us": round(tempo_codificacao * 1e6, 3),
+        "decodificacao_us": round(tempo_decodificacao * 1e6, 3),
+    }
+    print(f"{nome}: {resultado['bytes']} bytes, codificação {resultado['codificacao_us']} µs, "
+          f"decodificação {resultado['decodificacao_us']} µs")
+    return resultado
+
+###################################################################
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do codec de eventos")
+    parser.add_argument("--repeticoes", type=int, default=200000)
+    args = parser.parse_args()
+
+    evento = EventoPedido.de_dict(EVENTO)
+    casos = [
+        ("json_original", lambda: codificar_original(EVENTO), decodificar_original),
+        ("codec_json", lambda: codificar(evento, FORMATO_JSON)[0],
+         lambda corpo: decodificar(corpo, codec.CONTENT_TYPE_JSON)),
+    ]
+    if codec.msgpack is not None:
+        casos.append(("codec_msgpack", lambda: codificar(evento, FORMATO_MSGPACK)[0],
+                      lambda corpo: decodificar(corpo, codec.CONTENT_TYPE_MSGPACK)))
+    else:
+        print("msgpack não instalado; medindo apenas os formatos JSON.")
+
+    resultados = {nome: medir(nome, cod, dec, args.repeticoes) for nome, cod, dec in casos}
+    print(json.dumps(resultados, indent=4))
+
+if __name__ == "__main__":
+    main()
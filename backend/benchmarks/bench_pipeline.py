@@ -0,0 +1,344 @@
+# Benchmark ponta a ponta do fluxo de pedidos: POST /pedidos -> estoque (reserva) ->
+# pagamento (sistemapgto) -> entrega -> pedidos.enviados.
+#
+# Os seis serviços sobem num único processo (uvicorn em threads). Com --transporte amqp_local
+# (padrão) eles usam o backend RabbitMQ ligado ao broker em processo de benchmarks/amqp_local.py,
+# instalado como `pika` antes dos imports; com --transporte memoria usam o barramento asyncio
+# de comum/transporte.py, sem nenhuma camada AMQP.
+# As decisões do sistemapgto usam uma semente fixa, então duas execuções com os mesmos
+# parâmetros têm a mesma sequência de aprovações e recusas. A carga é de laço aberto: os pedidos
+# saem nos instantes agendados pela taxa, e as latências contam a partir do agendamento.
+#
+# Requer fastapi, uvicorn e httpx (não precisa de RabbitMQ). Uso (a partir de backend/):
+#   python -m benchmarks.bench_pipeline --taxas 50 100 200 --duracao 10 --saida base.json
+#   python -m benchmarks.bench_pipeline --taxas 50 100 200 --duracao 10 --comparar base.json
+
+import argparse
+import asyncio
+import contextlib
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+DIRETORIO_BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+SERVICOS = ["principal", "estoque", "pagamento", "entrega", "notificacao", "sistemapgto"]
+MODULOS = {
+    "principal": "api",
+    "estoque": "estoque",
+    "pagamento": "pagamento",
+    "entrega": "entrega",
+    "notificacao": "notificacao",
+    "sistemapgto": "sistemapgto",
+}
+
+# Consumidores ligados a cada chave quando todos os serviços terminaram de subir
+CONSUMIDORES_ESPERADOS = {
+    "pedidos.criados": 2,
+    "estoque.reservas": 2,
+    "pagamentos.aprovados": 4,
+    "pagamentos.recusados": 3,
+    "pedidos.enviados": 2,
+}
+
+ETAPAS = ["http_post", "criacao_ate_reserva", "criacao_ate_pagamento", "pagamento_ate_envio", "ponta_a_ponta"]
+PERCENTIS = (50, 95, 99)
+
+###################################################################
+
+def preparar_ambiente(args, diretorio):
+    # Tudo precisa estar pronto antes de importar os serviços, que leem o ambiente na importação
+    if args.transporte == "memoria":
+        os.environ["TRANSPORTE_BACKEND"] = "memoria"
+        from comum.transporte import barramento_padrao as broker
+    else:
+        os.environ["TRANSPORTE_BACKEND"] = "rabbitmq"
+        from benchmarks import amqp_local
+        sys.modules["pika"] = amqp_local
+        broker = amqp_local.broker_padrao
+
+    os.chdir(diretorio)
+    produtos = [{"id": i, "name": f"Produto {i}", "stock": 10 ** 9} for i in range(1, args.produtos + 1)]
+    with open("estoque.json", "w") as file:
+        json.dump(produtos, file)
+
+    portas = {servico: args.porta_base + i for i, servico in enumerate(SERVICOS)}
+    os.environ.update({
+        "PAGAMENTO_ATRASO": str(args.atraso_pagamento),
+        "ENTREGA_ATRASO": str(args.atraso_entrega),
+        "SISTEMAPGTO_SEMENTE": str(args.semente),
+        "ESTOQUE_SERVICE_URL": f"http://127.0.0.1:{portas['estoque']}",
+        "NOTIFICACAO_SERVICE_URL": f"http://127.0.0.1:{portas['notificacao']}",
+        "ENTREGA_SERVICE_URL": f"http://127.0.0.1:{portas['entrega']}",
+        "PAGAMENTO_SERVICE_URL": f"http://127.0.0.1:{portas['pagamento']}",
+        "WEBHOOK_LOTE_URL": f"http://127.0.0.1:{portas['sistemapgto']}/webhook/pagamento/lote",
+    })
+
+    for servico in SERVICOS:
+        sys.path.insert(0, os.path.join(DIRETORIO_BACKEND, servico))
+    return broker, portas
+
+def subir_servicos(portas):
+    import importlib
+    import uvicorn
+
+    class Servidor(uvicorn.Server):
+        # Roda fora da thread principal; os sinais ficam com o benchmark
+        def install_signal_handlers(self):
+            pass
+
+    servidores = []
+    for servico in SERVICOS:
+        app = importlib.import_module(MODULOS[servico]).app
+        servidor = Servidor(uvicorn.Config(app, host="127.0.0.1", port=portas[servico], log_level="warning"))
+        thread = threading.Thread(target=servidor.run, name=f"uvicorn-{servico}", daemon=True)
+        thread.start()
+        servidores.append((servidor, thread))
+    return servidores
+
+def aguardar(condicao, timeout, descricao):
+    limite = time.monotonic() + timeout
+    while not condicao():
+        if time.monotonic() > limite:
+            raise RuntimeError(f"Tempo esgotado aguardando {descricao}")
+        time.sleep(0.05)
+
+def derrubar_servicos(servidores):
+    for servidor, _ in servidores:
+        servidor.should_exit = True
+    for _, thread in servidores:
+        thread.join(10)
+
+###################################################################
+
+class Coletor:
+    # Instante em que cada evento de cada pedido chegou a um consumidor ligado a '#'
+    # (o primeiro, se repetido); a medição é a mesma nos dois transportes
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.eventos = {}  # id do pedido -> {routing_key: instante}
+
+    def registrar(self, mensagem):
+        from comum.codec import decodificar_mensagem
+        agora = time.perf_counter()
+        try:
+            pedido_id = decodificar_mensagem(mensagem.propriedades, mensagem.corpo).id
+        except ValueError:
+            return
+        with self._lock:
+            self.eventos.setdefault(pedido_id, {}).setdefault(mensagem.routing_key, agora)
+
+    def instantes(self, pedido_id):
+        with self._lock:
+            return dict(self.eventos.get(pedido_id, {}))
+
+    def concluido(self, pedido_id):
+        instantes = self.instantes(pedido_id)
+        return "pedidos.enviados" in instantes or "pagamentos.recusados" in instantes
+
+def percentil(valores, p):
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    # Posição mais próxima (nearest rank)
+    indice = max(0, math.ceil(p / 100 * len(ordenados)) - 1)
+    return ordenados[indice]
+
+def resumir(valores):
+    resumo = {"n": len(valores)}
+    for p in PERCENTIS:
+        valor = percentil(valores, p)
+        resumo[f"p{p}"] = round(valor * 1000, 3) if valor is not None else None
+    resumo["media"] = round(sum(valores) / len(valores) * 1000, 3) if valores else None
+    return resumo
+
+###################################################################
+
+async def gerar_carga(url, taxa, duracao, produtos, gerador):
+    import httpx
+
+    total = int(taxa * duracao)
+    pedidos = []  # (agendado, resposta, id ou None)
+
+    async def enviar(cliente, agendado, corpo):
+        try:
+            resposta = await cliente.post(url, json=corpo)
+            pedido_id = resposta.json()["id"] if resposta.status_code == 200 else None
+        except (httpx.HTTPError, ValueError, KeyError):
+            pedido_id = None
+        pedidos.append((agendado, time.perf_counter(), pedido_id))
+
+    limites = httpx.Limits(max_connections=max(100, int(taxa)), max_keepalive_connections=max(100, int(taxa)))
+    async with httpx.AsyncClient(timeout=30, limits=limites) as cliente:
+        inicio = time.perf_counter()
+        tarefas = []
+        for i in range(total):
+            agendado = inicio + i / taxa
+            espera = agendado - time.perf_counter()
+            if espera > 0:
+                await asyncio.sleep(espera)
+            produto = gerador.randint(1, produtos)
+            corpo = {
+                "id": 0,
+                "client_id": gerador.randint(1, 1000),
+                "product_id": produto,
+                "product_name": f"Produto {produto}",
+                "quantity": 1,
+                "status": "pendente",
+            }
+            tarefas.append(asyncio.ensure_future(enviar(cliente, agendado, corpo)))
+        await asyncio.gather(*tarefas)
+    return pedidos
+
+def medir_taxa(args, portas, coletor, taxa, gerador):
+    url = f"http://127.0.0.1:{portas['principal']}/pedidos"
+    inicio = time.perf_counter()
+    pedidos = asyncio.run(gerar_carga(url, taxa, args.duracao, args.produtos, gerador))
+    aceitos = [p for p in pedidos if p[2] is not None]
+
+    limite = time.monotonic() + args.espera_final
+    while time.monotonic() < limite and not all(coletor.concluido(p[2]) for p in aceitos):
+        time.sleep(0.05)
+
+    latencias = {etapa: [] for etapa in ETAPAS}
+    aprovados = recusados = 0
+    fim = inicio
+    for agendado, respondido, pedido_id in pedidos:
+        latencias["http_post"].append(respondido - agendado)
+        if pedido_id is None:
+            continue
+        t = coletor.instantes(pedido_id)
+        criado = t.get("pedidos.criados")
+        pagamento = t.get("pagamentos.aprovados", t.get("pagamentos.recusados"))
+        if criado is not None and "estoque.reservas" in t:
+            latencias["criacao_ate_reserva"].append(t["estoque.reservas"] - criado)
+        if criado is not None and pagamento is not None:
+            latencias["criacao_ate_pagamento"].append(pagamento - criado)
+        if "pagamentos.aprovados" in t and "pedidos.enviados" in t:
+            latencias["pagamento_ate_envio"].append(t["pedidos.enviados"] - t["pagamentos.aprovados"])
+        if "pedidos.enviados" in t:
+            aprovados += 1
+            latencias["ponta_a_ponta"].append(t["pedidos.enviados"] - agendado)
+            fim = max(fim, t["pedidos.enviados"])
+        elif "pagamentos.recusados" in t:
+            recusados += 1
+            fim = max(fim, t["pagamentos.recusados"])
+
+    concluidos = aprovados + recusados
+    duracao_total = fim - inicio
+    return {
+        "taxa": taxa,
+        "enviados": len(pedidos),
+        "aceitos": len(aceitos),
+        "concluidos": concluidos,
+        "enviados_entrega": aprovados,
+        "recusados": recusados,
+        "pendentes": len(aceitos) - concluidos,
+        "vazao_pedidos_s": round(concluidos / duracao_total, 2) if duracao_total > 0 else 0.0,
+        "latencias_ms": {etapa: resumir(valores) for etapa, valores in latencias.items()},
+    }
+
+###################################################################
+
+def imprimir(resultado, terminal):
+    print(f"\nTaxa {resultado['taxa']}/s: {resultado['aceitos']}/{resultado['enviados']} aceitos, "
+          f"{resultado['concluidos']} concluídos ({resultado['enviados_entrega']} enviados, "
+          f"{resultado['recusados']} recusados, {resultado['pendentes']} pendentes), "
+          f"vazão {resultado['vazao_pedidos_s']} pedidos/s", file=terminal)
+    for etapa, resumo in resultado["latencias_ms"].items():
+        print(f"  {etapa:<22} n={resumo['n']:<6} p50={resumo['p50']} p95={resumo['p95']} p99={resumo['p99']} ms",
+              file=terminal)
+
+def comparar(atual, caminho_anterior, terminal):
+    with open(caminho_anterior, "r") as file:
+        anterior = {r["taxa"]: r for r in json.load(file)["resultados"]}
+
+    def variacao(novo, velho):
+        if novo is None or not velho:
+            return "n/d"
+        return f"{(novo - velho) / velho * 100:+.1f}%"
+
+    print(f"\nComparação com {caminho_anterior}:", file=terminal)
+    for resultado in atual:
+        base = anterior.get(resultado["taxa"])
+        if base is None:
+            print(f"  taxa {resultado['taxa']}/s ausente na execução anterior", file=terminal)
+            continue
+        linha = [f"vazão {variacao(resultado['vazao_pedidos_s'], base['vazao_pedidos_s'])}"]
+        for p in PERCENTIS:
+            chave = f"p{p}"
+            linha.append(f"{chave} {variacao(resultado['latencias_ms']['ponta_a_ponta'][chave], base['latencias_ms']['ponta_a_ponta'][chave])}")
+        print(f"  taxa {resultado['taxa']}/s ponta a ponta: " + ", ".join(linha), file=terminal)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ponta a ponta do fluxo de pedidos")
+    parser.add_argument("--taxas", type=float, nargs="+", default=[50, 100, 200], help="pedidos por segundo")
+    parser.add_argument("--duracao", type=float, default=10, help="segundos de carga por taxa")
+    parser.add_argument("--espera-final", type=float, default=30, help="segundos aguardando os pedidos em andamento")
+    parser.add_argument("--produtos", type=int, default=10)
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--atraso-pagamento", type=float, default=0)
+    parser.add_argument("--atraso-entrega", type=float, default=0)
+    parser.add_argument("--porta-base", type=int, default=18000)
+    parser.add_argument("--transporte", choices=["amqp_local", "memoria"], default="amqp_local")
+    parser.add_argument("--saida", help="grava os resultados em JSON neste arquivo")
+    parser.add_argument("--comparar", help="JSON de uma execução anterior para comparação")
+    parser.add_argument("--verbose", action="store_true", help="mostra os logs dos serviços")
+    args = parser.parse_args()
+
+    terminal = sys.stdout
+    saida = os.path.abspath(args.saida) if args.saida else None
+    anterior = os.path.abspath(args.comparar) if args.comparar else None
+    sys.path.insert(0, DIRETORIO_BACKEND)
+
+    with tempfile.TemporaryDirectory() as diretorio:
+        broker, portas = preparar_ambiente(args, diretorio)
+        from comum.transporte import obter_transporte
+        coletor = Coletor()
+        threading.Thread(target=obter_transporte().consumir, args=(["#"], coletor.registrar),
+                         kwargs={"auto_ack": True}, daemon=True).start()
+
+        logs = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+        with logs:
+            servidores = subir_servicos(portas)
+            try:
+                aguardar(lambda: all(s.started for s, _ in servidores), 30, "os serviços subirem")
+                # O coletor também está ligado a todas as chaves
+                aguardar(lambda: all(broker.consumidores(chave) >= n + 1 for chave, n in CONSUMIDORES_ESPERADOS.items()),
+                         30, "os consumidores se ligarem ao broker")
+
+                gerador = random.Random(args.semente)
+                resultados = []
+                for taxa in args.taxas:
+                    resultado = medir_taxa(args, portas, coletor, taxa, gerador)
+                    imprimir(resultado, terminal)
+                    resultados.append(resultado)
+            finally:
+                derrubar_servicos(servidores)
+
+    relatorio = {
+        "parametros": {
+            "taxas": args.taxas,
+            "duracao": args.duracao,
+            "produtos": args.produtos,
+            "semente": args.semente,
+            "atraso_pagamento": args.atraso_pagamento,
+            "atraso_entrega": args.atraso_entrega,
+            "transporte": args.transporte,
+        },
+        "resultados": resultados,
+    }
+    if saida:
+        with open(saida, "w") as file:
+            json.dump(relatorio, file, indent=4)
+        print(f"\nResultados gravados em {saida}", file=terminal)
+    if anterior:
+        comparar(resultados, anterior, terminal)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# Compara a vazão de publicação do publicador compartilhado com a abordagem antiga
+# (uma BlockingConnection nova por evento).
+#
+# Uso (a partir de backend/, com um RabbitMQ acessível):
+#   python -m benchmarks.bench_publicador --host localhost --mensagens 2000 --threads 8
+
+import argparse
+import json
+import threading
+import time
+
+import pika  # type: ignore
+
+from comum.publicador import CREDENTIALS, EXCHANGE_PADRAO, PublicadorEventos
+
+ROUTING_KEY = 'benchmark.publicador'
+
+EVENTO = {
+    "id": 1,
+    "client_id": 1,
+    "product_id": 1,
+    "product_name": "Produto A",
+    "quantity": 1,
+    "status": "criado",
+}
+
+###################################################################
+
+def enviar_evento_por_conexao(host, evento, routing_key):
+    # Reprodução do enviar_evento original dos serviços
+    connection = pika.BlockingConnection(pika.ConnectionParameters(host=host, credentials=CREDENTIALS))
+    channel = connection.channel()
+    channel.exchange_declare(exchange=EXCHANGE_PADRAO, exchange_type='topic')
+    channel.basic_publish(exchange=EXCHANGE_PADRAO, routing_key=routing_key, body=json.dumps(evento))
+    connection.close()
+
+def executar_em_threads(funcao, mensagens, threads):
+    por_thread = mensagens // threads
+
+    def trabalho():
+        for _ in range(por_thread):
+            funcao()
+
+    workers = [threading.Thread(target=trabalho) for _ in range(threads)]
+    inicio = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return por_thread * threads, time.perf_counter() - inicio
+
+def medir_por_conexao(host, mensagens, threads):
+    return executar_em_threads(lambda: enviar_evento_por_conexao(host, EVENTO, ROUTING_KEY), mensagens, threads)
+
+def medir_publicador_sincrono(publicador, mensagens, threads):
+    # Cada chamada espera a confirmação do broker, como as rotas e callbacks fazem
+    return executar_em_threads(lambda: publicador.publicar(EVENTO, ROUTING_KEY), mensagens, threads)
+
+def medir_publicador_em_lote(publicador, mensagens):
+    inicio = time.perf_counter()
+    futuros = [publicador.publicar(EVENTO, ROUTING_KEY, aguardar=False) for _ in range(mensagens)]
+    for futuro in futuros:
+        futuro.result()
+    return mensagens, time.perf_counter() - inicio
+
+###################################################################
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de publicação no RabbitMQ")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--mensagens", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--conexoes", type=int, default=1)
+    args = parser.parse_args()
+
+    publicador = PublicadorEventos(host=args.host, conexoes=args.conexoes)
+    # Aquece a conexão para não medir o handshake inicial
+    publicador.publicar(EVENTO, ROUTING_KEY)
+
+    resultados = {}
+    for nome, medir in [
+        ("por_conexao", lambda: medir_por_conexao(args.host, args.mensagens, args.threads)),
+        ("publicador_sincrono", lambda: medir_publicador_sincrono(publicador, args.mensagens, args.threads)),
+        ("publicador_em_lote", lambda: medir_publicador_em_lote(publicador, args.mensagens)),
+    ]:
+        total, duracao = medir()
+        resultados[nome] = {
+            "mensagens": total,
+            "segundos": round(duracao, 4),
+            "mensagens_por_segundo": round(total / duracao, 1),
+        }
+        print(f"{nome}: {total} mensagens em {duracao:.3f}s ({total / duracao:.1f} msg/s)")
+
+    publicador.fechar()
+    print(json.dumps(resultados, indent=4))
+
+if __name__ == "__main__":
+    main()
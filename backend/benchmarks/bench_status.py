@@ -0,0 +1,104 @@
+# Compara a gravação das mudanças de status uma a uma (um commit por evento)
+# com o group commit do AgrupadorStatus, ambos com fsync a cada commit.
+#
+# Uso (a partir de backend/):
+#   python -m benchmarks.bench_status --eventos 5000 --threads 8 --janela 0.005
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "principal"))
+
+from agrupador_status import AgrupadorStatus  # noqa: E402
+from repositorio_pedidos import RepositorioPedidosSQLite  # noqa: E402
+
+###################################################################
+
+def evento(i):
+    return {
+        "id": i,
+        "client_id": i % 50,
+        "product_id": i % 10,
+        "product_name": f"Produto {i % 10}",
+        "quantity": 1,
+        "status": "aprovado",
+    }
+
+def executar_em_threads(funcao, eventos, threads):
+    por_thread = eventos // threads
+
+    def trabalho(t):
+        for k in range(por_thread):
+            funcao(t * por_thread + k)
+
+    workers = [threading.Thread(target=trabalho, args=(t,)) for t in range(threads)]
+    inicio = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return por_thread * threads, time.perf_counter() - inicio
+
+def medir_um_a_um(caminho, eventos, threads):
+    repositorio = RepositorioPedidosSQLite(caminho)
+
+    def gravar(i):
+        conexao = repositorio._conexao()
+        conexao.execute("PRAGMA synchronous=FULL")
+        repositorio.atualizar_status(evento(i), f"evento-{i}")
+
+    total, duracao = executar_em_threads(gravar, eventos, threads)
+    repositorio.fechar()
+    return total, duracao, total
+
+def medir_agrupado(caminho, eventos, threads, janela, max_lote):
+    repositorio = RepositorioPedidosSQLite(caminho)
+    agrupador = AgrupadorStatus(repositorio, janela=janela, max_lote=max_lote)
+    agrupador.iniciar()
+
+    # Cada "consumidor" espera o ack do seu evento, como o callback do principal
+    def gravar(i):
+        persistido = threading.Event()
+        agrupador.enviar(evento(i), f"evento-{i}", lambda atualizado, erro: persistido.set())
+        persistido.wait()
+
+    total, duracao = executar_em_threads(gravar, eventos, threads)
+    agrupador.parar()
+    repositorio.fechar()
+    return total, duracao, agrupador.lotes
+
+###################################################################
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do group commit de status")
+    parser.add_argument("--eventos", type=int, default=5000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--janela", type=float, default=0.005)
+    parser.add_argument("--max-lote", type=int, default=256)
+    args = parser.parse_args()
+
+    resultados = {}
+    with tempfile.TemporaryDirectory() as diretorio:
+        for nome, medir in [
+            ("um_a_um", lambda: medir_um_a_um(os.path.join(diretorio, "um_a_um.db"), args.eventos, args.threads)),
+            ("agrupado", lambda: medir_agrupado(os.path.join(diretorio, "agrupado.db"), args.eventos,
+                                                args.threads, args.janela, args.max_lote)),
+        ]:
+            total, duracao, commits = medir()
+            resultados[nome] = {
+                "eventos": total,
+                "commits": commits,
+                "segundos": round(duracao, 4),
+                "eventos_por_segundo": round(total / duracao, 1),
+            }
+            print(f"{nome}: {total} eventos em {commits} commits, {duracao:.3f}s ({total / duracao:.1f} eventos/s)")
+
+    print(json.dumps(resultados, indent=4))
+
+if __name__ == "__main__":
+    main()
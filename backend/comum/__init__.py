@@ -0,0 +1 @@
+# Código compartilhado entre os microsserviços (mensageria, persistência, etc.)
@@ -0,0 +1,63 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+###################################################################
+
+class CacheSingleFlight:
+    # Cache de um único valor com TTL. Enquanto uma busca está em andamento,
+    # as demais requisições aguardam o mesmo resultado em vez de repetir a busca.
+    # invalidar() pode ser chamado de qualquer thread; quem chega depois dela não
+    # aproveita uma busca iniciada antes, que pode ter lido o valor antigo.
+
+    def __init__(self, ttl: float):
+        self._ttl = ttl
+        self._valor: Any = None
+        self._expira_em = 0.0
+        self._geracao = 0
+        self._em_voo: Optional[asyncio.Future] = None
+        self._geracao_em_voo = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.coalescidas = 0
+
+    async def obter(self, carregar: Callable[[], Awaitable[Any]]) -> Any:
+        if time.monotonic() < self._expira_em:
+            self.hits += 1
+            return self._valor
+
+        self.misses += 1
+        geracao = self._geracao
+        if self._em_voo is None or self._geracao_em_voo != geracao:
+            self._em_voo = asyncio.ensure_future(self._carregar(carregar, geracao))
+            self._geracao_em_voo = geracao
+        else:
+            self.coalescidas += 1
+        # shield: o cancelamento de uma requisição não cancela a busca compartilhada
+        return await asyncio.shield(self._em_voo)
+
+    async def _carregar(self, carregar, geracao: int):
+        try:
+            valor = await carregar()
+            # Uma invalidação durante a busca impede que o valor antigo seja guardado
+            if geracao == self._geracao:
+                self._valor = valor
+                self._expira_em = time.monotonic() + self._ttl
+            return valor
+        finally:
+            # Uma busca mais nova pode já ter tomado o lugar desta
+            if self._geracao_em_voo == geracao:
+                self._em_voo = None
+
+    def invalidar(self):
+        self._geracao += 1
+        self._expira_em = 0.0
+
+    def estatisticas(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalescidas": self.coalescidas,
+            "ttl": self._ttl,
+        }
@@ -0,0 +1,136 @@
+import json
+import os
+from typing import Optional, Tuple, Union
+
+try:
+    import msgpack  # type: ignore
+except ImportError:
+    msgpack = None
+
+CONTENT_TYPE_JSON = 'application/json'
+CONTENT_TYPE_MSGPACK = 'application/x-msgpack'
+
+FORMATO_JSON = 'json'
+FORMATO_MSGPACK = 'msgpack'
+
+# Formato usado na publicação; o consumo aceita os dois, escolhido pelo content_type de cada mensagem
+EVENTOS_FORMATO = os.getenv("EVENTOS_FORMATO", FORMATO_JSON)
+if EVENTOS_FORMATO == FORMATO_MSGPACK and msgpack is None:
+    # Sem isto o serviço publicaria em outro formato que os containers, sem avisar
+    raise ImportError("EVENTOS_FORMATO=msgpack, mas o pacote msgpack não está instalado (pip install msgpack)")
+
+# Versão do esquema dos eventos de pedido. No msgpack os campos vão por posição
+# logo após a versão. Versões novas só acrescentam campos no final, então um
+# consumidor antigo lê os campos que conhece e ignora o resto.
+VERSAO_ESQUEMA = 1
+
+###################################################################
+
+class ErroCodec(ValueError):
+    pass
+
+class EventoPedido:
+    # Evento de pedido trocado entre os serviços (pedidos.*, pagamentos.*, estoque.reservas)
+    __slots__ = ("id", "client_id", "product_id", "product_name", "quantity", "status", "reserva")
+
+    CAMPOS = __slots__
+    OBRIGATORIOS = ("id", "client_id", "product_id", "product_name", "quantity")
+    INTEIROS = ("id", "client_id", "product_id", "quantity")
+
+    def __init__(self, id: int, client_id: int, product_id: int, product_name: str, quantity: int,
+                 status: Optional[str] = None, reserva: Optional[str] = None):
+        self.id = id
+        self.client_id = client_id
+        self.product_id = product_id
+        self.product_name = product_name
+        self.quantity = quantity
+        self.status = status
+        self.reserva = reserva
+
+    def __repr__(self):
+        campos = ", ".join(f"{campo}={getattr(self, campo)!r}" for campo in self.CAMPOS)
+        return f"EventoPedido({campos})"
+
+    def __eq__(self, outro):
+        return isinstance(outro, EventoPedido) and all(
+            getattr(self, campo) == getattr(outro, campo) for campo in self.CAMPOS)
+
+    def com_status(self, status: str) -> "EventoPedido":
+        return EventoPedido(self.id, self.client_id, self.product_id, self.product_name,
+                            self.quantity, status, self.reserva)
+
+    def para_dict(self) -> dict:
+        dados = {campo: getattr(self, campo) for campo in self.CAMPOS}
+        if self.reserva is None:
+            del dados["reserva"]
+        return dados
+
+    @classmethod
+    def de_dict(cls, dados: dict) -> "EventoPedido":
+        if not isinstance(dados, dict):
+            raise ErroCodec("Evento deve ser um objeto")
+        faltando = [campo for campo in cls.OBRIGATORIOS if campo not in dados]
+        if faltando:
+            raise ErroCodec(f"Campos ausentes no evento: {', '.join(faltando)}")
+        evento = cls(dados["id"], dados["client_id"], dados["product_id"], dados["product_name"],
+                     dados["quantity"], dados.get("status"), dados.get("reserva"))
+        evento._validar()
+        return evento
+
+    def _validar(self):
+        for campo in self.INTEIROS:
+            valor = getattr(self, campo)
+            if not isinstance(valor, int) or isinstance(valor, bool):
+                raise ErroCodec(f"Campo '{campo}' deve ser inteiro, recebido {valor!r}")
+
+###################################################################
+
+def _verificar_versao(versao):
+    if not isinstance(versao, int) or versao < 1:
+        raise ErroCodec(f"Versão de esquema inválida: {versao!r}")
+
+def codificar(evento: Union[dict, EventoPedido], formato: str = EVENTOS_FORMATO) -> Tuple[bytes, str]:
+    # Retorna o corpo e o content_type da mensagem
+    if not isinstance(evento, EventoPedido):
+        evento = EventoPedido.de_dict(evento)
+
+    if formato == FORMATO_MSGPACK:
+        if msgpack is None:
+            raise ErroCodec("Formato msgpack pedido, mas o pacote msgpack não está instalado")
+        corpo = msgpack.packb([VERSAO_ESQUEMA] + [getattr(evento, campo) for campo in EventoPedido.CAMPOS])
+        return corpo, CONTENT_TYPE_MSGPACK
+
+    dados = evento.para_dict()
+    dados["v"] = VERSAO_ESQUEMA
+    return json.dumps(dados).encode(), CONTENT_TYPE_JSON
+
+def decodificar(corpo: bytes, content_type: Optional[str] = CONTENT_TYPE_JSON) -> EventoPedido:
+    if content_type == CONTENT_TYPE_MSGPACK:
+        if msgpack is None:
+            raise ErroCodec("Mensagem em msgpack, mas o pacote msgpack não está instalado")
+        try:
+            valores = msgpack.unpackb(corpo)
+        except Exception as e:
+            raise ErroCodec(f"Erro ao decodificar msgpack: {e}")
+        if not isinstance(valores, list) or not valores:
+            raise ErroCodec("Evento msgpack deve ser uma lista")
+        versao, campos = valores[0], valores[1:]
+        _verificar_versao(versao)
+        if len(campos) < len(EventoPedido.CAMPOS):
+            raise ErroCodec(f"Evento com {len(campos)} campos, esperados {len(EventoPedido.CAMPOS)}")
+        evento = EventoPedido(*campos[:len(EventoPedido.CAMPOS)])
+        evento._validar()
+        return evento
+
+    # JSON é também o formato das mensagens sem content_type (publicadas antes do codec)
+    try:
+        dados = json.loads(corpo)
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        raise ErroCodec(f"Erro ao decodificar JSON: {e}")
+    if isinstance(dados, dict):
+        _verificar_versao(dados.get("v", VERSAO_ESQUEMA))
+    return EventoPedido.de_dict(dados)
+
+def decodificar_mensagem(properties, body: bytes) -> EventoPedido:
+    content_type = getattr(properties, "content_type", None) if properties is not None else None
+    return decodificar(body, content_type)
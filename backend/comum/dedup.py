@@ -0,0 +1,168 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+DEDUP_CAPACIDADE = int(os.getenv("DEDUP_CAPACIDADE", "100000"))
+DEDUP_TTL = float(os.getenv("DEDUP_TTL", "86400"))
+
+###################################################################
+
+class CacheIdempotencia:
+    # Ids de eventos já processados, limitados por quantidade (LRU) e por idade (TTL).
+    # A entrega é at-least-once; com este cache as reentregas são descartadas
+    # antes de qualquer I/O. snapshot()/carregar() permitem persistir junto com o estado.
+    # Um id pode guardar também o resultado do processamento, para a resposta ser
+    # reenviada quando o evento chega de novo.
+
+    def __init__(self, capacidade: int = DEDUP_CAPACIDADE, ttl: float = DEDUP_TTL):
+        self._capacidade = capacidade
+        self._ttl = ttl
+        self._ids: OrderedDict = OrderedDict()  # id -> registrado_em (epoch)
+        self._resultados: dict = {}  # id -> resultado, só para os ids registrados com um
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def contem(self, id_evento: Optional[str]) -> bool:
+        if id_evento is None:
+            return False
+        with self._lock:
+            registrado_em = self._ids.get(id_evento)
+            return registrado_em is not None and time.time() - registrado_em < self._ttl
+
+    def resultado(self, id_evento: Optional[str]):
+        if not self.contem(id_evento):
+            return None
+        with self._lock:
+            return self._resultados.get(id_evento)
+
+    def registrar(self, id_evento: Optional[str], resultado=None) -> bool:
+        # Retorna False se o id já estava registrado (evento repetido)
+        if id_evento is None:
+            return True
+        agora = time.time()
+        with self._lock:
+            registrado_em = self._ids.get(id_evento)
+            if registrado_em is not None and agora - registrado_em < self._ttl:
+                return False
+            self._ids[id_evento] = agora
+            self._ids.move_to_end(id_evento)
+            if resultado is not None:
+                self._resultados[id_evento] = resultado
+            self._expurgar(agora)
+            return True
+
+    def guardar_resultado(self, id_evento: Optional[str], resultado):
+        # Para o resultado que só é conhecido depois de o id ter sido registrado
+        if id_evento is None:
+            return
+        with self._lock:
+            if id_evento in self._ids:
+                self._resultados[id_evento] = resultado
+
+    def esquecer(self, id_evento: Optional[str]):
+        # Desfaz o registro quando o processamento falhou e o evento deve ser reprocessado
+        if id_evento is None:
+            return
+        with self._lock:
+            self._ids.pop(id_evento, None)
+            self._resultados.pop(id_evento, None)
+
+    def snapshot(self) -> List[list]:
+        with self._lock:
+            return [[id_evento, registrado_em] + ([self._resultados[id_evento]] if id_evento in self._resultados else [])
+                    for id_evento, registrado_em in self._ids.items()]
+
+    def carregar(self, itens: List[list]):
+        agora = time.time()
+        with self._lock:
+            # Cada item é [id, registrado_em] ou [id, registrado_em, resultado]
+            for item in sorted(itens, key=lambda item: item[1]):
+                id_evento, registrado_em = item[0], item[1]
+                if agora - registrado_em < self._ttl:
+                    self._ids[id_evento] = registrado_em
+                    self._ids.move_to_end(id_evento)
+                    if len(item) > 2:
+                        self._resultados[id_evento] = item[2]
+            self._expurgar(agora)
+
+    def _expurgar(self, agora: float):
+        while len(self._ids) > self._capacidade:
+            id_evento, _ = self._ids.popitem(last=False)
+            self._resultados.pop(id_evento, None)
+        while self._ids:
+            id_evento, registrado_em = next(iter(self._ids.items()))
+            if agora - registrado_em < self._ttl:
+                break
+            self._ids.popitem(last=False)
+            self._resultados.pop(id_evento, None)
+
+class LogIdempotencia:
+    # Ids de eventos processados num arquivo JSON lines só de acréscimo. Persiste um
+    # CacheIdempotencia grande sem regravar o conjunto inteiro a cada mudança: cada gravação
+    # custa só as linhas novas. Quando o arquivo passa do dobro da capacidade ele é
+    # reescrito com os ids mais recentes ainda dentro do TTL.
+
+    def __init__(self, caminho: str, capacidade: int = DEDUP_CAPACIDADE, ttl: float = DEDUP_TTL):
+        self._caminho = caminho
+        self._capacidade = capacidade
+        self._ttl = ttl
+        self._arquivo = None
+        self._linhas = 0
+        self._lock = threading.Lock()
+
+    def carregar(self) -> List[list]:
+        itens = []
+        if not os.path.exists(self._caminho):
+            return itens
+        with open(self._caminho, 'r') as file:
+            for linha in file:
+                try:
+                    itens.append(json.loads(linha))
+                except json.JSONDecodeError:
+                    # Última linha cortada por um crash no meio da escrita
+                    continue
+        self._linhas = len(itens)
+        return itens
+
+    def anexar(self, itens: List[list]):
+        if not itens:
+            return
+        with self._lock:
+            if self._arquivo is None:
+                self._arquivo = open(self._caminho, 'a')
+            self._arquivo.write("".join(json.dumps(item) + "\n" for item in itens))
+            self._arquivo.flush()
+            os.fsync(self._arquivo.fileno())
+            self._linhas += len(itens)
+            if self._linhas > 2 * self._capacidade:
+                self._compactar()
+
+    def fechar(self):
+        with self._lock:
+            if self._arquivo is not None:
+                self._arquivo.close()
+                self._arquivo = None
+
+    def _compactar(self):
+        from comum.persistencia import gravar_atomico
+
+        self._arquivo.close()
+        self._arquivo = None
+        agora = time.time()
+        recentes: OrderedDict = OrderedDict()
+        for item in self.carregar():
+            if agora - item[1] < self._ttl:
+                recentes[item[0]] = item
+                recentes.move_to_end(item[0])
+        itens = list(recentes.values())[-self._capacidade:]
+        gravar_atomico(self._caminho, lambda file: file.writelines(json.dumps(item) + "\n" for item in itens))
+        self._linhas = len(itens)
+
+def id_do_evento(properties) -> Optional[str]:
+    # Id único atribuído pelo publicador (propriedade AMQP message_id)
+    return getattr(properties, "message_id", None) if properties is not None else None
@@ -0,0 +1,29 @@
+import hashlib
+import os
+import time
+from typing import Optional
+
+# Distingue versões de processos diferentes: os contadores recomeçam do zero a cada início
+INSTANCIA = f"{os.getpid():x}{int(time.time() * 1000):x}"
+
+###################################################################
+
+def gerar_etag(recurso: str, versao: int, consulta: Optional[str] = None) -> str:
+    # Com `consulta` (filtros, cursor, limite...), cada consulta do recurso tem o seu ETag
+    if consulta is not None:
+        recurso = f"{recurso}-{hashlib.sha1(consulta.encode()).hexdigest()[:16]}"
+    return f'"{recurso}-{INSTANCIA}-{versao}"'
+
+def etag_confere(if_none_match: Optional[str], etag: str) -> bool:
+    # If-None-Match pode trazer "*", uma lista separada por vírgulas e ETags fracas (W/)
+    if not if_none_match:
+        return False
+    for candidata in if_none_match.split(","):
+        candidata = candidata.strip()
+        if candidata == "*":
+            return True
+        if candidata.startswith("W/"):
+            candidata = candidata[2:]
+        if candidata == etag:
+            return True
+    return False
@@ -0,0 +1,51 @@
+import os
+import threading
+import time
+
+# Ids no estilo snowflake limitados a 53 bits para continuarem exatos em JavaScript:
+# | 41 bits: ms desde EPOCA_IDS | 5 bits: worker | 7 bits: sequência no mesmo ms |
+EPOCA_IDS = 1704067200000  # 2024-01-01T00:00:00Z em ms
+BITS_WORKER = 5
+BITS_SEQUENCIA = 7
+MAX_WORKER = (1 << BITS_WORKER) - 1
+MAX_SEQUENCIA = (1 << BITS_SEQUENCIA) - 1
+
+# Cada réplica precisa de um ID_WORKER diferente (0 a 31)
+ID_WORKER = int(os.getenv("ID_WORKER", "0"))
+
+###################################################################
+
+class GeradorIds:
+    # Não consulta nenhum estado persistido: a unicidade vem do relógio + worker + sequência.
+    # Se o relógio voltar ou a sequência do ms esgotar, o gerador avança o ms lógico
+    # em vez de esperar, então os ids nunca se repetem nem diminuem dentro do processo.
+
+    def __init__(self, worker_id: int = ID_WORKER):
+        if not 0 <= worker_id <= MAX_WORKER:
+            raise ValueError(f"worker_id deve estar entre 0 e {MAX_WORKER}")
+        self._worker_id = worker_id
+        self._ultimo_ms = -1
+        self._sequencia = 0
+        self._lock = threading.Lock()
+
+    def proximo(self) -> int:
+        with self._lock:
+            agora = int(time.time() * 1000) - EPOCA_IDS
+            if agora > self._ultimo_ms:
+                self._ultimo_ms = agora
+                self._sequencia = 0
+            else:
+                self._sequencia += 1
+                if self._sequencia > MAX_SEQUENCIA:
+                    self._ultimo_ms += 1
+                    self._sequencia = 0
+
+            return (self._ultimo_ms << (BITS_WORKER + BITS_SEQUENCIA)) | (self._worker_id << BITS_SEQUENCIA) | self._sequencia
+
+def timestamp_do_id(id_gerado: int) -> float:
+    # Segundos desde a época Unix em que o id foi gerado
+    return ((id_gerado >> (BITS_WORKER + BITS_SEQUENCIA)) + EPOCA_IDS) / 1000
+
+def menor_id_desde(timestamp: float) -> int:
+    # Menor id possível gerado a partir do instante informado (para filtros por intervalo)
+    return max(0, int(timestamp * 1000) - EPOCA_IDS) << (BITS_WORKER + BITS_SEQUENCIA)
@@ -0,0 +1,303 @@
+import bisect
+import functools
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Limites (em segundos) dos histogramas de duração
+BUCKETS_PADRAO = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE_METRICAS = "text/plain; version=0.0.4; charset=utf-8"
+
+# Rótulo das requisições que não casaram com nenhuma rota (evita um valor por URL)
+ROTA_DESCONHECIDA = "desconhecida"
+
+###################################################################
+
+def _escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _formatar_rotulos(nomes: Tuple[str, ...], valores: Tuple, extra: str = "") -> str:
+    pares = [f'{nome}="{_escapar(valor)}"' for nome, valor in zip(nomes, valores)]
+    if extra:
+        pares.append(extra)
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+def _formatar_numero(valor: float) -> str:
+    if valor == float("inf"):
+        return "+Inf"
+    if isinstance(valor, int) or float(valor).is_integer():
+        return str(int(valor))
+    return repr(float(valor))
+
+class _ValorContador:
+    __slots__ = ("valor", "_lock")
+
+    def __init__(self):
+        self.valor = 0
+        self._lock = threading.Lock()
+
+    def incrementar(self, quantidade: float = 1):
+        with self._lock:
+            self.valor += quantidade
+
+class _ValorMedidor(_ValorContador):
+    __slots__ = ()
+
+    def definir(self, valor: float):
+        self.valor = valor
+
+    def decrementar(self, quantidade: float = 1):
+        self.incrementar(-quantidade)
+
+class _Cronometro:
+    # Context manager sem gerador: é usado nos caminhos quentes
+    __slots__ = ("_valor", "_inicio")
+
+    def __init__(self, valor: "_ValorHistograma"):
+        self._valor = valor
+
+    def __enter__(self):
+        self._inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        self._valor.observar(time.perf_counter() - self._inicio)
+        return False
+
+class _ValorHistograma:
+    __slots__ = ("_limites", "_contagens", "soma", "total", "_lock")
+
+    def __init__(self, limites: Tuple[float, ...]):
+        self._limites = limites
+        self._contagens = [0] * (len(limites) + 1)  # o último é o +Inf
+        self.soma = 0.0
+        self.total = 0
+        self._lock = threading.Lock()
+
+    def observar(self, valor: float):
+        indice = bisect.bisect_left(self._limites, valor)
+        with self._lock:
+            self._contagens[indice] += 1
+            self.soma += valor
+            self.total += 1
+
+    def cronometrar(self) -> _Cronometro:
+        return _Cronometro(self)
+
+    def acumulados(self) -> List[Tuple[float, int]]:
+        with self._lock:
+            contagens = list(self._contagens)
+        acumulado, linhas = 0, []
+        for limite, contagem in zip(self._limites + (float("inf"),), contagens):
+            acumulado += contagem
+            linhas.append((limite, acumulado))
+        return linhas
+
+class _Metrica:
+    # Uma série por combinação de valores dos rótulos, criada no primeiro uso.
+    # Sem rótulos, os métodos da série ficam disponíveis direto na métrica.
+    tipo = ""
+
+    def __init__(self, nome: str, ajuda: str, rotulos: Tuple[str, ...] = ()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self._series: Dict[tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def _nova_serie(self):
+        raise NotImplementedError
+
+    def rotulado(self, *valores):
+        serie = self._series.get(valores)
+        if serie is None:
+            if len(valores) != len(self.rotulos):
+                raise ValueError(f"A métrica {self.nome} espera os rótulos {self.rotulos}")
+            with self._lock:
+                serie = self._series.setdefault(valores, self._nova_serie())
+        return serie
+
+    def __getattr__(self, atributo):
+        # Só chamado quando o atributo não existe na métrica (ex.: incrementar sem rótulos)
+        if atributo.startswith("_") or self.rotulos:
+            raise AttributeError(atributo)
+        return getattr(self.rotulado(), atributo)
+
+    def _amostras(self) -> List[str]:
+        with self._lock:
+            series = list(self._series.items())
+        return [f"{self.nome}{_formatar_rotulos(self.rotulos, valores)} {_formatar_numero(serie.valor)}"
+                for valores, serie in series]
+
+    def exportar(self) -> List[str]:
+        return [f"# HELP {self.nome} {_escapar(self.ajuda)}", f"# TYPE {self.nome} {self.tipo}"] + self._amostras()
+
+class Contador(_Metrica):
+    tipo = "counter"
+
+    def _nova_serie(self):
+        return _ValorContador()
+
+class Medidor(_Metrica):
+    # Com `funcao`, o valor é lido na hora da coleta (sem custo nos caminhos quentes)
+    tipo = "gauge"
+
+    def __init__(self, nome: str, ajuda: str, rotulos: Tuple[str, ...] = (),
+                 funcao: Optional[Callable[[], float]] = None):
+        super().__init__(nome, ajuda, rotulos)
+        self._funcao = funcao
+
+    def _nova_serie(self):
+        return _ValorMedidor()
+
+    def _amostras(self) -> List[str]:
+        if self._funcao is None:
+            return super()._amostras()
+        try:
+            return [f"{self.nome} {_formatar_numero(self._funcao())}"]
+        except Exception as e:
+            print(f"Erro ao ler a métrica {self.nome}: {e}")
+            return []
+
+class Histograma(_Metrica):
+    tipo = "histogram"
+
+    def __init__(self, nome: str, ajuda: str, rotulos: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = BUCKETS_PADRAO):
+        super().__init__(nome, ajuda, rotulos)
+        self._limites = tuple(sorted(buckets))
+
+    def _nova_serie(self):
+        return _ValorHistograma(self._limites)
+
+    def _amostras(self) -> List[str]:
+        with self._lock:
+            series = list(self._series.items())
+        linhas = []
+        for valores, serie in series:
+            for limite, acumulado in serie.acumulados():
+                le = f'le="{_formatar_numero(limite)}"'
+                linhas.append(f"{self.nome}_bucket{_formatar_rotulos(self.rotulos, valores, le)} {acumulado}")
+            rotulos = _formatar_rotulos(self.rotulos, valores)
+            linhas.append(f"{self.nome}_sum{rotulos} {_formatar_numero(serie.soma)}")
+            linhas.append(f"{self.nome}_count{rotulos} {serie.total}")
+        return linhas
+
+###################################################################
+
+class RegistroMetricas:
+    # Métricas do processo, exportadas no formato texto do Prometheus.
+    # Registrar de novo um nome já existente devolve a mesma métrica, então módulos
+    # diferentes podem declarar a mesma métrica sem se coordenar.
+
+    def __init__(self):
+        self._metricas: Dict[str, _Metrica] = {}
+        self._lock = threading.Lock()
+
+    def registrar(self, metrica: _Metrica) -> _Metrica:
+        with self._lock:
+            existente = self._metricas.get(metrica.nome)
+            if existente is None:
+                self._metricas[metrica.nome] = metrica
+                return metrica
+        if type(existente) is not type(metrica) or existente.rotulos != metrica.rotulos:
+            raise ValueError(f"Métrica {metrica.nome} já registrada com outro tipo ou rótulos")
+        return existente
+
+    def exportar(self) -> str:
+        with self._lock:
+            metricas = list(self._metricas.values())
+        linhas = []
+        for metrica in metricas:
+            linhas.extend(metrica.exportar())
+        return "\n".join(linhas) + "\n"
+
+registro_padrao = RegistroMetricas()
+
+def contador(nome: str, ajuda: str, rotulos: Tuple[str, ...] = ()) -> Contador:
+    return registro_padrao.registrar(Contador(nome, ajuda, rotulos))
+
+def medidor(nome: str, ajuda: str, rotulos: Tuple[str, ...] = (),
+            funcao: Optional[Callable[[], float]] = None) -> Medidor:
+    return registro_padrao.registrar(Medidor(nome, ajuda, rotulos, funcao))
+
+def histograma(nome: str, ajuda: str, rotulos: Tuple[str, ...] = (),
+               buckets: Tuple[float, ...] = BUCKETS_PADRAO) -> Histograma:
+    return registro_padrao.registrar(Histograma(nome, ajuda, rotulos, buckets))
+
+def exportar_metricas() -> str:
+    return registro_padrao.exportar()
+
+# Tempo das gravações e leituras em arquivo ou banco, por operação
+duracao_io = histograma("io_duracao_segundos", "Duração das operações de I/O em arquivo ou banco", ("operacao",))
+
+def medir_io(operacao: str):
+    # Decorador que registra a duração de cada chamada em io_duracao_segundos
+    serie = duracao_io.rotulado(operacao)
+
+    def decorador(funcao):
+        @functools.wraps(funcao)
+        def medida(*args, **kwargs):
+            inicio = time.perf_counter()
+            try:
+                return funcao(*args, **kwargs)
+            finally:
+                serie.observar(time.perf_counter() - inicio)
+        return medida
+    return decorador
+
+###################################################################
+
+duracao_requisicoes = histograma(
+    "http_requisicao_duracao_segundos", "Duração das requisições HTTP por rota", ("metodo", "rota", "status"))
+
+class MiddlewareMetricas:
+    # Middleware ASGI que mede cada requisição HTTP. A rota é o caminho declarado
+    # (ex.: /pedidos/{pedido_id}), descoberto pelo endpoint que o roteador escolheu.
+
+    def __init__(self, app):
+        self.app = app
+        self._rotas: Dict[Callable, str] = {}
+
+    def _rota(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return ROTA_DESCONHECIDA
+        rota = self._rotas.get(endpoint)
+        if rota is None:
+            aplicacao = scope.get("app")
+            self._rotas = {getattr(r, "endpoint", None): r.path for r in getattr(aplicacao, "routes", [])
+                           if hasattr(r, "path")}
+            rota = self._rotas.get(endpoint, ROTA_DESCONHECIDA)
+        return rota
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        inicio = time.perf_counter()
+        status = [500]
+
+        async def enviar(mensagem):
+            if mensagem["type"] == "http.response.start":
+                status[0] = mensagem["status"]
+            await send(mensagem)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            duracao_requisicoes.rotulado(scope["method"], self._rota(scope), status[0]).observar(
+                time.perf_counter() - inicio)
+
+def instrumentar_app(app):
+    # Mede as requisições e expõe GET /metrics na aplicação FastAPI
+    from fastapi.responses import Response
+
+    app.add_middleware(MiddlewareMetricas)
+
+    async def metricas():
+        return Response(exportar_metricas(), media_type=CONTENT_TYPE_METRICAS)
+
+    app.add_api_route("/metrics", metricas, methods=["GET"], include_in_schema=False)
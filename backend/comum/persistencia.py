@@ -0,0 +1,179 @@
+import json
+import os
+import tempfile
+import threading
+from typing import Any, Callable, Optional
+
+from comum.metricas import medir_io
+
+###################################################################
+
+@medir_io("gravacao_atomica")
+def gravar_atomico(caminho: str, escrever: Callable[[Any], None]):
+    # Grava num temporário no mesmo diretório e troca com os.replace:
+    # um crash no meio da escrita deixa o arquivo anterior intacto
+    diretorio = os.path.dirname(os.path.abspath(caminho))
+    fd, temporario = tempfile.mkstemp(prefix=".", suffix=".tmp", dir=diretorio)
+    try:
+        with os.fdopen(fd, 'w') as file:
+            escrever(file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporario, caminho)
+    except BaseException:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+        raise
+
+    try:
+        fd_diretorio = os.open(diretorio, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd_diretorio)
+    except OSError:
+        pass
+    finally:
+        os.close(fd_diretorio)
+
+def salvar_json_atomico(caminho: str, dados: Any, indent=None):
+    gravar_atomico(caminho, lambda file: json.dump(dados, file, indent=indent))
+
+class GravadorAtrasado:
+    # Write-behind: as mutações só marcam o estado como sujo e uma thread
+    # grava um snapshot no máximo a cada `intervalo` segundos.
+    # marcar(ao_gravar) funciona como group commit: o callback roda depois que
+    # um snapshot contendo a mutação estiver no disco, junto com os demais do lote.
+    # apos_escrita roda a cada snapshot gravado, antes dos callbacks; se falhar, a gravação é refeita.
+
+    def __init__(self, caminho: str, obter_dados: Callable[[], Any], intervalo: float = 0.5, indent=None,
+                 apos_escrita: Optional[Callable[[], None]] = None):
+        self._caminho = caminho
+        self._obter_dados = obter_dados
+        self._intervalo = intervalo
+        self._indent = indent
+        self._apos_escrita = apos_escrita
+
+        self._sujo = threading.Event()
+        self._parando = threading.Event()
+        self._gravacao_lock = threading.Lock()
+        self._callbacks: list = []
+        self._callbacks_lock = threading.Lock()
+        self._thread = None
+
+    def iniciar(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._executar, name=f"gravador-{self._caminho}", daemon=True)
+            self._thread.start()
+
+    def marcar(self, ao_gravar: Optional[Callable[[], None]] = None):
+        if ao_gravar is not None:
+            with self._callbacks_lock:
+                self._callbacks.append(ao_gravar)
+        self._sujo.set()
+
+    def descarregar(self):
+        with self._gravacao_lock:
+            if not self._sujo.is_set():
+                return
+            self._sujo.clear()
+            # Callbacks registrados depois desta troca ficam para a próxima gravação
+            with self._callbacks_lock:
+                callbacks, self._callbacks = self._callbacks, []
+            try:
+                salvar_json_atomico(self._caminho, self._obter_dados(), indent=self._indent)
+                if self._apos_escrita is not None:
+                    self._apos_escrita()
+            except Exception as e:
+                with self._callbacks_lock:
+                    self._callbacks[:0] = callbacks
+                self._sujo.set()
+                print(f"Erro ao gravar {self._caminho}: {e}")
+                return
+
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Erro no callback de gravação de {self._caminho}: {e}")
+
+    def parar(self):
+        self._parando.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.descarregar()
+
+    def _executar(self):
+        while not self._parando.is_set():
+            if not self._sujo.wait(timeout=self._intervalo):
+                continue
+            # Agrupa as mutações que chegarem dentro do intervalo numa única gravação
+            self._parando.wait(self._intervalo)
+            self.descarregar()
+
+class GravadorAtrasadoParticionado:
+    # Write-behind por partição: cada chave suja é gravada no seu próprio arquivo,
+    # então uma mutação custa a escrita de uma partição e não do conjunto inteiro.
+    # obter_dados(chave) retornando None remove o arquivo da partição.
+
+    def __init__(self, caminho: Callable[[Any], str], obter_dados: Callable[[Any], Any],
+                 intervalo: float = 0.5, indent=None):
+        self._caminho = caminho
+        self._obter_dados = obter_dados
+        self._intervalo = intervalo
+        self._indent = indent
+
+        self._sujas: set = set()
+        self._lock = threading.Lock()
+        self._gravacao_lock = threading.Lock()
+        self._sinal = threading.Event()
+        self._parando = threading.Event()
+        self._thread = None
+
+    def iniciar(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._executar, name="gravador-particionado", daemon=True)
+            self._thread.start()
+
+    def marcar(self, chave):
+        with self._lock:
+            self._sujas.add(chave)
+        self._sinal.set()
+
+    def descarregar(self) -> bool:
+        # Retorna False se alguma partição não pôde ser gravada (ela continua suja)
+        falhou = False
+        with self._gravacao_lock:
+            with self._lock:
+                sujas, self._sujas = self._sujas, set()
+                self._sinal.clear()
+
+            for chave in sujas:
+                caminho = self._caminho(chave)
+                try:
+                    dados = self._obter_dados(chave)
+                    if dados is None:
+                        if os.path.exists(caminho):
+                            os.remove(caminho)
+                    else:
+                        salvar_json_atomico(caminho, dados, indent=self._indent)
+                except Exception as e:
+                    self.marcar(chave)
+                    falhou = True
+                    print(f"Erro ao gravar {caminho}: {e}")
+        return not falhou
+
+    def parar(self):
+        self._parando.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.descarregar()
+
+    def _executar(self):
+        while not self._parando.is_set():
+            if not self._sinal.wait(timeout=self._intervalo):
+                continue
+            self._parando.wait(self._intervalo)
+            self.descarregar()
@@ -0,0 +1,338 @@
+import asyncio
+import itertools
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future, InvalidStateError
+from typing import List, Optional, Union
+
+import pika  # type: ignore
+
+from comum.codec import EventoPedido, codificar
+
+RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "rabbitmq")
+RABBITMQ_USER = os.getenv("RABBITMQ_USER", "admin")
+RABBITMQ_PASSWORD = os.getenv("RABBITMQ_PASSWORD", "admin")
+CREDENTIALS = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASSWORD)
+
+EXCHANGE_PADRAO = 'default'
+
+# Quantidade de conexões mantidas abertas por processo
+PUBLICADOR_CONEXOES = int(os.getenv("PUBLICADOR_CONEXOES", "1"))
+# Máximo de mensagens publicadas por rodada do ioloop antes de processar confirmações
+PUBLICADOR_LOTE_MAXIMO = int(os.getenv("PUBLICADOR_LOTE_MAXIMO", "256"))
+# Máximo de mensagens aguardando confirmação do broker por conexão
+PUBLICADOR_MAX_PENDENTES = int(os.getenv("PUBLICADOR_MAX_PENDENTES", "4096"))
+PUBLICADOR_TIMEOUT = float(os.getenv("PUBLICADOR_TIMEOUT", "10"))
+PUBLICADOR_ATRASO_RECONEXAO = float(os.getenv("PUBLICADOR_ATRASO_RECONEXAO", "2"))
+# Mensagens persistentes sobrevivem a um reinício do broker nas filas duráveis
+EVENTOS_PERSISTENTES = os.getenv("EVENTOS_PERSISTENTES", "1") == "1"
+
+###################################################################
+
+class ErroPublicacao(Exception):
+    pass
+
+class _Mensagem:
+    __slots__ = ("exchange", "routing_key", "corpo", "propriedades", "futuro")
+
+    def __init__(self, exchange: str, routing_key: str, corpo: bytes, propriedades: pika.BasicProperties):
+        self.exchange = exchange
+        self.routing_key = routing_key
+        self.corpo = corpo
+        self.propriedades = propriedades
+        self.futuro: Future = Future()
+
+def _resolver(futuro: Future, erro: Optional[Exception] = None):
+    # O chamador pode ter cancelado o futuro enquanto a mensagem estava em voo
+    try:
+        if erro is None:
+            futuro.set_result(True)
+        else:
+            futuro.set_exception(erro)
+    except InvalidStateError:
+        pass
+
+class _ConexaoPublicacao:
+    # Uma conexão AMQP aberta permanentemente, dirigida por um ioloop em thread própria.
+    # Outras threads apenas enfileiram mensagens; toda chamada ao pika acontece na thread do ioloop.
+
+    def __init__(self, parametros: pika.ConnectionParameters, nome: str,
+                 lote_maximo: int, max_pendentes: int, atraso_reconexao: float):
+        self._parametros = parametros
+        self._lote_maximo = lote_maximo
+        self._max_pendentes = max_pendentes
+        self._atraso_reconexao = atraso_reconexao
+
+        self._fila: deque = deque()
+        self._pendentes: dict = {}  # delivery_tag -> _Mensagem, em ordem crescente de tag
+        self._proxima_tag = 0
+
+        self._conexao: Optional[pika.SelectConnection] = None
+        self._canal = None
+        self._parando = False
+
+        self._lock = threading.Lock()
+        self._drenagem_agendada = False
+
+        self._thread = threading.Thread(target=self._executar, name=nome, daemon=True)
+        self._thread.start()
+
+    def enfileirar(self, mensagem: _Mensagem):
+        self.enfileirar_lote([mensagem])
+
+    def enfileirar_lote(self, mensagens: List[_Mensagem]):
+        # O lote inteiro entra na fila antes de acordar o ioloop, que o publica numa só drenagem
+        if self._parando:
+            for mensagem in mensagens:
+                _resolver(mensagem.futuro, ErroPublicacao("Publicador encerrado"))
+            return
+        self._fila.extend(mensagens)
+        self._agendar_drenagem()
+
+    def fechar(self, timeout: float):
+        self._parando = True
+        conexao = self._conexao
+        if conexao is not None:
+            try:
+                conexao.ioloop.add_callback_threadsafe(self._fechar_conexao)
+            except Exception:
+                pass
+        self._thread.join(timeout)
+        for mensagem in list(self._fila) + list(self._pendentes.values()):
+            _resolver(mensagem.futuro, ErroPublicacao("Publicador encerrado"))
+
+    ###############################################################
+
+    def _agendar_drenagem(self):
+        with self._lock:
+            if self._drenagem_agendada:
+                return
+            conexao = self._conexao
+            if conexao is None:
+                # A abertura do próximo canal drena a fila
+                return
+            self._drenagem_agendada = True
+        try:
+            conexao.ioloop.add_callback_threadsafe(self._drenar)
+        except Exception:
+            with self._lock:
+                self._drenagem_agendada = False
+
+    def _executar(self):
+        while not self._parando:
+            try:
+                self._conexao = pika.SelectConnection(
+                    parameters=self._parametros,
+                    on_open_callback=self._on_conexao_aberta,
+                    on_open_error_callback=self._on_erro_abertura,
+                    on_close_callback=self._on_conexao_fechada,
+                )
+                self._conexao.ioloop.start()
+            except Exception as e:
+                print(f"Erro no publicador de eventos: {e}")
+
+            with self._lock:
+                self._conexao = None
+                self._drenagem_agendada = False
+
+            if not self._parando:
+                print(f"Publicador desconectado. Reconectando em {self._atraso_reconexao}s...")
+                time.sleep(self._atraso_reconexao)
+
+    def _on_conexao_aberta(self, conexao):
+        conexao.channel(on_open_callback=self._on_canal_aberto)
+
+    def _on_erro_abertura(self, conexao, erro):
+        print(f"Erro ao conectar o publicador ao RabbitMQ: {erro}")
+        conexao.ioloop.stop()
+
+    def _on_conexao_fechada(self, conexao, motivo):
+        self._canal = None
+        self._devolver_pendentes()
+        conexao.ioloop.stop()
+
+    def _on_canal_aberto(self, canal):
+        canal.add_on_close_callback(self._on_canal_fechado)
+        canal.exchange_declare(
+            exchange=EXCHANGE_PADRAO,
+            exchange_type='topic',
+            callback=lambda _frame: self._on_exchange_declarada(canal),
+        )
+
+    def _on_exchange_declarada(self, canal):
+        canal.confirm_delivery(ack_nack_callback=self._on_confirmacao)
+        self._proxima_tag = 0
+        self._canal = canal
+        self._drenar()
+
+    def _on_canal_fechado(self, canal, motivo):
+        print(f"Canal do publicador fechado: {motivo}")
+        self._canal = None
+        self._devolver_pendentes()
+        self._fechar_conexao()
+
+    def _fechar_conexao(self):
+        conexao = self._conexao
+        if conexao is not None and not (conexao.is_closing or conexao.is_closed):
+            conexao.close()
+
+    def _devolver_pendentes(self):
+        # Mensagens sem confirmação voltam para o início da fila e são republicadas na reconexão
+        if self._pendentes:
+            self._fila.extendleft(reversed(list(self._pendentes.values())))
+            self._pendentes.clear()
+
+    def _drenar(self):
+        with self._lock:
+            self._drenagem_agendada = False
+
+        canal = self._canal
+        if canal is None or not canal.is_open:
+            return
+
+        publicadas = 0
+        while self._fila and publicadas < self._lote_maximo and len(self._pendentes) < self._max_pendentes:
+            mensagem = self._fila.popleft()
+            if mensagem.futuro.done():
+                continue
+            try:
+                canal.basic_publish(
+                    exchange=mensagem.exchange,
+                    routing_key=mensagem.routing_key,
+                    body=mensagem.corpo,
+                    properties=mensagem.propriedades,
+                )
+            except Exception as e:
+                print(f"Erro ao publicar evento: {e}")
+                self._fila.appendleft(mensagem)
+                return
+            self._proxima_tag += 1
+            self._pendentes[self._proxima_tag] = mensagem
+            publicadas += 1
+
+        # Cede o ioloop para processar confirmações antes do próximo lote
+        if self._fila and len(self._pendentes) < self._max_pendentes:
+            self._agendar_drenagem()
+
+    def _on_confirmacao(self, frame):
+        metodo = frame.method
+        confirmado = isinstance(metodo, pika.spec.Basic.Ack)
+        tag = metodo.delivery_tag
+
+        if metodo.multiple:
+            tags = list(itertools.takewhile(lambda t: t <= tag, self._pendentes))
+        else:
+            tags = [tag] if tag in self._pendentes else []
+
+        for t in tags:
+            mensagem = self._pendentes.pop(t)
+            if confirmado:
+                _resolver(mensagem.futuro)
+            else:
+                _resolver(mensagem.futuro, ErroPublicacao(
+                    f"Broker recusou a mensagem com chave {mensagem.routing_key}"))
+
+        if self._fila:
+            self._drenar()
+
+###################################################################
+
+class PublicadorEventos:
+    # Pool de conexões de publicação com confirmações do broker.
+    # Seguro para uso simultâneo pelas rotas do FastAPI e pelas threads consumidoras.
+
+    def __init__(self, host: str = RABBITMQ_HOST, credenciais: pika.PlainCredentials = CREDENTIALS,
+                 conexoes: int = PUBLICADOR_CONEXOES, lote_maximo: int = PUBLICADOR_LOTE_MAXIMO,
+                 max_pendentes: int = PUBLICADOR_MAX_PENDENTES,
+                 atraso_reconexao: float = PUBLICADOR_ATRASO_RECONEXAO):
+        parametros = pika.ConnectionParameters(host=host, credentials=credenciais, heartbeat=30)
+        self._conexoes = [
+            _ConexaoPublicacao(parametros, f"publicador-{i}", lote_maximo, max_pendentes, atraso_reconexao)
+            for i in range(max(1, conexoes))
+        ]
+
+    def _mensagem(self, evento: Union[dict, EventoPedido], routing_key: str, exchange: str,
+                  id_evento: Optional[str], cabecalhos: Optional[dict] = None) -> _Mensagem:
+        # Cada evento leva um message_id único; republicações após reconexão mantêm o mesmo id,
+        # o que permite aos consumidores descartar duplicatas.
+        # O formato do corpo (EVENTOS_FORMATO) vai no content_type para o consumidor decodificar.
+        corpo, content_type = codificar(evento)
+        propriedades = pika.BasicProperties(
+            content_type=content_type,
+            message_id=id_evento or uuid.uuid4().hex,
+            headers=cabecalhos,
+            delivery_mode=2 if EVENTOS_PERSISTENTES else None,
+        )
+        return _Mensagem(exchange, routing_key, corpo, propriedades)
+
+    def _conexao(self, routing_key: str) -> _ConexaoPublicacao:
+        # A mesma chave sempre usa a mesma conexão, preservando a ordem por tópico
+        return self._conexoes[hash(routing_key) % len(self._conexoes)]
+
+    def publicar(self, evento: Union[dict, EventoPedido], routing_key: str, exchange: str = EXCHANGE_PADRAO,
+                 aguardar: bool = True, timeout: float = PUBLICADOR_TIMEOUT, id_evento: Optional[str] = None,
+                 cabecalhos: Optional[dict] = None):
+        mensagem = self._mensagem(evento, routing_key, exchange, id_evento, cabecalhos)
+        self._conexao(routing_key).enfileirar(mensagem)
+
+        if aguardar:
+            return mensagem.futuro.result(timeout=timeout)
+        return mensagem.futuro
+
+    async def publicar_async(self, evento: Union[dict, EventoPedido], routing_key: str, exchange: str = EXCHANGE_PADRAO,
+                             timeout: float = PUBLICADOR_TIMEOUT, id_evento: Optional[str] = None,
+                             cabecalhos: Optional[dict] = None):
+        futuro = self.publicar(evento, routing_key, exchange=exchange, aguardar=False, id_evento=id_evento,
+                               cabecalhos=cabecalhos)
+        return await asyncio.wait_for(asyncio.wrap_future(futuro), timeout)
+
+    def publicar_lote(self, eventos: List[Union[dict, EventoPedido]], routing_key: str,
+                      exchange: str = EXCHANGE_PADRAO, cabecalhos: Optional[List[Optional[dict]]] = None) -> List[Future]:
+        # Um futuro por evento, na ordem recebida; o broker confirma o lote com acks múltiplos
+        cabecalhos = cabecalhos or [None] * len(eventos)
+        mensagens = [self._mensagem(evento, routing_key, exchange, None, cabecalhos_evento)
+                     for evento, cabecalhos_evento in zip(eventos, cabecalhos)]
+        self._conexao(routing_key).enfileirar_lote(mensagens)
+        return [mensagem.futuro for mensagem in mensagens]
+
+    async def publicar_lote_async(self, eventos: List[Union[dict, EventoPedido]], routing_key: str,
+                                  exchange: str = EXCHANGE_PADRAO, timeout: float = PUBLICADOR_TIMEOUT,
+                                  cabecalhos: Optional[List[Optional[dict]]] = None) -> list:
+        # Retorna, por evento, True ou a exceção da sua publicação
+        futuros = [asyncio.wrap_future(futuro)
+                   for futuro in self.publicar_lote(eventos, routing_key, exchange, cabecalhos)]
+        if not futuros:
+            return []
+        _, pendentes = await asyncio.wait(futuros, timeout=timeout)
+        for futuro in pendentes:
+            futuro.cancel()
+        return [
+            ErroPublicacao("Tempo esgotado aguardando a confirmação do broker") if futuro.cancelled()
+            else (futuro.exception() or futuro.result())
+            for futuro in futuros
+        ]
+
+    def fechar(self, timeout: float = PUBLICADOR_TIMEOUT):
+        for conexao in self._conexoes:
+            conexao.fechar(timeout)
+
+_publicador: Optional[PublicadorEventos] = None
+_publicador_lock = threading.Lock()
+
+def obter_publicador() -> PublicadorEventos:
+    global _publicador
+    if _publicador is None:
+        with _publicador_lock:
+            if _publicador is None:
+                _publicador = PublicadorEventos()
+    return _publicador
+
+def fechar_publicador():
+    global _publicador
+    with _publicador_lock:
+        if _publicador is not None:
+            _publicador.fechar()
+            _publicador = None
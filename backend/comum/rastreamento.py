@@ -0,0 +1,225 @@
+import json
+import os
+import threading
+import time
+import urllib.request
+import uuid
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+# Para onde vão os spans: 'nenhum', 'arquivo' (JSON lines local) ou 'coletor' (POST em lote)
+RASTREAMENTO_EXPORTADOR = os.getenv("RASTREAMENTO_EXPORTADOR", "nenhum")
+RASTREAMENTO_ARQUIVO = os.getenv("RASTREAMENTO_ARQUIVO", "spans.jsonl")
+RASTREAMENTO_COLETOR_URL = os.getenv("RASTREAMENTO_COLETOR_URL", "http://principal:8000/rastreamento/spans")
+RASTREAMENTO_INTERVALO = float(os.getenv("RASTREAMENTO_INTERVALO", "1"))
+# Spans aguardando exportação; acima disso os mais antigos são descartados
+RASTREAMENTO_BUFFER = int(os.getenv("RASTREAMENTO_BUFFER", "10000"))
+# Correlações mantidas pelo coletor do principal
+RASTREAMENTO_CORRELACOES = int(os.getenv("RASTREAMENTO_CORRELACOES", "10000"))
+
+# Nome do cabeçalho HTTP e das chaves nos headers AMQP
+CABECALHO_CORRELACAO = "X-Correlation-ID"
+CHAVE_CORRELACAO = "correlation_id"
+CHAVE_PUBLICADO_EM = "publicado_em"
+
+###################################################################
+
+def nova_correlacao() -> str:
+    return uuid.uuid4().hex
+
+def cabecalhos_amqp(correlacao: Optional[str]) -> Optional[dict]:
+    if correlacao is None:
+        return None
+    return {CHAVE_CORRELACAO: correlacao, CHAVE_PUBLICADO_EM: time.time()}
+
+def _cabecalhos(mensagem) -> dict:
+    return getattr(mensagem.propriedades, "headers", None) or {}
+
+def correlacao_da_mensagem(mensagem, pedido_id: Optional[int] = None) -> Optional[str]:
+    # Mensagens publicadas antes do rastreamento ficam agrupadas pelo id do pedido
+    correlacao = _cabecalhos(mensagem).get(CHAVE_CORRELACAO)
+    if correlacao is None and pedido_id is not None:
+        return f"pedido-{pedido_id}"
+    return correlacao
+
+def espera_na_fila(mensagem, recebido_em: float) -> Optional[float]:
+    # Segundos entre a publicação e a entrega ao consumidor (inclui a fila do broker)
+    publicado_em = _cabecalhos(mensagem).get(CHAVE_PUBLICADO_EM)
+    if publicado_em is None:
+        return None
+    return max(0.0, recebido_em - publicado_em)
+
+def atributos_mensagem(mensagem, recebido_em: float, **atributos) -> dict:
+    espera = espera_na_fila(mensagem, recebido_em)
+    atributos["routing_key"] = mensagem.routing_key
+    if espera is not None:
+        atributos["espera_fila_ms"] = round(espera * 1000, 3)
+    return atributos
+
+###################################################################
+
+class ExportadorArquivo:
+
+    def __init__(self, caminho: str = RASTREAMENTO_ARQUIVO):
+        self._caminho = caminho
+
+    def exportar(self, spans: List[dict]):
+        with open(self._caminho, 'a') as file:
+            for span in spans:
+                file.write(json.dumps(span) + "\n")
+
+class ExportadorColetor:
+
+    def __init__(self, url: str = RASTREAMENTO_COLETOR_URL, timeout: float = 5):
+        self._url = url
+        self._timeout = timeout
+
+    def exportar(self, spans: List[dict]):
+        requisicao = urllib.request.Request(
+            self._url, data=json.dumps(spans).encode(), headers={"Content-Type": "application/json"}, method="POST")
+        with urllib.request.urlopen(requisicao, timeout=self._timeout):
+            pass
+
+class Rastreador:
+    # Registra spans (um trecho de trabalho com início, fim e a correlação do pedido) e os
+    # exporta em lote numa thread própria. Sem exportador, registrar não custa nada.
+    # Os instantes são epoch em segundos, comparáveis entre serviços.
+
+    def __init__(self, servico: str, exportador=None, intervalo: float = RASTREAMENTO_INTERVALO,
+                 tamanho_buffer: int = RASTREAMENTO_BUFFER):
+        self.servico = servico
+        self._exportador = exportador
+        self._intervalo = intervalo
+        self._buffer: deque = deque(maxlen=tamanho_buffer)
+        self._sinal = threading.Event()
+        self._parando = False
+        self._thread: Optional[threading.Thread] = None
+
+        self.descartados = 0
+
+    @property
+    def ativo(self) -> bool:
+        return self._exportador is not None
+
+    def registrar(self, correlacao: Optional[str], nome: str, inicio: float, fim: Optional[float] = None,
+                  **atributos):
+        if self._exportador is None or correlacao is None:
+            return
+        if len(self._buffer) == self._buffer.maxlen:
+            self.descartados += 1
+        self._buffer.append({
+            "correlacao": correlacao,
+            "servico": self.servico,
+            "nome": nome,
+            "inicio": inicio,
+            "fim": time.time() if fim is None else fim,
+            "atributos": atributos,
+        })
+
+    @contextmanager
+    def span(self, correlacao: Optional[str], nome: str, **atributos) -> Iterator[dict]:
+        # Os atributos podem ser completados dentro do bloco pelo dict retornado
+        inicio = time.time()
+        try:
+            yield atributos
+        except Exception as e:
+            atributos["erro"] = str(e)
+            raise
+        finally:
+            self.registrar(correlacao, nome, inicio, **atributos)
+
+    def iniciar(self):
+        if self._exportador is None:
+            return
+        self._thread = threading.Thread(target=self._executar, name=f"rastreador-{self.servico}", daemon=True)
+        self._thread.start()
+
+    def parar(self):
+        self._parando = True
+        self._sinal.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.descarregar()
+
+    def descarregar(self):
+        spans = []
+        while self._buffer:
+            spans.append(self._buffer.popleft())
+        if not spans:
+            return
+        try:
+            self._exportador.exportar(spans)
+        except Exception as e:
+            self.descartados += len(spans)
+            print(f"Erro ao exportar {len(spans)} spans: {e}")
+
+    def _executar(self):
+        while not self._parando:
+            self._sinal.wait(self._intervalo)
+            self.descarregar()
+
+def criar_rastreador(servico: str, exportador: str = RASTREAMENTO_EXPORTADOR) -> Rastreador:
+    if exportador == "nenhum":
+        return Rastreador(servico)
+    elif exportador == "arquivo":
+        return Rastreador(servico, ExportadorArquivo())
+    elif exportador == "coletor":
+        return Rastreador(servico, ExportadorColetor())
+    raise ValueError(f"Exportador de spans desconhecido: {exportador}")
+
+###################################################################
+
+class ColetorSpans:
+    # Spans de todos os serviços agrupados por correlação, para montar a linha do tempo de um
+    # pedido. Guarda as correlações mais recentes (LRU); também serve de exportador local.
+
+    def __init__(self, capacidade: int = RASTREAMENTO_CORRELACOES):
+        self._capacidade = capacidade
+        self._spans: OrderedDict = OrderedDict()  # correlacao -> [span]
+        self._correlacao_por_pedido: dict = {}
+        self._lock = threading.Lock()
+
+    def exportar(self, spans: List[dict]):
+        with self._lock:
+            for span in spans:
+                correlacao = span["correlacao"]
+                self._spans.setdefault(correlacao, []).append(span)
+                self._spans.move_to_end(correlacao)
+                pedido_id = span.get("atributos", {}).get("pedido_id")
+                if pedido_id is not None:
+                    self._correlacao_por_pedido[pedido_id] = correlacao
+            while len(self._spans) > self._capacidade:
+                antiga, spans_antigos = self._spans.popitem(last=False)
+                for span in spans_antigos:
+                    pedido_id = span.get("atributos", {}).get("pedido_id")
+                    if self._correlacao_por_pedido.get(pedido_id) == antiga:
+                        del self._correlacao_por_pedido[pedido_id]
+
+    def correlacao_do_pedido(self, pedido_id: int) -> Optional[str]:
+        with self._lock:
+            return self._correlacao_por_pedido.get(pedido_id)
+
+    def linha_do_tempo(self, correlacao: str) -> Optional[dict]:
+        with self._lock:
+            spans = sorted(self._spans.get(correlacao, []), key=lambda span: span["inicio"])
+        if not spans:
+            return None
+        inicio = spans[0]["inicio"]
+        fim = max(span["fim"] for span in spans)
+        return {
+            "correlacao": correlacao,
+            "inicio": inicio,
+            "duracao_ms": round((fim - inicio) * 1000, 3),
+            "spans": [
+                {
+                    "servico": span["servico"],
+                    "nome": span["nome"],
+                    "inicio_ms": round((span["inicio"] - inicio) * 1000, 3),
+                    "duracao_ms": round((span["fim"] - span["inicio"]) * 1000, 3),
+                    "atributos": span["atributos"],
+                }
+                for span in spans
+            ],
+        }
@@ -0,0 +1,522 @@
+import asyncio
+import functools
+import itertools
+import os
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Union
+
+from comum.codec import EventoPedido, codificar
+from comum.metricas import contador, histograma
+from comum.rastreamento import cabecalhos_amqp
+
+# 'rabbitmq' usa o broker; 'memoria' entrega os eventos dentro do próprio processo,
+# para serviços rodando juntos num só nó e para testes sem rede
+TRANSPORTE_BACKEND = os.getenv("TRANSPORTE_BACKEND", "rabbitmq")
+TRANSPORTE_TIMEOUT = float(os.getenv("TRANSPORTE_TIMEOUT", "10"))
+
+EXCHANGE_PADRAO = 'default'
+# Mensagens rejeitadas sem reenfileirar (falha definitiva) vão para esta exchange e ficam
+# na fila durável FILA_MORTAS, com a routing key original, para inspeção ou reenvio manual
+EXCHANGE_MORTAS = 'default.mortas'
+FILA_MORTAS = 'mensagens.mortas'
+# Quantas mensagens mortas o barramento em memória guarda (as mais antigas saem primeiro)
+TRANSPORTE_MORTAS_LIMITE = int(os.getenv("TRANSPORTE_MORTAS_LIMITE", "10000"))
+
+mensagens_consumidas = contador("mensagens_consumidas_total", "Mensagens entregues ao consumidor", ("routing_key",))
+mensagens_confirmadas = contador("mensagens_confirmadas_total", "Mensagens confirmadas (ack)", ("routing_key",))
+mensagens_rejeitadas = contador("mensagens_rejeitadas_total", "Mensagens rejeitadas (nack)", ("routing_key",))
+mensagens_mortas = contador(
+    "mensagens_mortas_total", "Mensagens rejeitadas sem reenfileirar (fila de mortas)", ("routing_key",))
+erros_consumidor = contador("consumidor_erros_total", "Exceções nos callbacks de consumo", ("routing_key",))
+duracao_callbacks = histograma(
+    "consumidor_callback_duracao_segundos", "Duração dos callbacks de consumo", ("routing_key",))
+
+###################################################################
+
+def _sem_confirmacao(*_):
+    # Confirmação de mensagens consumidas com auto_ack: já saíram confirmadas do broker
+    pass
+
+class Mensagem:
+    # Mensagem entregue ao callback de consumo, independente do backend.
+    # confirmar() e rejeitar() podem ser chamados de qualquer thread.
+    __slots__ = ("routing_key", "corpo", "propriedades", "reentregue", "resolvida", "_confirmar", "_rejeitar")
+
+    def __init__(self, routing_key: str, corpo: bytes, propriedades, reentregue: bool,
+                 confirmar: Callable[[], None], rejeitar: Callable[[bool], None]):
+        self.routing_key = routing_key
+        self.corpo = corpo
+        self.propriedades = propriedades
+        self.reentregue = reentregue
+        self.resolvida = False  # já confirmada ou rejeitada
+        self._confirmar = confirmar
+        self._rejeitar = rejeitar
+
+    def confirmar(self):
+        self.resolvida = True
+        if self._confirmar is not _sem_confirmacao:
+            mensagens_confirmadas.rotulado(self.routing_key).incrementar()
+        self._confirmar()
+
+    def rejeitar(self, reenfileirar: bool):
+        # Sem reenfileirar, a mensagem vai para a fila de mortas em vez de ser descartada
+        self.resolvida = True
+        if self._rejeitar is not _sem_confirmacao:
+            mensagens_rejeitadas.rotulado(self.routing_key).incrementar()
+            if not reenfileirar:
+                mensagens_mortas.rotulado(self.routing_key).incrementar()
+        self._rejeitar(reenfileirar)
+
+def _entregar(callback: Callable[[Mensagem], None], mensagem: Mensagem, auto_ack: bool):
+    # Chama o callback contabilizando a mensagem e o tempo gasto nele. Uma exceção do callback
+    # não derruba o consumidor: a mensagem ainda não resolvida tem uma nova tentativa e, se já
+    # era reentregue, vai para as mortas. Igual nos dois backends.
+    routing_key = mensagem.routing_key
+    mensagens_consumidas.rotulado(routing_key).incrementar()
+    if auto_ack:
+        mensagens_confirmadas.rotulado(routing_key).incrementar()
+    inicio = time.perf_counter()
+    try:
+        callback(mensagem)
+    except Exception as e:
+        erros_consumidor.rotulado(routing_key).incrementar()
+        print(f"Erro no callback da chave '{routing_key}': {e}")
+        if not mensagem.resolvida:
+            mensagem.rejeitar(reenfileirar=not mensagem.reentregue)
+    finally:
+        duracao_callbacks.rotulado(routing_key).observar(time.perf_counter() - inicio)
+
+class Transporte(ABC):
+
+    @abstractmethod
+    def publicar(self, evento: Union[dict, EventoPedido], routing_key: str, aguardar: bool = True,
+                 timeout: float = TRANSPORTE_TIMEOUT, id_evento: Optional[str] = None,
+                 correlacao: Optional[str] = None):
+        # Com aguardar=False retorna um Future resolvido quando a publicação for confirmada.
+        # A correlação segue nos headers da mensagem junto com o instante da publicação.
+        ...
+
+    @abstractmethod
+    def publicar_lote(self, eventos: List[Union[dict, EventoPedido]], routing_key: str,
+                      correlacoes: Optional[List[Optional[str]]] = None) -> List[Future]:
+        # Um futuro por evento, na ordem recebida
+        ...
+
+    @abstractmethod
+    def consumir(self, chaves: List[str], callback: Callable[[Mensagem], None],
+                 prefetch: int = 0, auto_ack: bool = False, grupo: Optional[str] = None):
+        # Liga uma fila a cada chave (com curingas * e #) e entrega as mensagens ao callback.
+        # Bloqueia a thread chamadora, onde o callback roda; com auto_ack a mensagem já chega confirmada.
+        # Sem grupo, cada consumidor tem filas exclusivas e recebe todas as mensagens (fan-out).
+        # Com grupo, as filas são duráveis e nomeadas "<grupo>.<chave>": os consumidores do mesmo
+        # grupo dividem as mensagens entre si e o que chega enquanto nenhum está ativo fica retido.
+        ...
+
+    def fechar(self):
+        pass
+
+    async def publicar_async(self, evento: Union[dict, EventoPedido], routing_key: str,
+                             timeout: float = TRANSPORTE_TIMEOUT, id_evento: Optional[str] = None,
+                             correlacao: Optional[str] = None):
+        futuro = self.publicar(evento, routing_key, aguardar=False, id_evento=id_evento, correlacao=correlacao)
+        return await asyncio.wait_for(asyncio.wrap_future(futuro), timeout)
+
+    async def publicar_lote_async(self, eventos: List[Union[dict, EventoPedido]], routing_key: str,
+                                  timeout: float = TRANSPORTE_TIMEOUT,
+                                  correlacoes: Optional[List[Optional[str]]] = None) -> list:
+        # Retorna, por evento, True ou a exceção da sua publicação
+        futuros = [asyncio.wrap_future(futuro) for futuro in self.publicar_lote(eventos, routing_key, correlacoes)]
+        if not futuros:
+            return []
+        _, pendentes = await asyncio.wait(futuros, timeout=timeout)
+        for futuro in pendentes:
+            futuro.cancel()
+        return [
+            TimeoutError("Tempo esgotado aguardando a publicação") if futuro.cancelled()
+            else (futuro.exception() or futuro.result())
+            for futuro in futuros
+        ]
+
+###################################################################
+
+class TransporteRabbitMQ(Transporte):
+    # Publicação pelo PublicadorEventos (confirmações do broker) e consumo por BlockingConnection
+
+    def __init__(self):
+        from comum import publicador
+        self._publicador = publicador
+
+    def publicar(self, evento, routing_key, aguardar=True, timeout=TRANSPORTE_TIMEOUT, id_evento=None,
+                 correlacao=None):
+        return self._publicador.obter_publicador().publicar(
+            evento, routing_key, aguardar=aguardar, timeout=timeout, id_evento=id_evento,
+            cabecalhos=cabecalhos_amqp(correlacao))
+
+    def publicar_lote(self, eventos, routing_key, correlacoes=None):
+        return self._publicador.obter_publicador().publicar_lote(
+            eventos, routing_key, cabecalhos=_cabecalhos_lote(eventos, correlacoes))
+
+    async def publicar_async(self, evento, routing_key, timeout=TRANSPORTE_TIMEOUT, id_evento=None,
+                             correlacao=None):
+        return await self._publicador.obter_publicador().publicar_async(
+            evento, routing_key, timeout=timeout, id_evento=id_evento, cabecalhos=cabecalhos_amqp(correlacao))
+
+    async def publicar_lote_async(self, eventos, routing_key, timeout=TRANSPORTE_TIMEOUT, correlacoes=None):
+        return await self._publicador.obter_publicador().publicar_lote_async(
+            eventos, routing_key, timeout=timeout, cabecalhos=_cabecalhos_lote(eventos, correlacoes))
+
+    def consumir(self, chaves, callback, prefetch=0, auto_ack=False, grupo=None):
+        pika = self._publicador.pika
+        connection = pika.BlockingConnection(pika.ConnectionParameters(
+            host=self._publicador.RABBITMQ_HOST, credentials=self._publicador.CREDENTIALS))
+        channel = connection.channel()
+        channel.exchange_declare(exchange=EXCHANGE_PADRAO, exchange_type='topic')
+        channel.exchange_declare(exchange=EXCHANGE_MORTAS, exchange_type='topic', durable=True)
+        channel.queue_declare(queue=FILA_MORTAS, durable=True)
+        channel.queue_bind(exchange=EXCHANGE_MORTAS, queue=FILA_MORTAS, routing_key='#')
+        argumentos = {"x-dead-letter-exchange": EXCHANGE_MORTAS}
+        if prefetch:
+            channel.basic_qos(prefetch_count=prefetch)
+
+        thread_consumo = threading.get_ident()
+
+        def na_thread_do_consumidor(acao):
+            # O pika só aceita chamadas do canal na thread da conexão
+            if threading.get_ident() == thread_consumo:
+                acao()
+            else:
+                connection.add_callback_threadsafe(acao)
+
+        def entregar(ch, method, properties, body):
+            if auto_ack:
+                confirmar = rejeitar = _sem_confirmacao
+            else:
+                confirmar = lambda: na_thread_do_consumidor(
+                    functools.partial(ch.basic_ack, delivery_tag=method.delivery_tag))
+                rejeitar = lambda requeue: na_thread_do_consumidor(
+                    lambda: ch.basic_nack(delivery_tag=method.delivery_tag, requeue=requeue))
+            _entregar(callback, Mensagem(method.routing_key, body, properties, method.redelivered,
+                                         confirmar, rejeitar), auto_ack)
+
+        for routing_key in chaves:
+            if grupo:
+                result = channel.queue_declare(queue=nome_fila_grupo(grupo, routing_key), durable=True,
+                                               arguments=argumentos)
+            else:
+                result = channel.queue_declare(queue='', exclusive=True, arguments=argumentos)
+            fila = result.method.queue
+            channel.queue_bind(exchange=EXCHANGE_PADRAO, queue=fila, routing_key=routing_key)
+            channel.basic_consume(queue=fila, on_message_callback=entregar, auto_ack=auto_ack)
+
+        channel.start_consuming()
+
+    def fechar(self):
+        self._publicador.fechar_publicador()
+
+###################################################################
+
+def nome_fila_grupo(grupo: str, routing_key: str) -> str:
+    return f"{grupo}.{routing_key}"
+
+def _cabecalhos_lote(eventos: list, correlacoes: Optional[List[Optional[str]]]) -> List[Optional[dict]]:
+    return [cabecalhos_amqp(correlacao) for correlacao in (correlacoes or [None] * len(eventos))]
+
+def topico_confere(padrao: str, routing_key: str) -> bool:
+    # Mesma regra da exchange topic: '*' casa uma palavra e '#' casa zero ou mais
+    return _topico_confere(padrao.split('.'), routing_key.split('.'))
+
+def _topico_confere(padrao: List[str], chave: List[str]) -> bool:
+    if not padrao:
+        return not chave
+    if padrao[0] == '#':
+        return any(_topico_confere(padrao[1:], chave[i:]) for i in range(len(chave) + 1))
+    if not chave or (padrao[0] != '*' and padrao[0] != chave[0]):
+        return False
+    return _topico_confere(padrao[1:], chave[1:])
+
+class PropriedadesMensagem:
+    # Os mesmos campos de pika.BasicProperties lidos pelos consumidores
+    __slots__ = ("content_type", "message_id", "headers")
+
+    def __init__(self, content_type: Optional[str] = None, message_id: Optional[str] = None,
+                 headers: Optional[dict] = None):
+        self.content_type = content_type
+        self.message_id = message_id
+        self.headers = headers
+
+class _Entrega:
+    __slots__ = ("routing_key", "corpo", "propriedades", "reentregue")
+
+    def __init__(self, routing_key: str, corpo: bytes, propriedades: PropriedadesMensagem, reentregue: bool = False):
+        self.routing_key = routing_key
+        self.corpo = corpo
+        self.propriedades = propriedades
+        self.reentregue = reentregue
+
+class _FilaMemoria:
+    # Fila ligada a uma chave, consumida no event loop da thread que chamou consumir().
+    # Com nome, é a parte de um consumidor numa fila compartilhada do barramento.
+
+    def __init__(self, padrao: str, loop: asyncio.AbstractEventLoop, nome: Optional[str] = None):
+        self.padrao = padrao
+        self.loop = loop
+        self.nome = nome
+        self.entregas: asyncio.Queue = asyncio.Queue()
+
+    def colocar(self, entrega: _Entrega):
+        self.loop.call_soon_threadsafe(self.entregas.put_nowait, entrega)
+
+class _FilaCompartilhada:
+    # Fila nomeada de um grupo de consumidores: recebe uma cópia de cada mensagem e a entrega
+    # a um único membro, o com menos mensagens à espera. Sem membros, as mensagens ficam
+    # retidas até o próximo consumidor do grupo, como numa fila durável do broker.
+
+    def __init__(self, nome: str, padrao: str):
+        self.nome = nome
+        self.padrao = padrao
+        self.membros: List[_FilaMemoria] = []
+        self.retidas: deque = deque()
+        self._proximo = 0
+
+    def escolher(self) -> Optional[_FilaMemoria]:
+        if not self.membros:
+            return None
+        # A partida gira entre os membros para desempatar em round-robin
+        self._proximo = (self._proximo + 1) % len(self.membros)
+        candidatos = self.membros[self._proximo:] + self.membros[:self._proximo]
+        return min(candidatos, key=lambda membro: membro.entregas.qsize())
+
+class BarramentoMemoria:
+    # Exchange topic dentro do processo. Cada consumidor roda um event loop asyncio na
+    # própria thread; as publicações chegam às filas por call_soon_threadsafe, sem rede
+    # e sem serialização além da do codec.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._filas: List[_FilaMemoria] = []
+        self._compartilhadas: Dict[str, _FilaCompartilhada] = {}
+        # Equivalente à FILA_MORTAS do broker
+        self.mortas: deque = deque(maxlen=TRANSPORTE_MORTAS_LIMITE)
+
+    def ligar(self, fila: _FilaMemoria):
+        with self._lock:
+            if fila.nome is None:
+                self._filas.append(fila)
+                return
+            compartilhada = self._compartilhadas.get(fila.nome)
+            if compartilhada is None:
+                compartilhada = self._compartilhadas[fila.nome] = _FilaCompartilhada(fila.nome, fila.padrao)
+            compartilhada.membros.append(fila)
+            retidas, compartilhada.retidas = list(compartilhada.retidas), deque()
+        self._distribuir(compartilhada, retidas)
+
+    def desligar(self, fila: _FilaMemoria):
+        with self._lock:
+            if fila.nome is None:
+                if fila in self._filas:
+                    self._filas.remove(fila)
+                return
+            compartilhada = self._compartilhadas[fila.nome]
+            if fila in compartilhada.membros:
+                compartilhada.membros.remove(fila)
+
+    def devolver(self, fila: _FilaMemoria, entregas: List[_Entrega]):
+        # Mensagens não entregues ou sem confirmação de um membro que saiu voltam para o grupo
+        if fila.nome is not None and entregas:
+            self._distribuir(self._compartilhadas[fila.nome], entregas)
+
+    def matar(self, entrega: _Entrega):
+        print(f"Mensagem da chave '{entrega.routing_key}' enviada para as mensagens mortas.")
+        self.mortas.append(entrega)
+
+    def consumidores(self, routing_key: str) -> int:
+        with self._lock:
+            exclusivas = sum(1 for fila in self._filas if topico_confere(fila.padrao, routing_key))
+            return exclusivas + sum(
+                1 for compartilhada in self._compartilhadas.values()
+                if compartilhada.membros and topico_confere(compartilhada.padrao, routing_key)
+            )
+
+    def publicar(self, routing_key: str, corpo: bytes, propriedades: PropriedadesMensagem):
+        with self._lock:
+            destinos = [fila for fila in self._filas if topico_confere(fila.padrao, routing_key)]
+            grupos = [compartilhada for compartilhada in self._compartilhadas.values()
+                      if topico_confere(compartilhada.padrao, routing_key)]
+        # Como numa exchange sem filas ligadas, a mensagem sem destino é descartada
+        for fila in destinos:
+            try:
+                fila.colocar(_Entrega(routing_key, corpo, propriedades))
+            except RuntimeError:
+                # Event loop do consumidor já encerrado
+                self.desligar(fila)
+        for compartilhada in grupos:
+            self._distribuir(compartilhada, [_Entrega(routing_key, corpo, propriedades)])
+
+    def _distribuir(self, compartilhada: _FilaCompartilhada, entregas: List[_Entrega]):
+        for entrega in entregas:
+            while True:
+                with self._lock:
+                    membro = compartilhada.escolher()
+                    if membro is None:
+                        compartilhada.retidas.append(entrega)
+                        break
+                try:
+                    membro.colocar(entrega)
+                    break
+                except RuntimeError:
+                    self.desligar(membro)
+
+class TransporteMemoria(Transporte):
+
+    def __init__(self, barramento: Optional[BarramentoMemoria] = None):
+        self.barramento = barramento or barramento_padrao
+        self._consumos: List[tuple] = []  # (loop, evento de parada)
+        self._lock = threading.Lock()
+
+    def _enviar(self, evento, routing_key, id_evento=None, correlacao=None) -> Future:
+        corpo, content_type = codificar(evento)
+        propriedades = PropriedadesMensagem(content_type=content_type, message_id=id_evento or uuid.uuid4().hex,
+                                            headers=cabecalhos_amqp(correlacao))
+        futuro = Future()
+        try:
+            self.barramento.publicar(routing_key, corpo, propriedades)
+            futuro.set_result(True)
+        except Exception as e:
+            futuro.set_exception(e)
+        return futuro
+
+    def publicar(self, evento, routing_key, aguardar=True, timeout=TRANSPORTE_TIMEOUT, id_evento=None,
+                 correlacao=None):
+        futuro = self._enviar(evento, routing_key, id_evento, correlacao)
+        if aguardar:
+            return futuro.result(timeout=timeout)
+        return futuro
+
+    def publicar_lote(self, eventos, routing_key, correlacoes=None):
+        correlacoes = correlacoes or [None] * len(eventos)
+        return [self._enviar(evento, routing_key, correlacao=correlacao)
+                for evento, correlacao in zip(eventos, correlacoes)]
+
+    def consumir(self, chaves, callback, prefetch=0, auto_ack=False, grupo=None):
+        asyncio.run(self._consumir(chaves, callback, prefetch, auto_ack, grupo))
+
+    async def _consumir(self, chaves, callback, prefetch, auto_ack, grupo):
+        loop = asyncio.get_running_loop()
+        parar = asyncio.Event()
+        # Limite de mensagens sem confirmação somando todas as filas deste consumidor
+        em_voo = asyncio.Semaphore(prefetch) if prefetch and not auto_ack else None
+        filas = [_FilaMemoria(chave, loop, nome_fila_grupo(grupo, chave) if grupo else None) for chave in chaves]
+        # Entregas sem confirmação, devolvidas ao grupo se o consumidor parar antes dela
+        sem_confirmacao: Dict[int, tuple] = {}  # sequência -> (fila, entrega)
+        sequencia = itertools.count()
+
+        def liberar(seq):
+            # Confirmações repetidas ou que chegam depois da parada são ignoradas
+            item = sem_confirmacao.pop(seq, None)
+            if item is not None and em_voo is not None:
+                em_voo.release()
+            return item
+
+        def rejeitar(seq, reenfileirar):
+            item = liberar(seq)
+            if item is None:
+                return
+            fila, entrega = item
+            if reenfileirar:
+                fila.entregas.put_nowait(_reentrega(entrega))
+            else:
+                self.barramento.matar(entrega)
+
+        async def consumir_fila(fila: _FilaMemoria):
+            while True:
+                entrega = await fila.entregas.get()
+                if em_voo is not None:
+                    await em_voo.acquire()
+                if auto_ack:
+                    confirmar = reenviar = _sem_confirmacao
+                else:
+                    # Pode vir de qualquer thread; o estado da fila só é tocado no event loop
+                    seq = next(sequencia)
+                    sem_confirmacao[seq] = (fila, entrega)
+                    confirmar = functools.partial(_no_loop, loop, liberar, seq)
+                    reenviar = functools.partial(_no_loop, loop, rejeitar, seq)
+                _entregar(callback, Mensagem(entrega.routing_key, entrega.corpo, entrega.propriedades,
+                                             entrega.reentregue, confirmar, reenviar), auto_ack)
+
+        with self._lock:
+            self._consumos.append((loop, parar))
+        for fila in filas:
+            self.barramento.ligar(fila)
+
+        tarefas = [asyncio.ensure_future(consumir_fila(fila)) for fila in filas]
+        try:
+            await parar.wait()
+        finally:
+            for fila in filas:
+                self.barramento.desligar(fila)
+            for tarefa in tarefas:
+                tarefa.cancel()
+            await asyncio.gather(*tarefas, return_exceptions=True)
+            # Como o broker ao fechar o canal: as sem confirmação voltam marcadas como reentregues
+            pendentes = {fila: [] for fila in filas}
+            for fila, entrega in sem_confirmacao.values():
+                pendentes[fila].append(_reentrega(entrega))
+            sem_confirmacao.clear()
+            for fila in filas:
+                restantes = pendentes[fila]
+                while not fila.entregas.empty():
+                    restantes.append(fila.entregas.get_nowait())
+                self.barramento.devolver(fila, restantes)
+
+    def fechar(self):
+        with self._lock:
+            consumos, self._consumos = self._consumos, []
+        for loop, parar in consumos:
+            try:
+                loop.call_soon_threadsafe(parar.set)
+            except RuntimeError:
+                pass
+
+def _reentrega(entrega: _Entrega) -> _Entrega:
+    return _Entrega(entrega.routing_key, entrega.corpo, entrega.propriedades, True)
+
+def _no_loop(loop: asyncio.AbstractEventLoop, funcao: Callable, *args):
+    try:
+        loop.call_soon_threadsafe(funcao, *args)
+    except RuntimeError:
+        # Consumidor já encerrado: a mensagem foi devolvida ao grupo na parada
+        pass
+
+barramento_padrao = BarramentoMemoria()
+
+###################################################################
+
+_transporte: Optional[Transporte] = None
+_transporte_lock = threading.Lock()
+
+def criar_transporte(backend: str = TRANSPORTE_BACKEND) -> Transporte:
+    if backend == "rabbitmq":
+        return TransporteRabbitMQ()
+    elif backend == "memoria":
+        return TransporteMemoria()
+    raise ValueError(f"Backend de transporte desconhecido: {backend}")
+
+def obter_transporte() -> Transporte:
+    global _transporte
+    if _transporte is None:
+        with _transporte_lock:
+            if _transporte is None:
+                _transporte = criar_transporte()
+    return _transporte
+
+def fechar_transporte():
+    global _transporte
+    with _transporte_lock:
+        if _transporte is not None:
+            _transporte.fechar()
+            _transporte = None
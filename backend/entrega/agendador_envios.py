@@ -0,0 +1,179 @@
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Optional
+
+from comum.dedup import CacheIdempotencia
+from comum.metricas import medir_io
+from comum.persistencia import gravar_atomico
+
+OP_AGENDAR = 'agendar'
+OP_CONCLUIR = 'concluir'
+
+###################################################################
+
+class AgendadorEnvios:
+    # Heap de envios ordenado pelo horário de vencimento, servido por uma única thread.
+    # Os envios pendentes ficam num journal (JSON lines) para sobreviver a reinícios:
+    # cada agendamento e cada conclusão é uma linha, compactada quando o arquivo cresce.
+    # As conclusões recentes (limite e TTL da deduplicação) sobrevivem à compactação, então
+    # um pedido já enviado não é agendado de novo nem depois de um reinício.
+
+    def __init__(self, caminho_journal: str, despachar: Callable[[dict], Future],
+                 atraso_nova_tentativa: float = 2.0):
+        self._caminho_journal = caminho_journal
+        self._despachar = despachar
+        self._atraso_nova_tentativa = atraso_nova_tentativa
+
+        self._heap: list = []  # (vence_em, seq, pedido_id)
+        self._pendentes: dict = {}  # pedido_id -> {"pedido": ..., "vence_em": ...}
+        self._concluidos = CacheIdempotencia()  # pedido_id -> concluído em
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._parando = False
+        self._thread: Optional[threading.Thread] = None
+
+        self._journal = None
+        self._linhas_journal = 0
+
+    def pendentes(self) -> int:
+        return len(self._pendentes)
+
+    def iniciar(self):
+        with self._cond:
+            self._carregar_journal()
+            for pedido_id, envio in self._pendentes.items():
+                heapq.heappush(self._heap, (envio["vence_em"], next(self._seq), pedido_id))
+            self._compactar_journal()
+
+        if self._pendentes:
+            print(f"{len(self._pendentes)} envios pendentes recuperados de {self._caminho_journal}.")
+
+        self._thread = threading.Thread(target=self._executar, name="agendador-envios", daemon=True)
+        self._thread.start()
+
+    def parar(self):
+        with self._cond:
+            self._parando = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+        with self._cond:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+
+    def agendar(self, pedido: dict, atraso: float) -> bool:
+        # Retorna False se o pedido já estava agendado ou enviado (mensagem repetida)
+        vence_em = time.time() + atraso
+        with self._cond:
+            if pedido["id"] in self._pendentes or self._concluidos.contem(pedido["id"]):
+                return False
+            # Primeiro no journal: se a gravação falhar, o envio não fica só na memória
+            self._registrar({"op": OP_AGENDAR, "pedido": pedido, "vence_em": vence_em})
+            self._pendentes[pedido["id"]] = {"pedido": pedido, "vence_em": vence_em}
+            heapq.heappush(self._heap, (vence_em, next(self._seq), pedido["id"]))
+            if self._heap[0][2] == pedido["id"]:
+                self._cond.notify()
+        return True
+
+    ###############################################################
+
+    def _executar(self):
+        while True:
+            with self._cond:
+                vencidos = []
+                while not self._parando:
+                    agora = time.time()
+                    while self._heap and self._heap[0][0] <= agora:
+                        _, _, pedido_id = heapq.heappop(self._heap)
+                        envio = self._pendentes.get(pedido_id)
+                        if envio is not None:
+                            vencidos.append(envio["pedido"])
+                    if vencidos:
+                        break
+                    self._cond.wait(timeout=self._heap[0][0] - agora if self._heap else None)
+                if self._parando:
+                    return
+
+            for pedido in vencidos:
+                try:
+                    futuro = self._despachar(pedido)
+                except Exception as e:
+                    print(f"Erro ao despachar o pedido {pedido['id']}: {e}")
+                    self._reagendar(pedido["id"])
+                    continue
+                futuro.add_done_callback(lambda f, pedido_id=pedido["id"]: self._on_despachado(pedido_id, f))
+
+    def _on_despachado(self, pedido_id, futuro: Future):
+        if futuro.cancelled() or futuro.exception() is not None:
+            print(f"Erro ao despachar o pedido {pedido_id}. Nova tentativa em {self._atraso_nova_tentativa}s.")
+            self._reagendar(pedido_id)
+            return
+
+        with self._cond:
+            if pedido_id not in self._pendentes:
+                return
+            self._registrar({"op": OP_CONCLUIR, "id": pedido_id, "em": time.time()})
+            del self._pendentes[pedido_id]
+            self._concluidos.registrar(pedido_id)
+            # Compacta quando o journal tem bem mais linhas do que as que sobrevivem à compactação
+            if self._linhas_journal > 1000 and self._linhas_journal > 2 * (len(self._pendentes) + len(self._concluidos)):
+                self._compactar_journal()
+
+    def _reagendar(self, pedido_id):
+        with self._cond:
+            if pedido_id in self._pendentes:
+                heapq.heappush(self._heap, (time.time() + self._atraso_nova_tentativa, next(self._seq), pedido_id))
+                self._cond.notify()
+
+    ###############################################################
+
+    @medir_io("journal_envios")
+    def _registrar(self, operacao: dict):
+        # O agendamento é confirmado ao broker logo depois, então a linha precisa estar no disco
+        if self._journal is None:
+            raise RuntimeError("Journal de envios fechado: o agendador não foi iniciado ou já parou")
+        self._journal.write(json.dumps(operacao) + "\n")
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self._linhas_journal += 1
+
+    def _carregar_journal(self):
+        if not os.path.exists(self._caminho_journal):
+            return
+        concluidos = []
+        with open(self._caminho_journal, 'r') as file:
+            for linha in file:
+                try:
+                    operacao = json.loads(linha)
+                except json.JSONDecodeError:
+                    # Última linha incompleta de um crash durante a escrita
+                    continue
+                if operacao.get("op") == OP_AGENDAR:
+                    pedido = operacao["pedido"]
+                    self._pendentes[pedido["id"]] = {"pedido": pedido, "vence_em": operacao["vence_em"]}
+                elif operacao.get("op") == OP_CONCLUIR:
+                    self._pendentes.pop(operacao["id"], None)
+                    concluidos.append([operacao["id"], operacao["em"]])
+        self._concluidos.carregar(concluidos)
+
+    def _compactar_journal(self):
+        if self._journal is not None:
+            self._journal.close()
+
+        concluidos = self._concluidos.snapshot()
+
+        def escrever(file):
+            for pedido_id, concluido_em in concluidos:
+                file.write(json.dumps({"op": OP_CONCLUIR, "id": pedido_id, "em": concluido_em}) + "\n")
+            for envio in self._pendentes.values():
+                file.write(json.dumps({"op": OP_AGENDAR, "pedido": envio["pedido"], "vence_em": envio["vence_em"]}) + "\n")
+
+        gravar_atomico(self._caminho_journal, escrever)
+        self._linhas_journal = len(concluidos) + len(self._pendentes)
+        self._journal = open(self._caminho_journal, 'a')
@@ -1,16 +1,18 @@
+import os
 import threading
-import pika  # type: ignore
-import json
-import time  # Para introduzir o delay
+import time
 
 from fastapi import FastAPI
+from comum.codec import ErroCodec, decodificar_mensagem
+from comum.dedup import CacheIdempotencia, id_do_evento
+from comum.metricas import instrumentar_app
+from comum.rastreamento import atributos_mensagem, correlacao_da_mensagem, criar_rastreador
+from comum.transporte import Mensagem, obter_transporte, fechar_transporte
+from agendador_envios import AgendadorEnvios
 
 app = FastAPI()
-
-RABBITMQ_HOST = 'rabbitmq'
-RABBITMQ_USER = "admin"
-RABBITMQ_PASSWORD = "admin"
-CREDENTIALS = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASSWORD)
+# Latência por rota e GET /metrics no formato do Prometheus
+instrumentar_app(app)
 
 TOPIC_PEDIDOS_CRIADOS = 'pedidos.criados'
 TOPIC_PEDIDOS_EXCLUIDOS = 'pedidos.excluídos'
@@ -22,75 +24,73 @@ FILAS = {
     "Pagamentos_Aprovados": TOPIC_PAGAMENTOS_APROVADOS,
 }
 
-###################################################################
+ENTREGA_ATRASO = float(os.getenv("ENTREGA_ATRASO", "5"))
+ENVIOS_JOURNAL_PATH = os.getenv("ENVIOS_JOURNAL_PATH", "envios_pendentes.jsonl")
+# Réplicas do mesmo grupo dividem as mensagens em filas duráveis compartilhadas; vazio volta às filas exclusivas
+GRUPO_CONSUMO = os.getenv("GRUPO_CONSUMO", "entrega")
 
-def enviar_evento(evento, routing_key):
-    connection = pika.BlockingConnection(pika.ConnectionParameters(
-        host=RABBITMQ_HOST, credentials=CREDENTIALS))
-    channel = connection.channel()
-    channel.exchange_declare(exchange='default', exchange_type='topic')
+rastreador = criar_rastreador("entrega")
 
-    channel.basic_publish(
-        exchange='default', 
-        routing_key=routing_key, 
-        body=json.dumps(evento)
-    )
+###################################################################
 
-    print(
-        f"Evento enviado para a exchange 'default' com chave {routing_key}: {evento}")
-    connection.close()
+def despachar_envio(pedido_enviado):
+    print(f"Pedido {pedido_enviado['id']} despachado para a fila: {TOPIC_PEDIDOS_ENVIADOS}")
+    # O rastro viaja no journal junto com o pedido; o codec ignora a chave extra
+    rastro = pedido_enviado.get("rastro") or {}
+    correlacao = rastro.get("correlacao")
+    if "agendado_em" in rastro:
+        rastreador.registrar(correlacao, "entrega.espera", rastro["agendado_em"], pedido_id=pedido_enviado["id"])
+    return obter_transporte().publicar(pedido_enviado, TOPIC_PEDIDOS_ENVIADOS, aguardar=False, correlacao=correlacao)
+
+agendador_envios = AgendadorEnvios(ENVIOS_JOURNAL_PATH, despachar_envio)
+# Descarta reentregas antes de decodificar. Depois de um reinício quem garante um único
+# envio por pedido é o journal do agendador, que também guarda os pedidos já enviados
+eventos_processados = CacheIdempotencia()
+
+def callback(mensagem: Mensagem):
+    recebido_em = time.time()
+    id_evento = id_do_evento(mensagem.propriedades)
+    if not eventos_processados.registrar(id_evento):
+        print(f"Evento {id_evento} repetido ignorado.")
+        mensagem.confirmar()
+        return
 
-def callback(ch, method, properties, body):
     try:
-        pedido = json.loads(body)
+        pedido = decodificar_mensagem(mensagem.propriedades, mensagem.corpo)
         print(f"Pedido recebido para processamento: {pedido}")
 
-        if not all(key in pedido for key in ["id", "client_id", "product_id", "product_name", "quantity", "status"]):
-            print("Erro: Formato de pedido inválido.")
-            return
-
-        pedido_enviado = {
-            "id": pedido["id"],
-            "client_id": pedido["client_id"],
-            "product_id": pedido["product_id"],
-            "product_name": pedido["product_name"],
-            "quantity": pedido["quantity"],
-            "status": "enviado", 
-        }
-
-        # Introduz um delay de 5 segundos antes de enviar o evento
-        print("Aguardando 5 segundos antes de enviar o evento...")
-        time.sleep(5)
-
-        enviar_evento(pedido_enviado, TOPIC_PEDIDOS_ENVIADOS)
-        print(f"Pedido enviado com sucesso para a fila: {TOPIC_PEDIDOS_ENVIADOS}")
-
-    except json.JSONDecodeError:
-        print("Erro ao decodificar a mensagem recebida.")
+        # O journal do agendador guarda o pedido como JSON
+        pedido_enviado = pedido.com_status("enviado").para_dict()
+        correlacao = correlacao_da_mensagem(mensagem, pedido.id)
+        pedido_enviado["rastro"] = {"correlacao": correlacao, "agendado_em": time.time()}
+
+        # O envio é despachado pelo agendador quando o atraso vencer, sem travar o consumidor
+        if agendador_envios.agendar(pedido_enviado, ENTREGA_ATRASO):
+            print(f"Envio do pedido {pedido.id} agendado para daqui a {ENTREGA_ATRASO} segundos.")
+        else:
+            print(f"Envio do pedido {pedido.id} já estava agendado ou foi feito.")
+
+        # Ack só depois do envio estar registrado no journal
+        mensagem.confirmar()
+        rastreador.registrar(correlacao, "entrega.agendamento", recebido_em,
+                             **atributos_mensagem(mensagem, recebido_em, pedido_id=pedido.id))
+
+    except ErroCodec as e:
+        print(f"Erro: Formato de pedido inválido. {e}")
+        mensagem.confirmar()
     except Exception as e:
         print(f"Erro inesperado: {e}")
+        eventos_processados.esquecer(id_evento)
+        # Uma nova tentativa; na segunda falha a mensagem vai para as mortas
+        mensagem.rejeitar(reenfileirar=not mensagem.reentregue)
 
 def consumir_pedidos():
     try:
-        connection = pika.BlockingConnection(pika.ConnectionParameters(
-            host=RABBITMQ_HOST, credentials=CREDENTIALS))
-        channel = connection.channel()
-        channel.exchange_declare(exchange='default', exchange_type='topic')
-
         for fila, routing_key in FILAS.items():
-            result = channel.queue_declare(queue='', exclusive=True)
-            fila_temporaria = result.method.queue
-            channel.queue_bind(exchange='default',
-                               queue=fila_temporaria, routing_key=routing_key)
-
-            channel.basic_consume(
-                queue=fila_temporaria, on_message_callback=callback, auto_ack=True
-            )
-
             print(f"Consumindo mensagens da fila: {fila} (chave: {routing_key})")
 
         print("Aguardando mensagens de todas as filas. Para sair pressione CTRL+C")
-        channel.start_consuming()
+        obter_transporte().consumir(list(FILAS.values()), callback, grupo=GRUPO_CONSUMO or None)
         
     except Exception as e:
         print(f"Erro ao configurar o consumidor: {str(e)}")
@@ -103,4 +103,12 @@ def root():
 
 @app.on_event("startup")
 def start_rabbitmq_consumer():
+    agendador_envios.iniciar()
+    rastreador.iniciar()
     threading.Thread(target=consumir_pedidos, daemon=True).start()
+
+@app.on_event("shutdown")
+def encerrar_recursos():
+    agendador_envios.parar()
+    rastreador.parar()
+    fechar_transporte()
@@ -1,186 +1,250 @@
 import json
+import os
 import threading
-import pika # type: ignore
-from fastapi import FastAPI, HTTPException
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+from fastapi import FastAPI, Header, HTTPException, Query, Response
+from comum.etag import gerar_etag, etag_confere
+from comum.metricas import instrumentar_app
+from comum.transporte import Mensagem, obter_transporte, fechar_transporte
+from comum.codec import ErroCodec, EventoPedido, decodificar_mensagem
+from comum.dedup import id_do_evento
+from comum.rastreamento import atributos_mensagem, correlacao_da_mensagem, criar_rastreador
+from indice_estoque import (
+    IndiceEstoque, ESTOQUE_OK, ESTOQUE_INEXISTENTE, ESTOQUE_DUPLICADO, ESTOQUE_SEM_RESERVA, ESTOQUE_ENCERRADO,
+)
 
 app = FastAPI()
-
-RABBITMQ_HOST = 'rabbitmq'
-RABBITMQ_USER = "admin"
-RABBITMQ_PASSWORD = "admin"
-CREDENTIALS = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASSWORD)
+# Latência por rota e GET /metrics no formato do Prometheus
+instrumentar_app(app)
 
 TOPIC_PEDIDOS_CRIADOS = 'pedidos.criados'
 TOPIC_PEDIDOS_EXCLUIDOS = 'pedidos.excluídos'
 TOPIC_PEDIDOS_ENVIADOS = 'pedidos.enviados'
 TOPIC_PAGAMENTOS_APROVADOS = 'pagamentos.aprovados'
 TOPIC_PAGAMENTOS_RECUSADOS = 'pagamentos.recusados'
+TOPIC_ESTOQUE_RESERVAS = 'estoque.reservas'
+
+RESERVA_CONFIRMADA = 'reservado'
+
+ESTOQUE_FILE_PATH = "estoque.json"
+# Janela do group commit: reservas que chegam dentro dela saem numa única gravação
+ESTOQUE_INTERVALO_GRAVACAO = float(os.getenv("ESTOQUE_INTERVALO_GRAVACAO", "0.01"))
+ESTOQUE_PREFETCH = int(os.getenv("ESTOQUE_PREFETCH", "256"))
+# Réplicas do mesmo grupo dividem as mensagens em filas duráveis compartilhadas; vazio volta às filas exclusivas
+GRUPO_CONSUMO = os.getenv("GRUPO_CONSUMO", "estoque")
+
+rastreador = criar_rastreador("estoque")
+
+indice_estoque = IndiceEstoque(ESTOQUE_FILE_PATH, intervalo_gravacao=ESTOQUE_INTERVALO_GRAVACAO)
+# Um executor de uma thread por faixa de produtos do índice
+executores_reservas = [
+    ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"reservas-{i}")
+    for i in range(indice_estoque.faixas)
+]
 
 ###################################################################
 
 def carregar_estoque():
     try:
-        with open("estoque.json", "r") as file:
-            content = file.read().strip()
-            if not content:
-                raise HTTPException(status_code=204, detail="No content")
-            return json.loads(content)
-    except FileNotFoundError:
-        raise HTTPException(status_code=404, detail="Arquivo não encontrado")
-    except json.JSONDecodeError:
-        raise HTTPException(
-            status_code=400, detail="Erro ao decodificar o JSON")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro interno: {str(e)}")
-
-def carregar_estoque_por_id(product_id: int):
-    try:
-        with open("estoque.json", "r") as file:
+        with open(ESTOQUE_FILE_PATH, "r") as file:
             content = file.read().strip()
             if not content:
                 raise HTTPException(status_code=204, detail="No content")
-            
             estoque = json.loads(content)
-            if not isinstance(estoque, list):
+            if not isinstance(estoque, (list, dict)):
                 raise HTTPException(
                     status_code=400, 
                     detail="Formato inválido: O estoque deve ser uma lista"
                 )
-            
-            produto = next((item for item in estoque if item.get("id") == product_id), None)
-            
-            if produto is None:
-                raise HTTPException(
-                    status_code=404, 
-                    detail=f"Produto com ID {product_id} não encontrado"
-                )
-            
-            return produto
+            return estoque
     except FileNotFoundError:
         raise HTTPException(status_code=404, detail="Arquivo não encontrado")
     except json.JSONDecodeError:
         raise HTTPException(
-            status_code=400, detail="Erro ao decodificar o JSON"
-        )
+            status_code=400, detail="Erro ao decodificar o JSON")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro interno: {str(e)}")
 
-def salvar_estoque(estoque):
-    with open("estoque.json", "w") as file:
-        json.dump(estoque, file, indent=4)
-
 ###################################################################
 
-def enviar_evento(evento, queue):
-    connection = pika.BlockingConnection(pika.ConnectionParameters(
-        host=RABBITMQ_HOST, credentials=CREDENTIALS))
-    channel = connection.channel()
-    channel.exchange_declare(exchange='default', exchange_type='topic')
-
-    channel.queue_declare(queue=queue)
-
-    channel.basic_publish(
-        exchange='',
-        routing_key=queue,
-        body=json.dumps(evento)
+def enviar_evento(evento, routing_key, id_evento=None, correlacao=None):
+    futuro = obter_transporte().publicar(evento, routing_key, aguardar=False, id_evento=id_evento,
+                                         correlacao=correlacao)
+    print(f"Evento enviado para a exchange 'default' com chave {routing_key}: {evento}")
+    return futuro
+
+def confirmar_mensagem(mensagem: Mensagem, sucesso=True):
+    # Pode ser chamada de qualquer thread
+    if sucesso:
+        mensagem.confirmar()
+    else:
+        # Uma nova tentativa; na segunda falha a mensagem vai para as mortas
+        mensagem.rejeitar(reenfileirar=not mensagem.reentregue)
+
+def reservar_pedido(pedido: EventoPedido, id_evento, confirmar, correlacao=None):
+    resultado, product = indice_estoque.reservar(pedido.id, pedido.product_id, pedido.quantity, id_evento)
+
+    if resultado == ESTOQUE_DUPLICADO:
+        # Um crash entre a gravação e a publicação deixaria o pedido sem resposta: ela sai de novo
+        resultado = indice_estoque.resultado_reserva(id_evento)
+        if resultado is None or resultado == ESTOQUE_ENCERRADO:
+            print(f"Evento {id_evento} repetido ignorado.")
+            confirmar()
+            return
+        print(f"Evento {id_evento} repetido; reenviando a resposta da reserva do pedido {pedido.id}.")
+    elif resultado == ESTOQUE_ENCERRADO:
+        # Pagamento recusado antes da reserva; uma resposta agora só sobrescreveria o status
+        print(f"Pedido {pedido.id} já foi recusado; nada foi reservado.")
+        confirmar()
+        return
+    elif resultado == ESTOQUE_OK:
+        print(f"Estoque reservado para o pedido {pedido.id}: {product}")
+    elif resultado == ESTOQUE_INEXISTENTE:
+        print(f"Erro: Produto com ID {pedido.product_id} não encontrado no estoque.")
+    else:
+        print(f"Erro: Estoque insuficiente para o produto '{product['name']}' (ID: {product['id']}).")
+
+    resposta = EventoPedido(
+        pedido.id, pedido.client_id, pedido.product_id, pedido.product_name, pedido.quantity,
+        reserva=RESERVA_CONFIRMADA if resultado == ESTOQUE_OK else resultado,
     )
 
-    print(f"Evento enviado para a fila {queue}: {evento}")
-    connection.close()
-
-def callback_pedido_criado(ch, method, properties, body):
+    aguardando_gravacao = time.time()
+
+    def responder():
+        rastreador.registrar(correlacao, "estoque.gravacao", aguardando_gravacao, pedido_id=pedido.id)
+        # O id fixo por pedido deixa a resposta republicada após um crash ser descartada pelo principal
+        futuro = enviar_evento(resposta, TOPIC_ESTOQUE_RESERVAS, id_evento=f"reserva-{pedido.id}",
+                               correlacao=correlacao)
+        futuro.add_done_callback(lambda f: confirmar())
+
+    # A resposta só sai depois que a reserva estiver no disco
+    indice_estoque.apos_gravacao(responder)
+
+def encerrar_reserva(pedido: EventoPedido, id_evento, confirmar, aprovado, correlacao=None):
+    if aprovado:
+        resultado, product = indice_estoque.confirmar(pedido.id, pedido.product_id, id_evento)
+    else:
+        resultado, product = indice_estoque.liberar(pedido.id, pedido.product_id, id_evento)
+
+    if resultado == ESTOQUE_DUPLICADO:
+        print(f"Evento {id_evento} repetido ignorado.")
+        confirmar()
+        return
+
+    if resultado == ESTOQUE_SEM_RESERVA and aprovado:
+        print(f"Pedido {pedido.id} pago antes da reserva; o estoque sai quando o pedido chegar.")
+    elif resultado == ESTOQUE_SEM_RESERVA:
+        print(f"Pedido {pedido.id} não tinha estoque reservado.")
+    elif resultado == ESTOQUE_INEXISTENTE:
+        print(f"Erro: Produto com ID {pedido.product_id} não encontrado no estoque.")
+    elif aprovado:
+        print(f"Reserva do pedido {pedido.id} confirmada: {product}")
+    else:
+        print(f"Reserva do pedido {pedido.id} liberada: {product}")
+
+    aguardando_gravacao = time.time()
+
+    def concluir():
+        rastreador.registrar(correlacao, "estoque.gravacao", aguardando_gravacao, pedido_id=pedido.id)
+        confirmar()
+
+    indice_estoque.apos_gravacao(concluir)
+
+def processar_evento(routing_key, pedido, id_evento, confirmar, correlacao=None):
     try:
-        pedido = json.loads(body)
-        print(f"Pedido criado recebido: {pedido}")
-
-        if not all(key in pedido for key in ["id", "client_id", "product_id", "product_name", "quantity", "status"]):
-            print("Erro: Formato de pedido inválido.")
-            return
-
-        estoque = carregar_estoque()
-
-        product = next((p for p in estoque if p['id'] == pedido['product_id']), None)
-
-        if not product:
-            print(f"Erro: Produto com ID {pedido['product_id']} não encontrado no estoque.")
-            return
-
-        if product['stock'] >= pedido['quantity']:
-            product['stock'] -= pedido['quantity']
-            salvar_estoque(estoque)
-            print(f"Estoque atualizado após pedido criado: {product}")
+        if routing_key == TOPIC_PEDIDOS_CRIADOS:
+            reservar_pedido(pedido, id_evento, confirmar, correlacao)
+        elif routing_key == TOPIC_PAGAMENTOS_APROVADOS:
+            encerrar_reserva(pedido, id_evento, confirmar, True, correlacao)
+        elif routing_key == TOPIC_PAGAMENTOS_RECUSADOS:
+            encerrar_reserva(pedido, id_evento, confirmar, False, correlacao)
         else:
-            print(f"Erro: Estoque insuficiente para o produto '{product['name']}' (ID: {product['id']}).")
-    except json.JSONDecodeError:
-        print("Erro ao decodificar a mensagem recebida.")
+            confirmar()
     except Exception as e:
         print(f"Erro no callback: {str(e)}")
+        confirmar(sucesso=False)
+
+def callback(mensagem: Mensagem):
+    recebido_em = time.time()
+    id_evento = id_do_evento(mensagem.propriedades)
+    # Pedidos criados repetidos seguem adiante para a resposta da reserva ser reenviada
+    if mensagem.routing_key != TOPIC_PEDIDOS_CRIADOS and indice_estoque.ja_processado(id_evento):
+        print(f"Evento {id_evento} repetido ignorado.")
+        mensagem.confirmar()
+        return
 
-def callback_pedido_excluido(ch, method, properties, body):
     try:
-        pedido = json.loads(body)
-        print(f"Pedido criado recebido: {pedido}")
+        pedido = decodificar_mensagem(mensagem.propriedades, mensagem.corpo)
+        print(f"Evento recebido na chave '{mensagem.routing_key}': {pedido}")
+    except ErroCodec as e:
+        print(f"Erro: Formato de pedido inválido. {e}")
+        mensagem.confirmar()
+        return
 
-        if not all(key in pedido for key in ["id", "client_id", "product_id", "product_name", "quantity", "status"]):
-            print("Erro: Formato de pedido inválido.")
-            return
+    correlacao = correlacao_da_mensagem(mensagem, pedido.id)
 
-        estoque = carregar_estoque()
+    def confirmar(sucesso=True):
+        # O span cobre a espera no executor, a reserva, a gravação e a publicação da resposta
+        rastreador.registrar(correlacao, "estoque.evento", recebido_em,
+                             **atributos_mensagem(mensagem, recebido_em, pedido_id=pedido.id, sucesso=sucesso))
+        confirmar_mensagem(mensagem, sucesso)
 
-        product = next((p for p in estoque if p['id'] == pedido['product_id']), None)
+    # Eventos do mesmo produto caem sempre no mesmo executor e mantêm a ordem de chegada
+    executor = executores_reservas[indice_estoque.faixa(pedido.product_id)]
+    executor.submit(processar_evento, mensagem.routing_key, pedido, id_evento, confirmar, correlacao)
 
-        if product:
-            product['stock'] += pedido['quantity']
-            salvar_estoque(estoque)
-            print(f"Estoque atualizado após pedido criado: {product}")
-            return
-        else:
-            print(f"Erro: Produto com ID {pedido['product_id']} não encontrado no estoque.")
-            return
-        
-    except json.JSONDecodeError:
-        print("Erro ao decodificar a mensagem recebida.")
-    except Exception as e:
-        print(f"Erro no callback: {str(e)}")
-        
 def consumir_eventos():
-    connection = pika.BlockingConnection(pika.ConnectionParameters(
-        host=RABBITMQ_HOST, credentials=CREDENTIALS))
-    channel = connection.channel()
-    channel.exchange_declare(exchange='default', exchange_type='topic')
-
-    criados = channel.queue_declare(queue='', exclusive=True)
-    excluidos = channel.queue_declare(queue='', exclusive=True)
-
-    criadosNome = criados.method.queue
-    excluidosNome = excluidos.method.queue
-
-    channel.queue_bind(exchange='default',
-                       queue=criadosNome, routing_key=TOPIC_PEDIDOS_CRIADOS)
-    channel.basic_consume(
-        queue=criadosNome, on_message_callback=callback_pedido_criado, auto_ack=True)
-
-    channel.queue_bind(exchange='default',
-                       queue=excluidosNome, routing_key=TOPIC_PAGAMENTOS_RECUSADOS)
-    channel.basic_consume(
-        queue=excluidosNome, on_message_callback=callback_pedido_excluido, auto_ack=True)
-
     print('Aguardando mensagens nas filas. Para sair, pressione CTRL+C.')
-    channel.start_consuming()
+    # Mensagens sem ack em voo; o ack só é dado após o group commit
+    obter_transporte().consumir(
+        [TOPIC_PEDIDOS_CRIADOS, TOPIC_PAGAMENTOS_APROVADOS, TOPIC_PAGAMENTOS_RECUSADOS],
+        callback, prefetch=ESTOQUE_PREFETCH, grupo=GRUPO_CONSUMO or None)
 
 ###################################################################
 
 @app.get("/estoque")
-async def consultar_estoque():
-    estoque = carregar_estoque()
-    return estoque
+async def consultar_estoque(if_none_match: Optional[str] = Header(None)):
+    # A versão é lida antes dos dados: no pior caso o ETag fica mais antigo que o corpo
+    etag = gerar_etag("estoque", indice_estoque.versao)
+    if etag_confere(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=indice_estoque.listar_serializado(), media_type="application/json", headers={"ETag": etag})
+
+# Estoque de vários produtos numa única chamada; ids inexistentes ficam fora da resposta
+@app.get("/estoque/lote")
+async def get_products_stock(ids: List[int] = Query(...)):
+    return indice_estoque.obter_estoques(ids)
 
 @app.get("/estoque/{product_id}")
 async def get_product_stock(product_id: int):
-    product = carregar_estoque_por_id(product_id)
-    print(product)
+    product = indice_estoque.obter(product_id)
+    if product is None:
+        raise HTTPException(
+            status_code=404, 
+            detail=f"Produto com ID {product_id} não encontrado"
+        )
     return product["stock"]
     
 @app.on_event("startup")
 def start_rabbitmq_consumer():
+    try:
+        indice_estoque.carregar(carregar_estoque())
+    except HTTPException as e:
+        print(f"Erro ao carregar o estoque: {e.detail}. Iniciando com estoque vazio.")
+    indice_estoque.iniciar()
+    rastreador.iniciar()
+
     threading.Thread(target=consumir_eventos, daemon=True).start()
+
+@app.on_event("shutdown")
+def encerrar_recursos():
+    for executor in executores_reservas:
+        executor.shutdown(wait=True)
+    indice_estoque.parar()
+    fechar_transporte()
+    rastreador.parar()
@@ -0,0 +1,266 @@
+import json
+import os
+import threading
+import time
+from contextlib import ExitStack
+from typing import Callable, List, Optional
+
+from comum.dedup import CacheIdempotencia, LogIdempotencia
+from comum.persistencia import GravadorAtrasado
+
+# Faixas de produtos com trava própria; pedidos de faixas diferentes não disputam trava
+ESTOQUE_FAIXAS = int(os.getenv("ESTOQUE_FAIXAS", "16"))
+
+ESTOQUE_OK = 'ok'
+ESTOQUE_INSUFICIENTE = 'insuficiente'
+ESTOQUE_INEXISTENTE = 'inexistente'
+ESTOQUE_DUPLICADO = 'duplicado'
+ESTOQUE_SEM_RESERVA = 'sem_reserva'
+ESTOQUE_ENCERRADO = 'encerrado'
+
+# Por que o pedido foi encerrado, guardado na marca de encerramento
+ENCERRADO_CONFIRMADO = 'confirmado'  # reserva feita e confirmada pelo pagamento aprovado
+ENCERRADO_PAGO = 'pago'  # pagamento aprovado antes da reserva: o saldo ainda não saiu
+ENCERRADO_LIBERADO = 'liberado'  # pagamento recusado ou pedido sem estoque
+
+###################################################################
+
+class IndiceEstoque:
+    # Estoque em memória com reservas por pedido. Cada produto pertence a uma faixa
+    # com trava própria: produtos diferentes são reservados em paralelo e o saldo de
+    # um mesmo produto nunca fica negativo.
+    #
+    # "stock" é o saldo disponível. reservar() retira do saldo e guarda a reserva do
+    # pedido; confirmar() a encerra quando o pagamento é aprovado e liberar() devolve
+    # a quantidade quando é recusado. Os dois deixam o pedido marcado como encerrado, com
+    # o motivo, mesmo sem reserva (o pagamento chegou antes do pedido criado). Um pedido
+    # criado depois disso não prende estoque que ninguém mais vai liberar: se foi pago, o
+    # saldo é retirado e confirmado no mesmo passo; se foi recusado, nada é reservado.
+    #
+    # Estoque e reservas vão num snapshot; os ids dos eventos aplicados vão num log só de
+    # acréscimo ao lado dele, escrito logo depois de cada snapshot e fora das travas. Um id
+    # só chega ao log depois que a mutação dele está no snapshot, então um crash entre os
+    # dois no máximo reprocessa um evento, e as reservas por pedido tornam isso inofensivo.
+    # O id de cada pedido criado guarda o resultado da reserva, para a resposta ser
+    # reenviada quando o evento chega de novo.
+
+    def __init__(self, caminho: str, intervalo_gravacao: float = 0.5, faixas: int = ESTOQUE_FAIXAS,
+                 caminho_eventos: Optional[str] = None):
+        self._produtos: dict = {}
+        self._reservas: dict = {}  # pedido_id -> {"product_id", "quantity"}
+        self._processados = CacheIdempotencia()
+        self._log_eventos = LogIdempotencia(caminho_eventos or os.path.splitext(caminho)[0] + ".eventos.jsonl")
+        self._eventos_novos: list = []  # [id, registrado_em] aplicados desde o último snapshot
+        self._eventos_gravando: list = []
+        self._travas = [threading.Lock() for _ in range(max(1, faixas))]
+
+        # Incrementada a cada mutação; serve de ETag e de chave da listagem serializada
+        self.versao = 0
+        self._versao_lock = threading.Lock()
+        self._listagem_versao = -1
+        self._listagem: bytes = b""
+        self._listagem_lock = threading.Lock()
+        self._gravador = GravadorAtrasado(caminho, self._estado, intervalo=intervalo_gravacao, indent=4,
+                                          apos_escrita=self._gravar_eventos)
+
+    @property
+    def faixas(self) -> int:
+        return len(self._travas)
+
+    def faixa(self, product_id: int) -> int:
+        return hash(product_id) % len(self._travas)
+
+    def _trava(self, product_id: int) -> threading.Lock:
+        return self._travas[self.faixa(product_id)]
+
+    def _todas_as_travas(self) -> ExitStack:
+        # Sempre na mesma ordem, para não haver deadlock entre dois snapshots
+        pilha = ExitStack()
+        for trava in self._travas:
+            pilha.enter_context(trava)
+        return pilha
+
+    def _nova_versao(self):
+        with self._versao_lock:
+            self.versao += 1
+
+    def carregar(self, estoque):
+        # Aceita a lista de produtos original ou o formato gravado pelo índice
+        if isinstance(estoque, dict):
+            produtos = estoque.get("produtos", [])
+            reservas = estoque.get("reservas", [])
+            # Arquivos antigos guardavam os ids no snapshot; eles migram para o log na próxima gravação
+            legados = estoque.get("eventos_processados", [])
+            self._processados.carregar(legados)
+            self._eventos_novos.extend(legados)
+        else:
+            produtos, reservas = estoque, []
+        with self._todas_as_travas():
+            self._produtos = {produto["id"]: dict(produto) for produto in produtos}
+            self._reservas = {
+                reserva["pedido_id"]: {"product_id": reserva["product_id"], "quantity": reserva["quantity"]}
+                for reserva in reservas
+            }
+        self._nova_versao()
+        if self._eventos_novos:
+            self._gravador.marcar()
+
+    def iniciar(self):
+        self._processados.carregar(self._log_eventos.carregar())
+        self._gravador.iniciar()
+
+    def parar(self):
+        self._gravador.parar()
+        self._log_eventos.fechar()
+
+    def apos_gravacao(self, callback: Callable[[], None]):
+        # Executa o callback quando as mutações feitas até aqui estiverem no disco
+        self._gravador.marcar(callback)
+
+    def _estado(self) -> dict:
+        with self._todas_as_travas():
+            # Os ids separados aqui são os das mutações contidas neste snapshot
+            self._eventos_gravando.extend(self._eventos_novos)
+            self._eventos_novos = []
+            return {
+                "produtos": [dict(produto) for produto in self._produtos.values()],
+                "reservas": [
+                    {"pedido_id": pedido_id, **reserva} for pedido_id, reserva in self._reservas.items()
+                ],
+            }
+
+    def _gravar_eventos(self):
+        # Na thread do gravador, depois que o snapshot está no disco
+        eventos, self._eventos_gravando = self._eventos_gravando, []
+        try:
+            self._log_eventos.anexar(eventos)
+        except Exception:
+            self._eventos_gravando[:0] = eventos
+            raise
+
+    def _registrar_evento(self, id_evento: Optional[str], resultado: Optional[str] = None) -> bool:
+        # Chamado com a trava da faixa do produto
+        if not self._processados.registrar(id_evento, resultado):
+            return False
+        if id_evento is not None:
+            self._eventos_novos.append([id_evento, time.time()] + ([resultado] if resultado is not None else []))
+        return True
+
+    def _encerrar_pedido(self, pedido_id: int, motivo: str, substituir: bool = False):
+        # A marca vai no mesmo cache e log dos ids de eventos, com o mesmo TTL.
+        # Sem substituir, vale o primeiro encerramento do pedido.
+        chave = f"encerrado-{pedido_id}"
+        if substituir:
+            self._processados.esquecer(chave)
+        self._registrar_evento(chave, motivo)
+
+    def _encerramento(self, pedido_id: int) -> Optional[str]:
+        # Motivo do encerramento, ou None se o pedido ainda está aberto
+        chave = f"encerrado-{pedido_id}"
+        if not self._processados.contem(chave):
+            return None
+        return self._processados.resultado(chave) or ENCERRADO_LIBERADO
+
+    def ja_processado(self, id_evento: Optional[str]) -> bool:
+        return self._processados.contem(id_evento)
+
+    def resultado_reserva(self, id_evento: Optional[str]) -> Optional[str]:
+        # None quando o evento não foi aplicado ou foi registrado antes de guardar resultados
+        return self._processados.resultado(id_evento)
+
+    def listar(self) -> List[dict]:
+        return [dict(produto) for produto in list(self._produtos.values())]
+
+    def listar_serializado(self) -> bytes:
+        # Reaproveita o JSON da listagem enquanto o estoque não muda
+        with self._listagem_lock:
+            versao = self.versao
+            if self._listagem_versao != versao:
+                self._listagem = json.dumps(self.listar()).encode()
+                self._listagem_versao = versao
+            return self._listagem
+
+    def obter(self, product_id: int) -> Optional[dict]:
+        produto = self._produtos.get(product_id)
+        return dict(produto) if produto else None
+
+    def obter_estoques(self, product_ids: List[int]) -> dict:
+        return {
+            product_id: self._produtos[product_id]["stock"]
+            for product_id in product_ids
+            if product_id in self._produtos
+        }
+
+    def reservas(self) -> int:
+        return len(self._reservas)
+
+    ###############################################################
+
+    def reservar(self, pedido_id: int, product_id: int, quantidade: int, id_evento: Optional[str] = None):
+        with self._trava(product_id):
+            # O id só é registrado no fim, junto com o resultado
+            if self._processados.contem(id_evento):
+                return ESTOQUE_DUPLICADO, None
+            produto = self._produtos.get(product_id)
+            encerramento = self._encerramento(pedido_id)
+            if produto is None:
+                resultado, copia = ESTOQUE_INEXISTENTE, None
+            elif encerramento == ENCERRADO_LIBERADO:
+                resultado, copia = ESTOQUE_ENCERRADO, dict(produto)
+            elif pedido_id in self._reservas or encerramento == ENCERRADO_CONFIRMADO:
+                # O mesmo pedido publicado de novo com outro id de evento
+                resultado, copia = ESTOQUE_OK, dict(produto)
+            elif produto["stock"] < quantidade:
+                resultado, copia = ESTOQUE_INSUFICIENTE, dict(produto)
+            else:
+                produto["stock"] -= quantidade
+                self._nova_versao()
+                if encerramento == ENCERRADO_PAGO:
+                    # O pagamento já foi aprovado: reserva e confirmação num passo só
+                    self._encerrar_pedido(pedido_id, ENCERRADO_CONFIRMADO, substituir=True)
+                else:
+                    self._reservas[pedido_id] = {"product_id": product_id, "quantity": quantidade}
+                resultado, copia = ESTOQUE_OK, dict(produto)
+            if resultado == ESTOQUE_INSUFICIENTE and encerramento == ENCERRADO_PAGO:
+                # Pago, mas sem estoque: a resposta sem_estoque encerra o pedido de vez
+                self._encerrar_pedido(pedido_id, ENCERRADO_LIBERADO, substituir=True)
+            self._registrar_evento(id_evento, resultado)
+        self._gravador.marcar()
+        return resultado, copia
+
+    def confirmar(self, pedido_id: int, product_id: int, id_evento: Optional[str] = None):
+        with self._trava(product_id):
+            if not self._registrar_evento(id_evento):
+                return ESTOQUE_DUPLICADO, None
+            reserva = self._reservas.get(pedido_id)
+            if reserva is None or reserva["product_id"] != product_id:
+                resultado = ESTOQUE_SEM_RESERVA
+            else:
+                # O saldo já foi descontado na reserva; só ela deixa de existir
+                del self._reservas[pedido_id]
+                resultado = ESTOQUE_OK
+            self._encerrar_pedido(pedido_id, ENCERRADO_PAGO if resultado == ESTOQUE_SEM_RESERVA else ENCERRADO_CONFIRMADO)
+            produto = self._produtos.get(product_id)
+            copia = dict(produto) if produto else None
+        self._gravador.marcar()
+        return resultado, copia
+
+    def liberar(self, pedido_id: int, product_id: int, id_evento: Optional[str] = None):
+        with self._trava(product_id):
+            if not self._registrar_evento(id_evento):
+                return ESTOQUE_DUPLICADO, None
+            reserva = self._reservas.get(pedido_id)
+            if reserva is None or reserva["product_id"] != product_id:
+                resultado, copia = ESTOQUE_SEM_RESERVA, None
+            else:
+                del self._reservas[pedido_id]
+                produto = self._produtos.get(product_id)
+                if produto is None:
+                    resultado, copia = ESTOQUE_INEXISTENTE, None
+                else:
+                    produto["stock"] += reserva["quantity"]
+                    self._nova_versao()
+                    resultado, copia = ESTOQUE_OK, dict(produto)
+            self._encerrar_pedido(pedido_id, ENCERRADO_LIBERADO)
+        self._gravador.marcar()
+        return resultado, copia
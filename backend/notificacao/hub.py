@@ -0,0 +1,107 @@
+import asyncio
+import itertools
+import json
+import time
+from collections import deque
+from typing import Optional, Set
+
+POLITICA_DESCARTAR = 'descartar'
+POLITICA_DESCONECTAR = 'desconectar'
+
+###################################################################
+
+class Assinante:
+    __slots__ = ("fila", "client_id", "eventos", "politica", "descartadas")
+
+    def __init__(self, tamanho_buffer: int, client_id: Optional[int], eventos: Optional[Set[str]], politica: str):
+        self.fila: asyncio.Queue = asyncio.Queue(maxsize=tamanho_buffer)
+        self.client_id = client_id
+        self.eventos = eventos
+        self.politica = politica
+        self.descartadas = 0
+
+    def aceita(self, evento: str, client_id) -> bool:
+        if self.eventos is not None and evento not in self.eventos:
+            return False
+        if self.client_id is not None and client_id != self.client_id:
+            return False
+        return True
+
+class HubNotificacoes:
+    # Difunde cada notificação para todos os assinantes SSE conectados.
+    # Roda inteiramente no event loop: cada conexão custa só uma asyncio.Queue limitada,
+    # e a notificação é serializada uma vez e compartilhada entre as filas.
+
+    def __init__(self, tamanho_buffer: int = 100, politica: str = POLITICA_DESCARTAR, tamanho_replay: int = 1000):
+        self._tamanho_buffer = tamanho_buffer
+        self._politica = politica
+        self._assinantes: Set[Assinante] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+        # Ids crescentes e anel com as notificações recentes para o Last-Event-ID.
+        # Os ids partem do relógio em ms para continuarem crescendo após um reinício.
+        self._ids = itertools.count(int(time.time() * 1000))
+        self._replay: deque = deque(maxlen=tamanho_replay)  # (id, evento, client_id, mensagem)
+
+    def iniciar(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+
+    def total_assinantes(self) -> int:
+        return len(self._assinantes)
+
+    def assinar(self, client_id: Optional[int] = None, eventos: Optional[Set[str]] = None,
+                ultimo_id: Optional[int] = None) -> Assinante:
+        assinante = Assinante(self._tamanho_buffer, client_id, eventos, self._politica)
+        if ultimo_id is not None:
+            self._reenviar(assinante, ultimo_id)
+        self._assinantes.add(assinante)
+        return assinante
+
+    def _reenviar(self, assinante: Assinante, ultimo_id: int):
+        # Como tudo roda no event loop, nenhuma notificação entra entre o replay e a assinatura
+        if self._replay and ultimo_id < self._replay[0][0] - 1:
+            print(f"Last-Event-ID {ultimo_id} anterior ao anel de replay; reenviando o que ainda está guardado.")
+        perdidas = [
+            mensagem for id_evento, evento, client_id, mensagem in self._replay
+            if id_evento > ultimo_id and assinante.aceita(evento, client_id)
+        ]
+        # O buffer do assinante limita o replay às notificações mais recentes
+        for mensagem in perdidas[-self._tamanho_buffer:]:
+            assinante.fila.put_nowait(mensagem)
+
+    def remover(self, assinante: Assinante):
+        self._assinantes.discard(assinante)
+
+    def publicar_threadsafe(self, notificacao: dict):
+        # Chamado pela thread consumidora do RabbitMQ
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self.publicar, notificacao)
+
+    def publicar(self, notificacao: dict):
+        evento = notificacao["evento"]
+        dados = notificacao.get("dados")
+        client_id = dados.get("client_id") if isinstance(dados, dict) else None
+        id_evento = next(self._ids)
+        mensagem = f"id: {id_evento}\ndata: {json.dumps(notificacao)}\n\n"
+        self._replay.append((id_evento, evento, client_id, mensagem))
+
+        for assinante in list(self._assinantes):
+            if not assinante.aceita(evento, client_id):
+                continue
+            try:
+                assinante.fila.put_nowait(mensagem)
+            except asyncio.QueueFull:
+                self._tratar_lento(assinante, mensagem)
+
+    def _tratar_lento(self, assinante: Assinante, mensagem: str):
+        assinante.descartadas += 1
+        if assinante.politica == POLITICA_DESCONECTAR:
+            # Esvazia o buffer e encerra o stream; o navegador reconecta sozinho
+            self.remover(assinante)
+            while not assinante.fila.empty():
+                assinante.fila.get_nowait()
+            assinante.fila.put_nowait(None)
+        else:
+            # Descarta a notificação mais antiga para abrir espaço
+            assinante.fila.get_nowait()
+            assinante.fila.put_nowait(mensagem)
@@ -1,13 +1,21 @@
+import asyncio
+import os
 import threading
-import pika # type: ignore
-import json
-import queue
-from fastapi import FastAPI
+import time
+from typing import Optional, Set
+from fastapi import FastAPI, Header
 from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.concurrency import run_in_threadpool
+from comum.codec import ErroCodec, decodificar_mensagem
+from comum.dedup import CacheIdempotencia, id_do_evento
+from comum.metricas import instrumentar_app, medidor
+from comum.rastreamento import atributos_mensagem, correlacao_da_mensagem, criar_rastreador
+from comum.transporte import Mensagem, obter_transporte, fechar_transporte
+from hub import HubNotificacoes
 
 app = FastAPI()
+# Latência por rota e GET /metrics no formato do Prometheus
+instrumentar_app(app)
 
 app.add_middleware(
     CORSMiddleware,
@@ -23,11 +31,6 @@ TOPIC_PEDIDOS_ENVIADOS = 'pedidos.enviados'
 TOPIC_PAGAMENTOS_APROVADOS = 'pagamentos.aprovados'
 TOPIC_PAGAMENTOS_RECUSADOS = 'pagamentos.recusados'
 
-RABBITMQ_HOST = 'rabbitmq'
-RABBITMQ_USER = "admin"
-RABBITMQ_PASSWORD = "admin"
-CREDENTIALS = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASSWORD)
-
 FILAS = {
     "Pedidos_Criados": TOPIC_PEDIDOS_CRIADOS,
     "Pedidos_Excluídos": TOPIC_PEDIDOS_EXCLUIDOS,
@@ -36,7 +39,19 @@ FILAS = {
     "Pagamentos_Recusados": TOPIC_PAGAMENTOS_RECUSADOS
 }
 
-notificacao_queue = queue.Queue()
+# Notificações guardadas por assinante antes de aplicar a política de consumidor lento
+SSE_BUFFER = int(os.getenv("SSE_BUFFER", "100"))
+# 'descartar' (perde as mais antigas) ou 'desconectar' (encerra o stream)
+SSE_POLITICA = os.getenv("SSE_POLITICA", "descartar")
+SSE_KEEPALIVE = float(os.getenv("SSE_KEEPALIVE", "15"))
+# Notificações recentes mantidas para reenviar a clientes que reconectam com Last-Event-ID
+SSE_REPLAY = int(os.getenv("SSE_REPLAY", "1000"))
+
+eventos_processados = CacheIdempotencia()
+rastreador = criar_rastreador("notificacao")
+
+hub_notificacoes = HubNotificacoes(tamanho_buffer=SSE_BUFFER, politica=SSE_POLITICA, tamanho_replay=SSE_REPLAY)
+medidor("sse_assinantes", "Clientes SSE conectados", funcao=hub_notificacoes.total_assinantes)
 
 ###################################################################
 
@@ -44,73 +59,87 @@ def notificar_evento(evento, routing_key):
     try:
         print(f"Notificação recebida na chave '{routing_key}': {evento}")
 
-        # Enfileira a notificação para ser enviada via SSE
-        notificacao_queue.put({
+        # Difunde a notificação para todos os clientes SSE conectados
+        hub_notificacoes.publicar_threadsafe({
             "evento": routing_key,
             "dados": evento
         })
     except Exception as e:
         print(f"Erro ao processar a notificação: {str(e)}")
 
-def callback(ch, method, properties, body):
+def callback(mensagem: Mensagem):
+    recebido_em = time.time()
+    # Reentregas não geram uma segunda notificação para os clientes
+    if not eventos_processados.registrar(id_do_evento(mensagem.propriedades)):
+        return
+
     try:
-        mensagem = json.loads(body)
-        print(f"Mensagem recebida da fila '{method.routing_key}': {mensagem}")
-        notificar_evento(mensagem, method.routing_key)
-    except json.JSONDecodeError:
-        print(f"Erro ao decodificar mensagem na fila '{method.routing_key}'.")
+        evento = decodificar_mensagem(mensagem.propriedades, mensagem.corpo).para_dict()
+        print(f"Mensagem recebida da fila '{mensagem.routing_key}': {evento}")
+        notificar_evento(evento, mensagem.routing_key)
+        rastreador.registrar(correlacao_da_mensagem(mensagem, evento["id"]), "notificacao.difusao", recebido_em,
+                             **atributos_mensagem(mensagem, recebido_em, pedido_id=evento["id"]))
+    except ErroCodec as e:
+        print(f"Erro ao decodificar mensagem na fila '{mensagem.routing_key}': {e}")
     except Exception as e:
         print(f"Erro ao processar mensagem: {str(e)}")
 
 def consumir_filas():
     try:
-        connection = pika.BlockingConnection(pika.ConnectionParameters(
-            host=RABBITMQ_HOST, credentials=CREDENTIALS))
-        channel = connection.channel()
-        channel.exchange_declare(exchange='default', exchange_type='topic')
-
         for fila, routing_key in FILAS.items():
-            result = channel.queue_declare(queue='', exclusive=True)
-            fila_temporaria = result.method.queue
-            channel.queue_bind(exchange='default',
-                               queue=fila_temporaria, routing_key=routing_key)
-
-            channel.basic_consume(
-                queue=fila_temporaria, on_message_callback=callback, auto_ack=True
-            )
-
             print(f"Consumindo mensagens da fila: {fila} (chave: {routing_key})")
 
         print("Aguardando mensagens de todas as filas. Para sair pressione CTRL+C")
-        channel.start_consuming()
+        # Sem grupo: cada réplica tem os próprios clientes SSE e precisa de todas as notificações
+        obter_transporte().consumir(list(FILAS.values()), callback, auto_ack=True)
 
     except Exception as e:
         print(f"Erro ao configurar o consumidor: {str(e)}")
 
 # SSE Generator: Gera mensagens contínuas para o cliente
-async def sse_notificacoes():
-    while True:
-        try:
-            # Obtém a próxima notificação da fila
-            notificacao = await run_in_threadpool(notificacao_queue.get)
-            if notificacao:
-                # Envia como evento no formato SSE
-                yield f"data: {json.dumps(notificacao)}\n\n"
-        except Exception as e:
-            print(f"Erro no SSE: {str(e)}")
-            break
+async def sse_notificacoes(client_id: Optional[int], eventos: Optional[Set[str]], ultimo_id: Optional[int]):
+    assinante = hub_notificacoes.assinar(client_id=client_id, eventos=eventos, ultimo_id=ultimo_id)
+    try:
+        while True:
+            try:
+                mensagem = await asyncio.wait_for(assinante.fila.get(), timeout=SSE_KEEPALIVE)
+            except asyncio.TimeoutError:
+                # Comentário SSE para manter a conexão viva atravessando proxies
+                yield ": keepalive\n\n"
+                continue
+            if mensagem is None:
+                print(f"Assinante SSE desconectado por lentidão ({assinante.descartadas} notificações perdidas).")
+                break
+            yield mensagem
+    finally:
+        hub_notificacoes.remover(assinante)
 
 ###################################################################
 
-# Endpoint SSE para enviar notificações ao cliente
+# Endpoint SSE para enviar notificações ao cliente.
+# Filtros opcionais: client_id e eventos (chaves de roteamento separadas por vírgula).
+# Ao reconectar, o navegador envia Last-Event-ID e recebe só o que perdeu.
 @app.get("/notificacoes")
-async def notificacoes_sse():
-    return StreamingResponse(sse_notificacoes(), media_type="text/event-stream")
+async def notificacoes_sse(client_id: Optional[int] = None, eventos: Optional[str] = None,
+                           last_event_id: Optional[str] = Header(None)):
+    filtro_eventos = {evento.strip() for evento in eventos.split(",") if evento.strip()} if eventos else None
+    try:
+        ultimo_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        ultimo_id = None
+    return StreamingResponse(sse_notificacoes(client_id, filtro_eventos, ultimo_id), media_type="text/event-stream")
 
 @app.get("/")
 def root():
     return {"message": "Serviço de Notificação com SSE está rodando"}
 
 @app.on_event("startup")
-def start_rabbitmq_consumer():
+async def start_rabbitmq_consumer():
+    hub_notificacoes.iniciar(asyncio.get_running_loop())
+    rastreador.iniciar()
     threading.Thread(target=consumir_filas, daemon=True).start()
+
+@app.on_event("shutdown")
+def encerrar_recursos():
+    rastreador.parar()
+    fechar_transporte()
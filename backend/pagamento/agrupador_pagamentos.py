@@ -0,0 +1,85 @@
+import asyncio
+from typing import Awaitable, Callable, List, Optional
+
+###################################################################
+
+class ErroAutorizacao(Exception):
+    pass
+
+class AgrupadorPagamentos:
+    # Junta as autorizações pedidas ao mesmo tempo em micro-lotes: o lote é enviado
+    # quando chega a `max_lote` pagamentos ou `espera` segundos após o primeiro.
+    # Cada chamador recebe apenas a decisão da sua transação. Roda no event loop da aplicação.
+
+    def __init__(self, enviar_lote: Callable[[List[dict]], Awaitable[List[dict]]],
+                 max_lote: int = 32, espera: float = 0.02):
+        self._enviar_lote = enviar_lote
+        self._max_lote = max_lote
+        self._espera = espera
+
+        self._pendentes: list = []  # (dados_pagamento, futuro)
+        self._temporizador: Optional[asyncio.TimerHandle] = None
+        self._envios: set = set()
+        self._em_envio = 0
+
+        self.lotes = 0
+        self.pagamentos = 0
+
+    async def autorizar(self, dados_pagamento: dict) -> dict:
+        loop = asyncio.get_running_loop()
+        futuro = loop.create_future()
+        self._pendentes.append((dados_pagamento, futuro))
+
+        if len(self._pendentes) >= self._max_lote:
+            self._despachar()
+        elif self._temporizador is None:
+            self._temporizador = loop.call_later(self._espera, self._despachar)
+
+        return await futuro
+
+    def pendentes(self) -> int:
+        # Pagamentos aguardando o próximo lote ou a resposta do lote já enviado
+        return len(self._pendentes) + self._em_envio
+
+    async def fechar(self):
+        self._despachar()
+        if self._envios:
+            await asyncio.gather(*self._envios, return_exceptions=True)
+
+    ###############################################################
+
+    def _despachar(self):
+        if self._temporizador is not None:
+            self._temporizador.cancel()
+            self._temporizador = None
+
+        lote, self._pendentes = self._pendentes, []
+        if not lote:
+            return
+        tarefa = asyncio.ensure_future(self._enviar(lote))
+        self._envios.add(tarefa)
+        tarefa.add_done_callback(self._envios.discard)
+
+    async def _enviar(self, lote: list):
+        self.lotes += 1
+        self.pagamentos += len(lote)
+        self._em_envio += len(lote)
+        try:
+            respostas = await self._enviar_lote([dados for dados, _ in lote])
+        except Exception as e:
+            for _, futuro in lote:
+                if not futuro.done():
+                    futuro.set_exception(e)
+            return
+        finally:
+            self._em_envio -= len(lote)
+
+        por_transacao = {resposta.get("transacao_id"): resposta for resposta in respostas}
+        for dados, futuro in lote:
+            if futuro.done():
+                continue
+            resposta = por_transacao.get(dados["transacao_id"])
+            if resposta is None:
+                futuro.set_exception(ErroAutorizacao(f"Transação {dados['transacao_id']} ausente na resposta do lote"))
+            else:
+                futuro.set_result(resposta)
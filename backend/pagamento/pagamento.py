@@ -1,130 +1,190 @@
+import asyncio
+import functools
+import os
 import threading
 import time
 import httpx
-import pika # type: ignore
 import json
 from fastapi import FastAPI
-import requests # type: ignore
+from comum.codec import ErroCodec, EventoPedido, decodificar_mensagem
+from comum.dedup import CacheIdempotencia, id_do_evento
+from comum.metricas import instrumentar_app, medidor
+from comum.persistencia import GravadorAtrasado
+from comum.rastreamento import (
+    CABECALHO_CORRELACAO, atributos_mensagem, correlacao_da_mensagem, criar_rastreador,
+)
+from comum.transporte import Mensagem, obter_transporte, fechar_transporte
+from agrupador_pagamentos import AgrupadorPagamentos, ErroAutorizacao
 
 app = FastAPI()
-
-RABBITMQ_HOST = 'rabbitmq'
-RABBITMQ_USER = "admin"
-RABBITMQ_PASSWORD = "admin"
-CREDENTIALS = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASSWORD)
+# Latência por rota e GET /metrics no formato do Prometheus
+instrumentar_app(app)
 
 TOPIC_PEDIDOS_CRIADOS = 'pedidos.criados'
 TOPIC_PEDIDOS_EXCLUIDOS = 'pedidos.excluídos'
 TOPIC_PEDIDOS_ENVIADOS = 'pedidos.enviados'
 TOPIC_PAGAMENTOS_APROVADOS = 'pagamentos.aprovados'
 TOPIC_PAGAMENTOS_RECUSADOS = 'pagamentos.recusados'
+# O pagamento só começa depois da reserva: pedido sem estoque não é cobrado nem enviado
+TOPIC_ESTOQUE_RESERVAS = 'estoque.reservas'
 
-WEBHOOK_URL = "http://sistemapgto:8000/webhook/pagamento"
+RESERVA_CONFIRMADA = 'reservado'
 
-###################################################################
+WEBHOOK_LOTE_URL = os.getenv("WEBHOOK_LOTE_URL", "http://sistemapgto:8000/webhook/pagamento/lote")
+WEBHOOK_TIMEOUT = float(os.getenv("WEBHOOK_TIMEOUT", "10"))
 
-def enviar_evento(evento, routing_key):
-    connection = pika.BlockingConnection(pika.ConnectionParameters(
-        host=RABBITMQ_HOST, credentials=CREDENTIALS))
-    channel = connection.channel()
-    channel.exchange_declare(exchange='default', exchange_type='topic')
+# Pagamentos em andamento ao mesmo tempo; também é o prefetch do consumidor
+PAGAMENTO_CONCORRENCIA = int(os.getenv("PAGAMENTO_CONCORRENCIA", "32"))
+PAGAMENTO_ATRASO = float(os.getenv("PAGAMENTO_ATRASO", "5"))
+# Micro-lotes de autorização: tamanho máximo e espera após o primeiro pagamento do lote
+PAGAMENTO_LOTE_MAXIMO = int(os.getenv("PAGAMENTO_LOTE_MAXIMO", str(PAGAMENTO_CONCORRENCIA)))
+PAGAMENTO_LOTE_ESPERA = float(os.getenv("PAGAMENTO_LOTE_ESPERA", "0.02"))
+PAGAMENTOS_PROCESSADOS_PATH = os.getenv("PAGAMENTOS_PROCESSADOS_PATH", "pagamentos_processados.json")
+# Réplicas do mesmo grupo dividem as mensagens em filas duráveis compartilhadas; vazio volta às filas exclusivas
+GRUPO_CONSUMO = os.getenv("GRUPO_CONSUMO", "pagamento")
 
-    channel.exchange_declare(exchange='default', exchange_type='topic')
+# Os pagamentos rodam no event loop da aplicação; a thread consumidora só despacha e confirma
+loop_pagamentos = None
+cliente_webhook = None
+agrupador_pagamentos = None
 
-    # Introduz um delay de 5 simulando loading do pgto
-    print("Aguardando 5 segundos antes de enviar o evento...")
-    time.sleep(5)
+def pagamentos_pendentes() -> int:
+    return agrupador_pagamentos.pendentes() if agrupador_pagamentos is not None else 0
 
-    channel.basic_publish(
-        exchange='default', 
-        routing_key=routing_key, 
-        body=json.dumps(evento)
-    )
+medidor("pagamentos_pendentes", "Pagamentos aguardando a autorização do sistema de pagamento",
+        funcao=pagamentos_pendentes)
+
+# Um pedido reentregue não pode ser cobrado duas vezes; os ids sobrevivem a reinícios junto
+# com a decisão do pagamento, que é republicada sem chamar o webhook se a publicação falhar
+pagamentos_processados = CacheIdempotencia()
+gravador_processados = GravadorAtrasado(PAGAMENTOS_PROCESSADOS_PATH, pagamentos_processados.snapshot)
+
+rastreador = criar_rastreador("pagamento")
+# Correlação de cada transação em autorização, enviada ao sistemapgto junto com o lote
+correlacoes_por_transacao = {}
+
+###################################################################
+
+async def enviar_evento(evento, routing_key, correlacao=None, id_evento=None):
+    # Introduz um delay simulando loading do pgto, sem ocupar o consumidor
+    print(f"Aguardando {PAGAMENTO_ATRASO} segundos antes de enviar o evento...")
+    with rastreador.span(correlacao, "pagamento.atraso", pedido_id=evento.id, atraso=PAGAMENTO_ATRASO):
+        await asyncio.sleep(PAGAMENTO_ATRASO)
+
+    await obter_transporte().publicar_async(evento, routing_key, id_evento=id_evento, correlacao=correlacao)
 
     print(
         f"Evento enviado para a exchange 'default' com chave {routing_key}: {evento}")
-    connection.close()
 
-def callback(ch, method, properties, body):
+async def enviar_lote_webhook(lote):
+    print(f"Enviando lote de {len(lote)} pagamentos para o sistema de pagamento")
+    inicio = time.time()
+    # Uma correlação por pagamento, na ordem do lote
+    correlacoes = [correlacoes_por_transacao.get(dados["transacao_id"]) for dados in lote]
+    response = await cliente_webhook.post(
+        WEBHOOK_LOTE_URL, json=lote,
+        headers={CABECALHO_CORRELACAO: ",".join(correlacao or "" for correlacao in correlacoes)})
+    response.raise_for_status()
+    for dados, correlacao in zip(lote, correlacoes):
+        rastreador.registrar(correlacao, "pagamento.webhook", inicio,
+                             transacao_id=dados["transacao_id"], tamanho_lote=len(lote))
+    return response.json()["resultados"]
+
+async def autorizar_pagamento(pedido: EventoPedido, correlacao=None) -> str:
+    # Retorna a decisão: 'aprovado', 'recusado' ou 'erro_pagamento'
+    dados_pagamento = {
+        "transacao_id": f"pgto_{pedido.id}",
+        "client_id": pedido.client_id,
+        "product_id": pedido.product_id,
+        "product_name": pedido.product_name,
+        "quantity": pedido.quantity,
+    }
+
+    print(f"Enviando dados para o sistema de pagamento: {dados_pagamento}")
+
+    correlacoes_por_transacao[dados_pagamento["transacao_id"]] = correlacao
     try:
-        pedido = json.loads(body)
-        print(f"Pedido recebido para processamento: {pedido}")
+        # A autorização segue no próximo micro-lote junto com os pedidos que chegarem ao mesmo tempo
+        with rastreador.span(correlacao, "pagamento.autorizacao", pedido_id=pedido.id):
+            resposta_pagamento = await agrupador_pagamentos.autorizar(dados_pagamento)
+    except httpx.HTTPStatusError as e:
+        print(f"Erro ao conectar com o webhook do sistema de pagamento. Código {e.response.status_code}")
+        resposta_pagamento = None
+    except (httpx.RequestError, ErroAutorizacao) as e:
+        print(f"Erro ao conectar com o webhook do sistema de pagamento: {e}")
+        resposta_pagamento = None
+    finally:
+        correlacoes_por_transacao.pop(dados_pagamento["transacao_id"], None)
+
+    if resposta_pagamento is None:
+        return "erro_pagamento"
+    print(f"Resposta do sistema de pagamento: {resposta_pagamento}")
+    return "aprovado" if resposta_pagamento.get("status") == "aprovado" else "recusado"
+
+async def processar_pedido(pedido: EventoPedido, id_evento, correlacao=None):
+    decisao = pagamentos_processados.resultado(id_evento)
+    if decisao is None:
+        decisao = await autorizar_pagamento(pedido, correlacao)
+        # Guardada antes da publicação: uma nova tentativa só republica, sem cobrar de novo
+        pagamentos_processados.guardar_resultado(id_evento, decisao)
+        gravador_processados.marcar()
+    else:
+        print(f"Pagamento do pedido {pedido.id} já decidido ({decisao}); republicando a decisão.")
+
+    topico = TOPIC_PAGAMENTOS_APROVADOS if decisao == "aprovado" else TOPIC_PAGAMENTOS_RECUSADOS
+    # O id fixo por pedido deixa os consumidores descartarem a decisão republicada
+    await enviar_evento(pedido.com_status(decisao), topico, correlacao, id_evento=f"pagamento-{pedido.id}")
+    print(f"Pagamento {decisao}. Pedido enviado para a fila: {topico}")
+
+def confirmar_mensagem(mensagem: Mensagem, id_evento, rastro, futuro):
+    # Executado na thread que concluiu o pagamento
+    erro = futuro.exception()
+    correlacao, recebido_em, pedido_id = rastro
+    rastreador.registrar(correlacao, "pagamento.evento", recebido_em,
+                         **atributos_mensagem(mensagem, recebido_em, pedido_id=pedido_id, sucesso=erro is None))
+    if erro is None:
+        gravador_processados.marcar()
+        mensagem.confirmar()
+    else:
+        # Com a decisão já tomada, a nova tentativa só repete a publicação
+        if pagamentos_processados.resultado(id_evento) is None:
+            pagamentos_processados.esquecer(id_evento)
+        # Uma nova tentativa por mensagem; na segunda falha ela vai para as mortas
+        print(f"Erro inesperado: {erro}")
+        mensagem.rejeitar(reenfileirar=not mensagem.reentregue)
+
+def callback(mensagem: Mensagem):
+    recebido_em = time.time()
+    id_evento = id_do_evento(mensagem.propriedades)
+    # Um evento repetido cuja decisão já existe segue adiante só para republicá-la
+    if not pagamentos_processados.registrar(id_evento) and pagamentos_processados.resultado(id_evento) is None:
+        print(f"Evento {id_evento} repetido ignorado.")
+        mensagem.confirmar()
+        return
 
-        if not all(key in pedido for key in ["id", "client_id", "product_id", "product_name", "quantity", "status"]):
-            print("Erro: Formato de pedido inválido.")
-            return
-
-        dados_pagamento = {
-            "transacao_id": f"pgto_{pedido['id']}",
-            "client_id": pedido["client_id"],
-            "product_id": pedido["product_id"],
-            "product_name": pedido["product_name"],
-            "quantity": pedido["quantity"],
-        }
-
-        print(f"Enviando dados para o sistema de pagamento: {dados_pagamento}")
-
-        response = requests.post(WEBHOOK_URL, json=dados_pagamento)
-
-        if response.status_code == 200:
-            resposta_pagamento = response.json()
-            print(f"Resposta do sistema de pagamento: {resposta_pagamento}")
-
-            if resposta_pagamento.get("status") == "aprovado":
-                pedido_atualizado = {
-                    "id": pedido["id"],
-                    "client_id": pedido["client_id"],
-                    "product_id": pedido["product_id"],
-                    "product_name": pedido["product_name"],
-                    "quantity": pedido["quantity"],
-                    "status": "aprovado",
-                }
-                enviar_evento(pedido_atualizado, TOPIC_PAGAMENTOS_APROVADOS)
-                print(f"Pagamento aprovado. Pedido enviado para a fila: {TOPIC_PAGAMENTOS_APROVADOS}")
-            else:
-                pedido_atualizado = {
-                    "id": pedido["id"],
-                    "client_id": pedido["client_id"],
-                    "product_id": pedido["product_id"],
-                    "product_name": pedido["product_name"],
-                    "quantity": pedido["quantity"],
-                    "status": "recusado",
-                }
-                enviar_evento(pedido_atualizado, TOPIC_PAGAMENTOS_RECUSADOS)
-                print(f"Pagamento recusado. Pedido enviado para a fila: {TOPIC_PAGAMENTOS_RECUSADOS}")
-        else:
-            print(f"Erro ao conectar com o webhook do sistema de pagamento. Código {response.status_code}")
-            pedido_erro = {
-                "id": pedido["id"],
-                "client_id": pedido["client_id"],
-                "product_id": pedido["product_id"],
-                "product_name": pedido["product_name"],
-                "quantity": pedido["quantity"],
-                "status": "erro_pagamento",
-            }
-            enviar_evento(pedido_erro, TOPIC_PAGAMENTOS_RECUSADOS)
-            print(f"Erro no pagamento. Pedido enviado para a fila: {TOPIC_PAGAMENTOS_RECUSADOS}")
-
-    except json.JSONDecodeError:
-        print("Erro ao decodificar a mensagem recebida.")
-    except Exception as e:
-        print(f"Erro inesperado: {e}")
+    try:
+        pedido = decodificar_mensagem(mensagem.propriedades, mensagem.corpo)
+        print(f"Pedido recebido para processamento: {pedido}")
+    except ErroCodec as e:
+        print(f"Erro: Formato de pedido inválido. {e}")
+        mensagem.confirmar()
+        return
 
-def consumir_pedidos():
-    connection = pika.BlockingConnection(pika.ConnectionParameters(
-        host=RABBITMQ_HOST, credentials=CREDENTIALS))
-    channel = connection.channel()
-    channel.exchange_declare(exchange='default', exchange_type='topic')
+    if pedido.reserva != RESERVA_CONFIRMADA:
+        print(f"Pedido {pedido.id} sem estoque reservado ({pedido.reserva}); não será cobrado.")
+        mensagem.confirmar()
+        return
 
-    result = channel.queue_declare(queue='', exclusive=True)
-    selected = result.method.queue
-    channel.queue_bind(exchange='default',
-                       queue=selected, routing_key=TOPIC_PEDIDOS_CRIADOS)
-    channel.basic_consume(
-        queue=selected, on_message_callback=callback, auto_ack=True)
+    correlacao = correlacao_da_mensagem(mensagem, pedido.id)
+    futuro = asyncio.run_coroutine_threadsafe(processar_pedido(pedido, id_evento, correlacao), loop_pagamentos)
+    futuro.add_done_callback(functools.partial(
+        confirmar_mensagem, mensagem, id_evento, (correlacao, recebido_em, pedido.id)))
 
-    print('Aguardando mensagens na fila Pedidos_Criados. Para sair pressione CTRL+C')
-    channel.start_consuming()
+def consumir_pedidos():
+    print(f'Aguardando as reservas do estoque ({PAGAMENTO_CONCORRENCIA} pagamentos simultâneos). Para sair pressione CTRL+C')
+    # Limita as mensagens sem ack ao número de pagamentos simultâneos
+    obter_transporte().consumir([TOPIC_ESTOQUE_RESERVAS], callback, prefetch=PAGAMENTO_CONCORRENCIA,
+                                grupo=GRUPO_CONSUMO or None)
 
 ###################################################################
 
@@ -133,5 +193,33 @@ def root():
     return {"message": "O consumidor está rodando"}
 
 @app.on_event("startup")
-def start_rabbitmq_consumer():
+async def start_rabbitmq_consumer():
+    global loop_pagamentos, cliente_webhook, agrupador_pagamentos
+    loop_pagamentos = asyncio.get_running_loop()
+    if os.path.exists(PAGAMENTOS_PROCESSADOS_PATH):
+        try:
+            with open(PAGAMENTOS_PROCESSADOS_PATH, 'r') as file:
+                pagamentos_processados.carregar(json.load(file))
+        except (OSError, ValueError, TypeError) as e:
+            # JSON corrompido ou ilegível (ValueError inclui o JSONDecodeError)
+            print(f"Erro ao carregar {PAGAMENTOS_PROCESSADOS_PATH}: {e}. Iniciando sem pagamentos processados.")
+    gravador_processados.iniciar()
+    rastreador.iniciar()
+    cliente_webhook = httpx.AsyncClient(
+        timeout=WEBHOOK_TIMEOUT,
+        limits=httpx.Limits(max_connections=PAGAMENTO_CONCORRENCIA),
+    )
+    agrupador_pagamentos = AgrupadorPagamentos(
+        enviar_lote_webhook, max_lote=PAGAMENTO_LOTE_MAXIMO, espera=PAGAMENTO_LOTE_ESPERA)
+
     threading.Thread(target=consumir_pedidos, daemon=True).start()
+
+@app.on_event("shutdown")
+async def encerrar_recursos():
+    if agrupador_pagamentos is not None:
+        await agrupador_pagamentos.fechar()
+    fechar_transporte()
+    gravador_processados.parar()
+    rastreador.parar()
+    if cliente_webhook is not None:
+        await cliente_webhook.aclose()
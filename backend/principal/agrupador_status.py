@@ -0,0 +1,96 @@
+import threading
+import time
+from typing import Callable, List, Optional
+
+from repositorio_pedidos import RepositorioPedidos
+
+###################################################################
+
+class AgrupadorStatus:
+    # Group commit das mudanças de status: os eventos consumidos são acumulados por até
+    # `janela` segundos (ou até `max_lote` eventos) e gravados numa única transação.
+    # O callback de cada evento só roda depois do commit do seu lote, e é nele que o
+    # consumidor dá o ack; uma falha na gravação chega ao callback como exceção.
+
+    def __init__(self, repositorio: RepositorioPedidos, janela: float = 0.005, max_lote: int = 256):
+        self._repositorio = repositorio
+        self._janela = janela
+        self._max_lote = max_lote
+
+        self._fila: list = []  # (evento, id_evento, ao_persistir)
+        self._cond = threading.Condition()
+        self._parando = False
+        self._thread: Optional[threading.Thread] = None
+
+        self.lotes = 0
+        self.eventos = 0
+
+    def iniciar(self):
+        self._thread = threading.Thread(target=self._executar, name="agrupador-status", daemon=True)
+        self._thread.start()
+
+    def parar(self):
+        with self._cond:
+            self._parando = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def enviar(self, evento: dict, id_evento: Optional[str],
+               ao_persistir: Callable[[Optional[bool], Optional[Exception]], None]):
+        with self._cond:
+            if self._parando:
+                ao_persistir(None, RuntimeError("Agrupador de status encerrado"))
+                return
+            self._fila.append((evento, id_evento, ao_persistir))
+            if len(self._fila) == 1 or len(self._fila) >= self._max_lote:
+                self._cond.notify()
+
+    def estatisticas(self) -> dict:
+        return {
+            "lotes": self.lotes,
+            "eventos": self.eventos,
+            "media_por_lote": self.eventos / self.lotes if self.lotes else 0.0,
+        }
+
+    ###############################################################
+
+    def _proximo_lote(self) -> List[tuple]:
+        with self._cond:
+            while not self._fila and not self._parando:
+                self._cond.wait()
+            if not self._fila:
+                return []
+
+            # O primeiro evento abre a janela; os que chegarem dentro dela entram no mesmo lote
+            limite = time.monotonic() + self._janela
+            while len(self._fila) < self._max_lote and not self._parando:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                self._cond.wait(restante)
+
+            lote, self._fila = self._fila[:self._max_lote], self._fila[self._max_lote:]
+            return lote
+
+    def _executar(self):
+        while True:
+            lote = self._proximo_lote()
+            if not lote:
+                return
+            try:
+                resultados = self._repositorio.atualizar_status_lote(
+                    [(evento, id_evento) for evento, id_evento, _ in lote])
+                erro = None
+            except Exception as e:
+                print(f"Erro ao gravar lote de {len(lote)} status: {e}")
+                resultados, erro = [None] * len(lote), e
+
+            self.lotes += 1
+            self.eventos += len(lote)
+            for (_, _, ao_persistir), resultado in zip(lote, resultados):
+                try:
+                    ao_persistir(resultado, erro)
+                except Exception as e:
+                    print(f"Erro no callback do lote de status: {e}")
@@ -1,13 +1,32 @@
+import functools
 import os
-import pika # type: ignore
 import json
 import httpx
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from typing import List, Optional
+import hashlib
+import time
+from fastapi import Body, FastAPI, Header, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ValidationError
+from typing import List, Literal, Optional
 from fastapi.middleware.cors import CORSMiddleware
+from comum.ids import GeradorIds
+from comum.transporte import Mensagem, obter_transporte, fechar_transporte
+from repositorio_pedidos import RepositorioPedidos, STATUS_SEM_ESTOQUE, criar_repositorio_pedidos
+from repositorio_carrinho import RepositorioCarrinho, criar_repositorio_carrinho
+from clientes_http import PoolClientesHttp, VerificadorProntidao
+from agrupador_status import AgrupadorStatus
+from comum.cache import CacheSingleFlight
+from comum.codec import ErroCodec, decodificar_mensagem
+from comum.dedup import CacheIdempotencia, id_do_evento
+from comum.etag import gerar_etag, etag_confere
+from comum.metricas import instrumentar_app
+from comum.rastreamento import (
+    CABECALHO_CORRELACAO, ColetorSpans, Rastreador, atributos_mensagem, correlacao_da_mensagem, nova_correlacao,
+)
 
 app = FastAPI()
+# Latência por rota e GET /metrics no formato do Prometheus
+instrumentar_app(app)
 
 app.add_middleware(
     CORSMiddleware,
@@ -15,26 +34,73 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"], 
     allow_headers=["*"], 
+    expose_headers=["ETag", "Link", "X-Proximo-Cursor"],
 )
 
-RABBITMQ_HOST = 'rabbitmq' 
-RABBITMQ_USER = "admin"
-RABBITMQ_PASSWORD = "admin"
-CREDENTIALS = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASSWORD)
-
 TOPIC_PEDIDOS_CRIADOS = 'pedidos.criados'
 TOPIC_PEDIDOS_EXCLUIDOS = 'pedidos.excluídos'
 TOPIC_PEDIDOS_ENVIADOS = 'pedidos.enviados'
 TOPIC_PAGAMENTOS_APROVADOS = 'pagamentos.aprovados'
 TOPIC_PAGAMENTOS_RECUSADOS = 'pagamentos.recusados'
+TOPIC_ESTOQUE_RESERVAS = 'estoque.reservas'
+
+RESERVA_CONFIRMADA = 'reservado'
+
+STATUS_POR_TOPICO = {
+    TOPIC_PAGAMENTOS_APROVADOS: "aprovado",
+    TOPIC_PAGAMENTOS_RECUSADOS: "recusado",
+    TOPIC_PEDIDOS_ENVIADOS: "enviado",
+}
+
+ESTOQUE_SERVICE_URL = os.getenv("ESTOQUE_SERVICE_URL", "http://estoque:8000")
+NOTIFICACAO_SERVICE_URL = os.getenv("NOTIFICACAO_SERVICE_URL", "http://notificacao:8000")
+ENTREGA_SERVICE_URL = os.getenv("ENTREGA_SERVICE_URL", "http://entrega:8000")
+PAGAMENTO_SERVICE_URL = os.getenv("PAGAMENTO_SERVICE_URL", "http://pagamento:8000")
+
+HTTP_MAX_CONEXOES_POR_HOST = int(os.getenv("HTTP_MAX_CONEXOES_POR_HOST", "50"))
+HTTP_MAX_KEEPALIVE_POR_HOST = int(os.getenv("HTTP_MAX_KEEPALIVE_POR_HOST", "20"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "5"))
+PRONTIDAO_INTERVALO = float(os.getenv("PRONTIDAO_INTERVALO", "10"))
+PRODUTOS_CACHE_TTL = float(os.getenv("PRODUTOS_CACHE_TTL", "5"))
+PEDIDOS_LIMITE_PADRAO = int(os.getenv("PEDIDOS_LIMITE_PADRAO", "100"))
+PEDIDOS_LIMITE_MAXIMO = int(os.getenv("PEDIDOS_LIMITE_MAXIMO", "1000"))
+# Máximo de pedidos aceitos por chamada de POST /pedidos/lote
+PEDIDOS_LOTE_MAXIMO = int(os.getenv("PEDIDOS_LOTE_MAXIMO", "1000"))
+# Group commit das mudanças de status: janela em segundos e tamanho máximo do lote.
+# Com janela 0 o lote é o que chegou enquanto o commit anterior estava em andamento.
+STATUS_LOTE_JANELA = float(os.getenv("STATUS_LOTE_JANELA", "0.005"))
+STATUS_LOTE_MAXIMO = int(os.getenv("STATUS_LOTE_MAXIMO", "256"))
+PRINCIPAL_PREFETCH = int(os.getenv("PRINCIPAL_PREFETCH", str(STATUS_LOTE_MAXIMO * 4)))
+
+# Serviços que antes eram "acordados" a cada pedido; agora só têm a prontidão monitorada
+SERVICOS_DEPENDENTES = [NOTIFICACAO_SERVICE_URL, PAGAMENTO_SERVICE_URL, ENTREGA_SERVICE_URL]
+
+pool_http = PoolClientesHttp(
+    [ESTOQUE_SERVICE_URL] + SERVICOS_DEPENDENTES,
+    max_conexoes=HTTP_MAX_CONEXOES_POR_HOST,
+    max_keepalive=HTTP_MAX_KEEPALIVE_POR_HOST,
+    timeout=HTTP_TIMEOUT,
+)
+verificador_prontidao = VerificadorProntidao(pool_http, SERVICOS_DEPENDENTES, intervalo=PRONTIDAO_INTERVALO)
+
+# Catálogo do estoque; invalidado pelos eventos que alteram o estoque
+cache_produtos = CacheSingleFlight(ttl=PRODUTOS_CACHE_TTL)
+# Último catálogo recebido do estoque, usado para revalidar com If-None-Match
+ultimo_catalogo = {"etag": None, "corpo": None}
+
+gerador_ids_pedidos = GeradorIds()
 
-ESTOQUE_SERVICE_URL = 'http://estoque:8000'
-NOTIFICACAO_SERVICE_URL = 'http://notificacao:8000'
-ENTREGA_SERVICE_URL = 'http://entrega:8000'
-PAGAMENTO_SERVICE_URL = 'http://pagamento:8000'
+# Filtro em memória das reentregas; a fonte de verdade é a tabela eventos_processados
+eventos_processados = CacheIdempotencia()
 
-CARRINHO_FILE_PATH = "carrinho.json"
-PEDIDOS_FILE_PATH = 'pedidos.json'
+# O principal é o coletor dos spans de todos os serviços (POST /rastreamento/spans)
+# e guarda os próprios direto nele, sem passar por HTTP
+coletor_spans = ColetorSpans()
+rastreador = Rastreador("principal", coletor_spans)
+
+repositorio_pedidos: Optional[RepositorioPedidos] = None
+agrupador_status: Optional[AgrupadorStatus] = None
+repositorio_carrinho: Optional[RepositorioCarrinho] = None
 
 # Modelo do Produto
 class Produto(BaseModel):
@@ -57,144 +123,94 @@ class Pedido(BaseModel):
     product_id: int
     product_name: str
     quantity: int
-    status: Optional[str]  # 'pendente', 'aprovado', 'recusado'
-
-###################################################################
-
-def enviar_evento(evento: dict, routing_key: str):
-    connection = pika.BlockingConnection(pika.ConnectionParameters(host=RABBITMQ_HOST, credentials=CREDENTIALS))
-    channel = connection.channel()
-    
-    channel.exchange_declare(exchange='default', exchange_type='topic')
-    
-    channel.basic_publish(exchange='default', routing_key=routing_key, body=json.dumps(evento))
-    
-    connection.close()
-
-def consumir_eventos():
-    try:
-        connection = pika.BlockingConnection(pika.ConnectionParameters(host=RABBITMQ_HOST, credentials=CREDENTIALS))
-        channel = connection.channel()
-
-        channel.exchange_declare(exchange='default', exchange_type='topic')
-
-        result_pagamentos_aprovados = channel.queue_declare(queue='', exclusive=True)
-        result_pagamentos_recusados = channel.queue_declare(queue='', exclusive=True)
-        result_pedidos_enviados = channel.queue_declare(queue='', exclusive=True)
-
-        fila_pagamentos_aprovados = result_pagamentos_aprovados.method.queue
-        fila_pagamentos_recusados = result_pagamentos_recusados.method.queue
-        fila_pedidos_enviados = result_pedidos_enviados.method.queue
+    status: Optional[str]  # 'pendente', 'aprovado', 'recusado', 'sem_estoque'
 
-        channel.queue_bind(exchange='default', queue=fila_pagamentos_aprovados, routing_key=TOPIC_PAGAMENTOS_APROVADOS)
-        channel.queue_bind(exchange='default', queue=fila_pagamentos_recusados, routing_key=TOPIC_PAGAMENTOS_RECUSADOS)
-        channel.queue_bind(exchange='default', queue=fila_pedidos_enviados, routing_key=TOPIC_PEDIDOS_ENVIADOS)
+# Span exportado pelos outros serviços (formato do Rastreador)
+class Span(BaseModel):
+    correlacao: str
+    servico: str
+    nome: str
+    inicio: float
+    fim: float
+    atributos: dict = {}
 
-        def callback(ch, method, properties, body):
-            try:
-                evento = json.loads(body)
-                print(f"Evento recebido na fila '{method.routing_key}': {evento}")
-
-                if method.routing_key == TOPIC_PAGAMENTOS_APROVADOS:
-                    print(f"Atualizando status do pedido {evento['id']} para 'aprovado'")
-                    evento["status"] = "aprovado"
-                    atualizar_pedido(evento)
-
-                elif method.routing_key == TOPIC_PAGAMENTOS_RECUSADOS:
-                    print(f"Atualizando status do pedido {evento['id']} para 'recusado'")
-                    evento["status"] = "recusado"
-                    atualizar_pedido(evento)
+###################################################################
 
-                elif method.routing_key == TOPIC_PEDIDOS_ENVIADOS:
-                    print(f"Atualizando status do pedido {evento['id']} para 'enviado'")
-                    evento["status"] = "enviado"
-                    atualizar_pedido(evento)
+def enviar_evento(evento: dict, routing_key: str, correlacao: Optional[str] = None):
+    obter_transporte().publicar(evento, routing_key, correlacao=correlacao)
 
-                ch.basic_ack(delivery_tag=method.delivery_tag)
+async def enviar_evento_async(evento: dict, routing_key: str, correlacao: Optional[str] = None):
+    await obter_transporte().publicar_async(evento, routing_key, correlacao=correlacao)
 
-            except json.JSONDecodeError:
-                print("Erro ao decodificar o evento recebido.")
-            except Exception as e:
-                print(f"Erro ao processar evento: {e}")
+def consumir_eventos():
+    def callback(mensagem: Mensagem):
+        recebido_em = time.time()
+        id_evento = id_do_evento(mensagem.propriedades)
+        if eventos_processados.contem(id_evento):
+            print(f"Evento {id_evento} repetido ignorado.")
+            mensagem.confirmar()
+            return
 
-        channel.basic_consume(queue=fila_pagamentos_aprovados, on_message_callback=callback)
-        channel.basic_consume(queue=fila_pagamentos_recusados, on_message_callback=callback)
-        channel.basic_consume(queue=fila_pedidos_enviados, on_message_callback=callback)
+        try:
+            evento = decodificar_mensagem(mensagem.propriedades, mensagem.corpo)
+        except ErroCodec as e:
+            print(f"Erro ao decodificar o evento recebido: {e}")
+            mensagem.confirmar()
+            return
+        print(f"Evento recebido na fila '{mensagem.routing_key}': {evento}")
+
+        status = STATUS_POR_TOPICO.get(mensagem.routing_key)
+        if mensagem.routing_key == TOPIC_PAGAMENTOS_RECUSADOS:
+            # O estoque do pedido recusado é devolvido
+            cache_produtos.invalidar()
+        elif mensagem.routing_key == TOPIC_ESTOQUE_RESERVAS:
+            # Resposta do estoque a um pedido de qualquer réplica
+            cache_produtos.invalidar()
+            if evento.reserva != RESERVA_CONFIRMADA:
+                status = STATUS_SEM_ESTOQUE
+
+        if status is None:
+            mensagem.confirmar()
+            return
+
+        print(f"Atualizando status do pedido {evento.id} para '{status}'")
+        pedido = evento.com_status(status).para_dict()
+        # O ack sai só depois que o lote com esta mudança for gravado
+        rastro = (correlacao_da_mensagem(mensagem, evento.id), recebido_em)
+        agrupador_status.enviar(pedido, id_evento,
+                                functools.partial(status_persistido, mensagem, pedido, id_evento, rastro))
 
+    try:
         print("Esperando por eventos. Pressione Ctrl+C para sair.")
-        channel.start_consuming()
+        # O prefetch cobre alguns lotes cheios do agrupador em voo
+        obter_transporte().consumir(
+            [TOPIC_PAGAMENTOS_APROVADOS, TOPIC_PAGAMENTOS_RECUSADOS, TOPIC_PEDIDOS_ENVIADOS, TOPIC_ESTOQUE_RESERVAS],
+            callback, prefetch=PRINCIPAL_PREFETCH)
 
     except Exception as e:
         print(f"Erro ao consumir eventos: {e}")
 
-def ler_carrinho():
-    if not os.path.exists(CARRINHO_FILE_PATH):
-        with open(CARRINHO_FILE_PATH, 'w') as file:
-            json.dump([], file)
-        print(f"Arquivo {CARRINHO_FILE_PATH} criado com carrinho vazio.") 
-        return [] 
-    with open(CARRINHO_FILE_PATH, 'r') as file:
-        try:
-            carrinho = json.load(file)
-            print(f"Carrinho carregado: {carrinho}")
-            return carrinho
-        except json.JSONDecodeError:
-            print(f"Erro ao decodificar JSON no arquivo {CARRINHO_FILE_PATH}. Retornando carrinho vazio.")
-            return [] 
-        
-def salvar_carrinho(carrinho):
-    try:
-        with open(CARRINHO_FILE_PATH, 'w') as file:
-            json.dump(carrinho, file, indent=4)
-            print(f"Carrinho salvo com sucesso em {CARRINHO_FILE_PATH}.") 
-    except Exception as e:
-        print(f"Erro ao salvar o carrinho no arquivo {CARRINHO_FILE_PATH}: {e}")
-
-def ler_pedidos() -> List[dict]:
-    if not os.path.exists(PEDIDOS_FILE_PATH):
-        with open(PEDIDOS_FILE_PATH, 'w') as file:
-            json.dump([], file)
-        print(f"Arquivo {PEDIDOS_FILE_PATH} criado com pedidos vazios.") 
-        return [] 
-
-    with open(PEDIDOS_FILE_PATH, 'r') as file:
-        try:
-        
-            pedidos = json.load(file)
-            print(f"Pedidos carregados: {pedidos}") 
-            return pedidos
-        except json.JSONDecodeError:
-        
-            print(f"Erro ao decodificar JSON no arquivo {PEDIDOS_FILE_PATH}. Retornando pedidos vazios.")
-            return [] 
-
-def salvar_pedidos(pedidos: List[dict]):
-    try:
-        with open(PEDIDOS_FILE_PATH, 'w') as file:
-            json.dump(pedidos, file, indent=4)
-            print(f"Pedidos salvos com sucesso em {PEDIDOS_FILE_PATH}.") 
-    except Exception as e:
-        print(f"Erro ao salvar os pedidos no arquivo {PEDIDOS_FILE_PATH}: {e}") 
-
-def atualizar_pedido(evento: dict):
-    try:
-        pedidos = ler_pedidos()
-
-        pedido_encontrado = False
-        for pedido in pedidos:
-            if pedido["id"] == evento["id"]:
-                pedido["status"] = evento["status"]
-                pedido_encontrado = True
-                print(f"Pedido {evento['id']} atualizado para status '{evento['status']}'.")
-
-        if not pedido_encontrado:
-            pedidos.append(evento)
-            print(f"Novo pedido {evento['id']} adicionado com status '{evento['status']}'.")
-
-        salvar_pedidos(pedidos)
-
-    except Exception as e:
-        print(f"Erro ao atualizar pedido: {e}")
+def status_persistido(mensagem: Mensagem, evento: dict, id_evento: Optional[str], rastro: tuple,
+                      atualizado: Optional[bool], erro: Optional[Exception]):
+    # Executado na thread do agrupador após o commit do lote
+    correlacao, recebido_em = rastro
+    rastreador.registrar(correlacao, "principal.status", recebido_em,
+                         **atributos_mensagem(mensagem, recebido_em, pedido_id=evento["id"],
+                                              status=evento["status"], sucesso=erro is None))
+    if erro is not None:
+        print(f"Erro ao atualizar pedido {evento['id']}: {erro}")
+        # Uma nova tentativa; na segunda falha a mensagem vai para as mortas
+        mensagem.rejeitar(reenfileirar=not mensagem.reentregue)
+        return
+
+    eventos_processados.registrar(id_evento)
+    if atualizado is None:
+        print(f"Evento {id_evento} repetido ignorado.")
+    elif atualizado:
+        print(f"Pedido {evento['id']} atualizado para status '{evento['status']}'.")
+    else:
+        print(f"Novo pedido {evento['id']} adicionado com status '{evento['status']}'.")
+    mensagem.confirmar()
     
 ###################################################################
 
@@ -204,99 +220,95 @@ async def root():
 
 ###################################################################
 
-@app.get("/produtos")
-async def listar_products():
+async def buscar_produtos():
+    headers = {"If-None-Match": ultimo_catalogo["etag"]} if ultimo_catalogo["etag"] else {}
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f'{ESTOQUE_SERVICE_URL}/estoque')
-        
-        if response.status_code == 200:
-            return response.json()
+        response = await pool_http.cliente(ESTOQUE_SERVICE_URL).get('/estoque', headers=headers)
+
+        if response.status_code == 304:
+            return ultimo_catalogo["etag"], ultimo_catalogo["corpo"]
+        elif response.status_code == 200:
+            corpo = response.content
+            etag = response.headers.get("ETag") or f'"{hashlib.sha1(corpo).hexdigest()}"'
+            ultimo_catalogo.update(etag=etag, corpo=corpo)
+            return etag, corpo
         else:
             raise HTTPException(status_code=response.status_code, detail="Erro ao obter products do estoque")
     
     except httpx.RequestError as e:
         raise HTTPException(status_code=500, detail=f"Erro de conexão com o serviço de estoque: {str(e)}")
+
+@app.get("/produtos")
+async def listar_products(if_none_match: Optional[str] = Header(None)):
+    etag, corpo = await cache_produtos.obter(buscar_produtos)
+    if etag_confere(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=corpo, media_type="application/json", headers={"ETag": etag})
+
+@app.get("/produtos/cache")
+async def estatisticas_cache_produtos():
+    return cache_produtos.estatisticas()
     
 ###################################################################
 
-@app.get("/carrinho", response_model=List[Carrinho])
-async def listar_carrinho():
-    carrinho = ler_carrinho()
-
-    async with httpx.AsyncClient() as client:
-        for item in carrinho:
-            try:
-                response = await client.get(f"{ESTOQUE_SERVICE_URL}/estoque/{item['product_id']}")
-                response.raise_for_status()
-                estoque_data = response.json()
-                
-                item["available_stock"] = estoque_data
-            except httpx.HTTPStatusError as e:
-                print(f"Erro ao buscar estoque para o produto {item['product_id']}: {e}")
-                item["available_stock"] = 0 
+@app.get("/carrinho/{client_id}", response_model=List[Carrinho])
+async def listar_carrinho(client_id: int):
+    carrinho = repositorio_carrinho.listar(client_id)
+    if not carrinho:
+        return carrinho
+
+    product_ids = sorted({item["product_id"] for item in carrinho})
+    estoques = {}
+
+    try:
+        response = await pool_http.cliente(ESTOQUE_SERVICE_URL).get("/estoque/lote", params={"ids": product_ids})
+        response.raise_for_status()
+        estoques = response.json()
+    except (httpx.HTTPError, ValueError) as e:
+        # Timeout, falha de conexão ou resposta inválida: o carrinho sai com estoque 0
+        print(f"Erro ao buscar estoque para os produtos {product_ids}: {e}")
+
+    for item in carrinho:
+        # Chaves de objetos JSON chegam como string
+        item["available_stock"] = estoques.get(str(item["product_id"]), 0)
 
     return carrinho
 
 @app.post("/carrinho", response_model=Carrinho)
 async def adicionar_ao_carrinho(novo_item: Carrinho):
-    carrinho = ler_carrinho()
-
-    for item in carrinho:
-        if item["product_id"] == novo_item.product_id and item["client_id"] == novo_item.client_id:
-            item["quantity"] += novo_item.quantity
-            salvar_carrinho(carrinho)
-            return item
-    
-    carrinho.append({
-        "client_id": novo_item.client_id,
-        "product_name": novo_item.product_name,
-        "product_id": novo_item.product_id,
-        "quantity": novo_item.quantity,
-    })
-    salvar_carrinho(carrinho)
-    return carrinho[-1]
+    return repositorio_carrinho.adicionar(novo_item.dict())
 
 @app.patch("/carrinho/{client_id}/{product_id}/{quantity}", response_model=Carrinho)
 async def atualizar_quantity(client_id: int, product_id: int, quantity: int):
-    carrinho = ler_carrinho()
-    
-    for item in carrinho:
-        if item["client_id"] == client_id and item["product_id"] == product_id:
-            if quantity <= 0:
-                raise HTTPException(status_code=400, detail="Quantidade deve ser maior que zero.")
-                        
-            item["quantity"] = quantity
-            salvar_carrinho(carrinho)
-            return item
-    
-    raise HTTPException(status_code=404, detail="Produto não encontrado no carrinho.")
+    if quantity <= 0:
+        raise HTTPException(status_code=400, detail="Quantidade deve ser maior que zero.")
+
+    item = repositorio_carrinho.atualizar_quantidade(client_id, product_id, quantity)
+    if item is None:
+        raise HTTPException(status_code=404, detail="Produto não encontrado no carrinho.")
+    return item
 
 @app.delete("/carrinho/{client_id}/{product_id}")
 async def remover_product(client_id: int, product_id: int):
-    carrinho = ler_carrinho()
-    
-    novo_carrinho = [item for item in carrinho if not (item["client_id"] == client_id and item["product_id"] == product_id)]
-    
-    if len(novo_carrinho) == len(carrinho):
+    if not repositorio_carrinho.remover(client_id, product_id):
         raise HTTPException(status_code=404, detail="Produto não encontrado no carrinho.")
-    
-    salvar_carrinho(novo_carrinho)
+
     return {"mensagem": f"Produto {product_id} removido do carrinho do cliente {client_id}."}
 
 ###################################################################
 
 @app.post("/pedidos", response_model=Pedido)
-async def criar_pedido(pedido: Pedido):
+async def criar_pedido(pedido: Pedido, response: Response, x_correlation_id: Optional[str] = Header(None)):
     if pedido.quantity <= 0:
         raise HTTPException(status_code=400, detail="A quantidade do produto deve ser maior que zero.")
-    
-    pedidos = ler_pedidos()
 
-    novo_id = len(pedidos) + 1
+    # A correlação acompanha o pedido por todos os serviços; o cliente pode enviar a sua
+    correlacao = x_correlation_id or nova_correlacao()
+    response.headers[CABECALHO_CORRELACAO] = correlacao
+    inicio = time.time()
 
     pedido_criado = Pedido(
-        id=novo_id,
+        id=gerador_ids_pedidos.proximo(),
         client_id=pedido.client_id,
         product_id=pedido.product_id,
         product_name=pedido.product_name,
@@ -304,9 +316,7 @@ async def criar_pedido(pedido: Pedido):
         status="pendente"
     )
 
-    pedidos.append(pedido_criado.dict())
-
-    salvar_pedidos(pedidos)
+    repositorio_pedidos.inserir(pedido_criado.dict())
 
     evento_pedido = {
         "id": pedido_criado.id,
@@ -316,26 +326,169 @@ async def criar_pedido(pedido: Pedido):
         "quantity": pedido_criado.quantity,
         "status": "criado"
     }
-    enviar_evento(evento_pedido, TOPIC_PEDIDOS_CRIADOS)
+    await enviar_evento_async(evento_pedido, TOPIC_PEDIDOS_CRIADOS, correlacao)
+    rastreador.registrar(correlacao, "principal.criar_pedido", inicio, pedido_id=pedido_criado.id)
+    cache_produtos.invalidar()
     
-    # Acordar os microserviços relacionados
-    urls = [NOTIFICACAO_SERVICE_URL, PAGAMENTO_SERVICE_URL, ENTREGA_SERVICE_URL]
-    async with httpx.AsyncClient() as client:
-        for url in urls:
-            response = await client.get(f'{url}/')
-            print(response)
+    # A prontidão dos serviços relacionados é verificada em segundo plano
+    if not verificador_prontidao.pronto():
+        print(f"Aviso: serviços relacionados ainda não prontos: {verificador_prontidao.estado()}")
 
     return pedido_criado
 
+def validar_item_lote(item) -> Pedido:
+    if not isinstance(item, dict):
+        raise ValueError("O pedido deve ser um objeto")
+    try:
+        pedido = Pedido(**{**item, "id": None, "status": None})
+    except ValidationError as e:
+        erros = "; ".join(f"{'.'.join(str(parte) for parte in erro['loc'])}: {erro['msg']}" for erro in e.errors())
+        raise ValueError(erros)
+    if pedido.quantity <= 0:
+        raise ValueError("A quantidade do produto deve ser maior que zero.")
+    return pedido
+
+@app.post("/pedidos/lote")
+async def criar_pedidos_em_lote(itens: List[dict] = Body(...)):
+    # Cada item é validado sozinho: um pedido inválido não impede a criação dos demais
+    if len(itens) > PEDIDOS_LOTE_MAXIMO:
+        raise HTTPException(status_code=400, detail=f"O lote aceita no máximo {PEDIDOS_LOTE_MAXIMO} pedidos.")
+
+    inicio = time.time()
+    resultados = [None] * len(itens)
+    validos = []  # (indice, pedido)
+    for indice, item in enumerate(itens):
+        try:
+            pedido = validar_item_lote(item)
+        except ValueError as e:
+            resultados[indice] = {"indice": indice, "resultado": "invalido", "erro": str(e)}
+            continue
+        pedido.id = gerador_ids_pedidos.proximo()
+        pedido.status = "pendente"
+        validos.append((indice, pedido))
+
+    if validos:
+        # Uma transação para todos os pedidos válidos
+        repositorio_pedidos.inserir_lote([pedido.dict() for _, pedido in validos])
+
+        eventos = [{**pedido.dict(), "status": "criado"} for _, pedido in validos]
+        correlacoes = [nova_correlacao() for _ in validos]
+        publicacoes = await obter_transporte().publicar_lote_async(
+            eventos, TOPIC_PEDIDOS_CRIADOS, correlacoes=correlacoes)
+        for (_, pedido), correlacao in zip(validos, correlacoes):
+            rastreador.registrar(correlacao, "principal.criar_pedido", inicio, pedido_id=pedido.id,
+                                 tamanho_lote=len(validos))
+        cache_produtos.invalidar()
+
+        for (indice, pedido), publicacao in zip(validos, publicacoes):
+            if isinstance(publicacao, Exception):
+                # O pedido ficou gravado como pendente, mas o evento não foi confirmado pelo broker
+                print(f"Erro ao publicar o pedido {pedido.id}: {publicacao}")
+                resultados[indice] = {"indice": indice, "resultado": "erro_publicacao",
+                                      "pedido": pedido, "erro": str(publicacao)}
+            else:
+                resultados[indice] = {"indice": indice, "resultado": "criado", "pedido": pedido}
+
+    criados = sum(1 for resultado in resultados if resultado["resultado"] == "criado")
+    return {"criados": criados, "falhas": len(itens) - criados, "resultados": resultados}
+
+def exportar_pedidos_ndjson(filtros: dict):
+    # Gerador síncrono: o Starlette o consome no threadpool, linha a linha, sem montar a lista
+    for pedido in repositorio_pedidos.iterar(**filtros):
+        yield json.dumps(pedido) + "\n"
+
+# Paginação por cursor: o cursor é o id do último pedido da página anterior.
+# Sem `limite`, a listagem JSON traz só os PEDIDOS_LIMITE_PADRAO primeiros e indica a próxima página.
+# formato=ndjson transmite todos os pedidos filtrados (ou até `limite`) como NDJSON.
 @app.get("/pedidos", response_model=List[Pedido])
-async def listar_pedidos():
-    pedidos = ler_pedidos()
+async def listar_pedidos(
+    request: Request,
+    response: Response,
+    client_id: Optional[int] = None,
+    status: Optional[str] = None,
+    cursor: Optional[int] = None,
+    limite: Optional[int] = Query(None, ge=1),
+    ordem: Literal["asc", "desc"] = "asc",
+    formato: Literal["json", "ndjson"] = "json",
+    if_none_match: Optional[str] = Header(None),
+):
+    # A versão cobre a coleção inteira; a consulta separa o ETag de cada filtro e página
+    consulta = json.dumps([client_id, status, cursor, limite, ordem, formato])
+    etag = gerar_etag("pedidos", repositorio_pedidos.versao, consulta)
+    if etag_confere(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    filtros = {
+        "client_id": client_id,
+        "status": status,
+        "cursor": cursor,
+        "limite": limite,
+        "decrescente": ordem == "desc",
+    }
+
+    if formato == "ndjson":
+        return StreamingResponse(
+            exportar_pedidos_ndjson(filtros), media_type="application/x-ndjson", headers={"ETag": etag})
+
+    filtros["limite"] = min(limite or PEDIDOS_LIMITE_PADRAO, PEDIDOS_LIMITE_MAXIMO)
+    pedidos = repositorio_pedidos.listar(**filtros)
+
+    response.headers["ETag"] = etag
+    if len(pedidos) == filtros["limite"]:
+        proximo_cursor = pedidos[-1]["id"]
+        response.headers["X-Proximo-Cursor"] = str(proximo_cursor)
+        response.headers["Link"] = f'<{request.url.include_query_params(cursor=proximo_cursor)}>; rel="next"'
     return pedidos
 
+# Spans exportados pelos outros serviços (RASTREAMENTO_EXPORTADOR=coletor)
+@app.post("/rastreamento/spans")
+async def receber_spans(spans: List[Span]):
+    coletor_spans.exportar([span.dict() for span in spans])
+    return {"recebidos": len(spans)}
+
+# Linha do tempo do pedido em todos os serviços: início e duração de cada trecho, em ms
+@app.get("/pedidos/{pedido_id}/linha-do-tempo")
+async def linha_do_tempo_pedido(pedido_id: int):
+    # Os spans locais ainda no buffer entram antes da consulta
+    rastreador.descarregar()
+    correlacao = coletor_spans.correlacao_do_pedido(pedido_id)
+    linha_do_tempo = coletor_spans.linha_do_tempo(correlacao) if correlacao is not None else None
+    if linha_do_tempo is None:
+        raise HTTPException(status_code=404, detail=f"Nenhum span registrado para o pedido {pedido_id}")
+    return {"pedido_id": pedido_id, **linha_do_tempo}
+
+@app.get("/prontidao")
+async def consultar_prontidao():
+    return {"pronto": verificador_prontidao.pronto(), "servicos": verificador_prontidao.estado()}
+
 ###################################################################
 
 @app.on_event("startup")
 async def iniciar_consumo_de_eventos():
     import threading
+    global repositorio_pedidos, repositorio_carrinho, agrupador_status
+    repositorio_pedidos = criar_repositorio_pedidos()
+    agrupador_status = AgrupadorStatus(repositorio_pedidos, janela=STATUS_LOTE_JANELA, max_lote=STATUS_LOTE_MAXIMO)
+    agrupador_status.iniciar()
+    repositorio_carrinho = criar_repositorio_carrinho()
+    eventos_processados.carregar(repositorio_pedidos.eventos_processados())
+
+    pool_http.abrir()
+    verificador_prontidao.iniciar()
+    rastreador.iniciar()
+
     thread = threading.Thread(target=consumir_eventos, daemon=True)
-    thread.start()
\ No newline at end of file
+    thread.start()
+
+@app.on_event("shutdown")
+async def encerrar_recursos():
+    await verificador_prontidao.parar()
+    rastreador.parar()
+    await pool_http.fechar()
+    fechar_transporte()
+    if agrupador_status is not None:
+        agrupador_status.parar()
+    if repositorio_pedidos is not None:
+        repositorio_pedidos.fechar()
+    if repositorio_carrinho is not None:
+        repositorio_carrinho.parar()
@@ -0,0 +1,74 @@
+import asyncio
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+###################################################################
+
+class PoolClientesHttp:
+    # Um AsyncClient com keep-alive por serviço de destino, aberto no startup e
+    # fechado no shutdown; cada cliente tem seu próprio limite de conexões por host
+
+    def __init__(self, urls: List[str], max_conexoes: int = 50, max_keepalive: int = 20, timeout: float = 5.0):
+        self._urls = urls
+        self._limites = httpx.Limits(max_connections=max_conexoes, max_keepalive_connections=max_keepalive)
+        self._timeout = timeout
+        self._clientes: Dict[str, httpx.AsyncClient] = {}
+
+    def abrir(self):
+        for url in self._urls:
+            self._clientes[url] = httpx.AsyncClient(base_url=url, limits=self._limites, timeout=self._timeout)
+
+    async def fechar(self):
+        clientes, self._clientes = self._clientes, {}
+        await asyncio.gather(*(cliente.aclose() for cliente in clientes.values()))
+
+    def cliente(self, url: str) -> httpx.AsyncClient:
+        return self._clientes[url]
+
+class VerificadorProntidao:
+    # Substitui as chamadas de "acordar" feitas a cada pedido: os serviços são
+    # consultados em paralelo em segundo plano e o resultado fica em cache
+
+    def __init__(self, pool: PoolClientesHttp, urls: List[str], intervalo: float = 10.0):
+        self._pool = pool
+        self._urls = urls
+        self._intervalo = intervalo
+        self._estado: Dict[str, dict] = {url: {"pronto": False, "verificado_em": None} for url in urls}
+        self._tarefa: Optional[asyncio.Task] = None
+
+    def iniciar(self):
+        self._tarefa = asyncio.get_running_loop().create_task(self._executar())
+
+    async def parar(self):
+        if self._tarefa is not None:
+            self._tarefa.cancel()
+            try:
+                await self._tarefa
+            except asyncio.CancelledError:
+                pass
+            self._tarefa = None
+
+    def estado(self) -> Dict[str, dict]:
+        return {url: dict(estado) for url, estado in self._estado.items()}
+
+    def pronto(self) -> bool:
+        return all(estado["pronto"] for estado in self._estado.values())
+
+    async def atualizar(self):
+        await asyncio.gather(*(self._verificar(url) for url in self._urls))
+
+    async def _verificar(self, url: str):
+        try:
+            response = await self._pool.cliente(url).get('/')
+            pronto = response.status_code == 200
+        except httpx.RequestError as e:
+            print(f"Serviço {url} indisponível: {e}")
+            pronto = False
+        self._estado[url] = {"pronto": pronto, "verificado_em": time.time()}
+
+    async def _executar(self):
+        while True:
+            await self.atualizar()
+            await asyncio.sleep(self._intervalo)
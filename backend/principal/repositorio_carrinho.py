@@ -0,0 +1,154 @@
+import json
+import os
+import threading
+from typing import List, Optional
+
+from comum.persistencia import GravadorAtrasadoParticionado
+
+CARRINHOS_DIR = os.getenv("CARRINHOS_DIR", "carrinhos")
+CARRINHO_JSON_LEGADO = os.getenv("CARRINHO_JSON_LEGADO", "carrinho.json")
+# O carrinho.json legado é renomeado com este sufixo depois de migrado
+SUFIXO_MIGRADO = ".migrado"
+
+CAMPOS_ITEM = ["client_id", "product_name", "product_id", "quantity"]
+
+###################################################################
+
+class RepositorioCarrinho:
+    # Carrinhos indexados por cliente e por produto, um arquivo por cliente.
+    # Cada cliente é carregado do disco no primeiro acesso e só o seu arquivo é regravado.
+
+    def __init__(self, diretorio: str = CARRINHOS_DIR, intervalo_gravacao: float = 0.5):
+        os.makedirs(diretorio, exist_ok=True)
+        self._diretorio = diretorio
+        self._carrinhos: dict = {}  # client_id -> {product_id: item}
+        self._lock = threading.Lock()
+        self._gravador = GravadorAtrasadoParticionado(
+            self._caminho, self._snapshot, intervalo=intervalo_gravacao, indent=4)
+
+    def iniciar(self):
+        self._gravador.iniciar()
+
+    def parar(self):
+        self._gravador.parar()
+
+    def descarregar(self) -> bool:
+        return self._gravador.descarregar()
+
+    def _caminho(self, client_id: int) -> str:
+        return os.path.join(self._diretorio, f"{client_id}.json")
+
+    def _snapshot(self, client_id: int) -> Optional[List[dict]]:
+        with self._lock:
+            itens = self._carrinhos.get(client_id)
+            if not itens:
+                return None
+            return [dict(item) for item in itens.values()]
+
+    def _carrinho(self, client_id: int, criar: bool = False) -> dict:
+        # Um cliente sem carrinho só entra no mapa quando recebe um item (criar=True)
+        itens = self._carrinhos.get(client_id)
+        if itens is not None:
+            return itens
+
+        itens = {}
+        caminho = self._caminho(client_id)
+        if os.path.exists(caminho):
+            try:
+                with open(caminho, 'r') as file:
+                    itens = {item["product_id"]: item for item in json.load(file)}
+            except json.JSONDecodeError:
+                print(f"Erro ao decodificar JSON no arquivo {caminho}. Usando carrinho vazio.")
+        if itens or criar:
+            self._carrinhos[client_id] = itens
+        return itens
+
+    ###############################################################
+
+    def listar(self, client_id: int) -> List[dict]:
+        with self._lock:
+            return [dict(item) for item in self._carrinho(client_id).values()]
+
+    def adicionar(self, novo_item: dict) -> dict:
+        client_id = novo_item["client_id"]
+        with self._lock:
+            item = _somar_item(self._carrinho(client_id, criar=True), novo_item)
+            copia = dict(item)
+        self._gravador.marcar(client_id)
+        return copia
+
+    def substituir(self, client_id: int, novos_itens: List[dict]):
+        # Troca o carrinho inteiro do cliente; usado pela migração, que pode ser repetida
+        itens = {}
+        for novo_item in novos_itens:
+            _somar_item(itens, novo_item)
+        with self._lock:
+            self._carrinhos[client_id] = itens
+        self._gravador.marcar(client_id)
+
+    def atualizar_quantidade(self, client_id: int, product_id: int, quantidade: int) -> Optional[dict]:
+        with self._lock:
+            item = self._carrinho(client_id).get(product_id)
+            if item is None:
+                return None
+            item["quantity"] = quantidade
+            copia = dict(item)
+        self._gravador.marcar(client_id)
+        return copia
+
+    def remover(self, client_id: int, product_id: int) -> bool:
+        with self._lock:
+            if self._carrinho(client_id).pop(product_id, None) is None:
+                return False
+        self._gravador.marcar(client_id)
+        return True
+
+def _somar_item(itens: dict, novo_item: dict) -> dict:
+    item = itens.get(novo_item["product_id"])
+    if item is not None:
+        item["quantity"] += novo_item["quantity"]
+    else:
+        item = {campo: novo_item[campo] for campo in CAMPOS_ITEM}
+        itens[item["product_id"]] = item
+    return item
+
+###################################################################
+
+def migrar_carrinho_json(repositorio: RepositorioCarrinho, caminho_json: str = CARRINHO_JSON_LEGADO) -> int:
+    # Distribui o carrinho.json legado (todos os clientes numa lista) entre os arquivos por cliente.
+    # Depois de gravados os arquivos, o legado é renomeado e a migração não roda de novo.
+    # Se algo falhar antes disso, ela é repetida no próximo início e cada carrinho é
+    # substituído, não somado, então nenhum item é contado duas vezes.
+    if not os.path.exists(caminho_json):
+        return 0
+
+    with open(caminho_json, 'r') as file:
+        conteudo = file.read().strip()
+
+    itens = []
+    if conteudo:
+        try:
+            itens = json.loads(conteudo)
+        except json.JSONDecodeError:
+            print(f"Erro ao decodificar JSON no arquivo {caminho_json}. Migração ignorada.")
+            return 0
+
+    por_cliente: dict = {}
+    for item in itens:
+        por_cliente.setdefault(item["client_id"], []).append(item)
+    for client_id, itens_cliente in por_cliente.items():
+        repositorio.substituir(client_id, itens_cliente)
+
+    if not repositorio.descarregar():
+        print(f"Erro ao gravar os carrinhos migrados de {caminho_json}. A migração será repetida.")
+        return 0
+    os.replace(caminho_json, caminho_json + SUFIXO_MIGRADO)
+
+    print(f"{len(itens)} itens de carrinho migrados de {caminho_json}.")
+    return len(itens)
+
+def criar_repositorio_carrinho() -> RepositorioCarrinho:
+    repositorio = RepositorioCarrinho()
+    migrar_carrinho_json(repositorio)
+    repositorio.iniciar()
+    return repositorio
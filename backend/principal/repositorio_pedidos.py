@@ -0,0 +1,398 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Iterator, List, Optional
+
+from comum.dedup import CacheIdempotencia, DEDUP_TTL
+from comum.metricas import medir_io
+
+PEDIDOS_BACKEND = os.getenv("PEDIDOS_BACKEND", "sqlite")
+PEDIDOS_DB_PATH = os.getenv("PEDIDOS_DB_PATH", "pedidos.db")
+PEDIDOS_JSON_LEGADO = os.getenv("PEDIDOS_JSON_LEGADO", "pedidos.json")
+# De quanto em quanto tempo os ids de eventos mais velhos que o DEDUP_TTL saem do banco
+PEDIDOS_INTERVALO_PODA = float(os.getenv("PEDIDOS_INTERVALO_PODA", "60"))
+
+CAMPOS_PEDIDO = ["id", "client_id", "product_id", "product_name", "quantity", "status"]
+
+# Pedido sem estoque reservado não muda mais de status, mesmo que o pagamento seja aprovado depois
+STATUS_SEM_ESTOQUE = "sem_estoque"
+
+# O status só avança: um evento atrasado ou reentregue não volta o pedido para trás.
+# Status da mesma ordem (aprovado/recusado) também não se sobrescrevem; nulo ou desconhecido é 0.
+ORDEM_STATUS = {"pendente": 1, "aprovado": 2, "recusado": 2, "enviado": 3, STATUS_SEM_ESTOQUE: 4}
+
+def ordem_status(status: Optional[str]) -> int:
+    return ORDEM_STATUS.get(status, 0)
+
+_ORDEM_STATUS_SQL = "CASE status {} ELSE 0 END".format(
+    " ".join(f"WHEN '{status}' THEN {ordem}" for status, ordem in ORDEM_STATUS.items()))
+
+###################################################################
+
+class RepositorioPedidos(ABC):
+    # Incrementada a cada mutação, usada como ETag das listagens
+    versao = 0
+
+    @abstractmethod
+    def inserir(self, pedido: dict) -> dict:
+        # Persiste um novo pedido; atribui o id quando ele vier vazio
+        ...
+
+    def inserir_lote(self, pedidos: List[dict]) -> List[dict]:
+        # Persiste vários pedidos de uma vez: ou todos são gravados, ou nenhum
+        return [self.inserir(pedido) for pedido in pedidos]
+
+    @abstractmethod
+    def obter(self, pedido_id: int) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    def atualizar_status(self, evento: dict, id_evento: Optional[str] = None) -> Optional[bool]:
+        # Atualiza o status do pedido do evento, criando-o se ainda não existir.
+        # Retorna False quando o pedido precisou ser criado e None quando o
+        # evento com este id já tinha sido aplicado.
+        ...
+
+    def atualizar_status_lote(self, atualizacoes: List[tuple]) -> List[Optional[bool]]:
+        # Aplica vários pares (evento, id_evento) de uma vez, com o mesmo retorno de atualizar_status
+        return [self.atualizar_status(evento, id_evento) for evento, id_evento in atualizacoes]
+
+    @abstractmethod
+    def eventos_processados(self) -> List[list]:
+        # Pares [id, processado_em] dos eventos aplicados dentro do DEDUP_TTL
+        ...
+
+    @abstractmethod
+    def iterar(self, client_id: Optional[int] = None, status: Optional[str] = None,
+               cursor: Optional[int] = None, limite: Optional[int] = None,
+               decrescente: bool = False) -> Iterator[dict]:
+        # Percorre os pedidos em ordem de id a partir do cursor (exclusivo),
+        # entregando cada linha assim que ela é lida
+        ...
+
+    def listar(self, client_id: Optional[int] = None, status: Optional[str] = None,
+               cursor: Optional[int] = None, limite: Optional[int] = None,
+               decrescente: bool = False) -> List[dict]:
+        return list(self.iterar(client_id, status, cursor, limite, decrescente))
+
+    @abstractmethod
+    def contar(self) -> int:
+        ...
+
+    def fechar(self):
+        pass
+
+class RepositorioPedidosMemoria(RepositorioPedidos):
+
+    def __init__(self):
+        self._pedidos: dict = {}
+        self._ultimo_id = 0
+        self._processados = CacheIdempotencia()
+        self._lock = threading.Lock()
+
+    def inserir(self, pedido: dict) -> dict:
+        with self._lock:
+            pedido = {campo: pedido.get(campo) for campo in CAMPOS_PEDIDO}
+            if pedido["id"] is None:
+                pedido["id"] = self._ultimo_id + 1
+            self._ultimo_id = max(self._ultimo_id, pedido["id"])
+            self._pedidos[pedido["id"]] = pedido
+            self.versao += 1
+            return dict(pedido)
+
+    def obter(self, pedido_id: int) -> Optional[dict]:
+        pedido = self._pedidos.get(pedido_id)
+        return dict(pedido) if pedido else None
+
+    def atualizar_status(self, evento: dict, id_evento: Optional[str] = None) -> Optional[bool]:
+        with self._lock:
+            if not self._processados.registrar(id_evento):
+                return None
+            self.versao += 1
+            pedido = self._pedidos.get(evento["id"])
+            if pedido is None:
+                self._pedidos[evento["id"]] = {campo: evento.get(campo) for campo in CAMPOS_PEDIDO}
+                self._ultimo_id = max(self._ultimo_id, evento["id"])
+                return False
+            if ordem_status(pedido["status"]) < ordem_status(evento["status"]):
+                pedido["status"] = evento["status"]
+            return True
+
+    def iterar(self, client_id=None, status=None, cursor=None, limite=None, decrescente=False) -> Iterator[dict]:
+        with self._lock:
+            ids = sorted(self._pedidos, reverse=decrescente)
+        entregues = 0
+        for pedido_id in ids:
+            if cursor is not None and (pedido_id >= cursor if decrescente else pedido_id <= cursor):
+                continue
+            pedido = self._pedidos.get(pedido_id)
+            if pedido is None:
+                continue
+            if client_id is not None and pedido["client_id"] != client_id:
+                continue
+            if status is not None and pedido["status"] != status:
+                continue
+            yield dict(pedido)
+            entregues += 1
+            if limite is not None and entregues >= limite:
+                return
+
+    def contar(self) -> int:
+        return len(self._pedidos)
+
+    def eventos_processados(self) -> List[list]:
+        return self._processados.snapshot()
+
+class RepositorioPedidosSQLite(RepositorioPedidos):
+    # Uma conexão por thread; o modo WAL deixa leitores e o escritor trabalharem em paralelo
+
+    def __init__(self, caminho: str = PEDIDOS_DB_PATH):
+        self._caminho = caminho
+        self._versao_lock = threading.Lock()
+        self._local = threading.local()
+        self._conexoes: List[sqlite3.Connection] = []
+        self._conexoes_lock = threading.Lock()
+        self._proxima_poda = 0.0
+        self._poda_lock = threading.Lock()
+
+        conexao = self._conexao()
+        conexao.execute("PRAGMA journal_mode=WAL")
+        conexao.execute("""
+            CREATE TABLE IF NOT EXISTS pedidos (
+                id INTEGER PRIMARY KEY,
+                client_id INTEGER NOT NULL,
+                product_id INTEGER NOT NULL,
+                product_name TEXT NOT NULL,
+                quantity INTEGER NOT NULL,
+                status TEXT
+            )
+        """)
+        conexao.execute("CREATE INDEX IF NOT EXISTS idx_pedidos_cliente ON pedidos (client_id, id)")
+        conexao.execute("CREATE INDEX IF NOT EXISTS idx_pedidos_status ON pedidos (status, id)")
+        # Ids dos eventos já aplicados, gravados na mesma transação que a mudança de status
+        conexao.execute("""
+            CREATE TABLE IF NOT EXISTS eventos_processados (
+                id TEXT PRIMARY KEY,
+                processado_em REAL NOT NULL
+            )
+        """)
+        conexao.execute("CREATE INDEX IF NOT EXISTS idx_eventos_processados_em ON eventos_processados (processado_em)")
+        self._podar_eventos(conexao)
+        conexao.commit()
+
+    def _nova_versao(self):
+        with self._versao_lock:
+            self.versao += 1
+
+    def _conexao(self) -> sqlite3.Connection:
+        conexao = getattr(self._local, "conexao", None)
+        if conexao is None:
+            conexao = sqlite3.connect(self._caminho, timeout=30, check_same_thread=False)
+            conexao.row_factory = sqlite3.Row
+            conexao.execute("PRAGMA synchronous=NORMAL")
+            self._local.conexao = conexao
+            with self._conexoes_lock:
+                self._conexoes.append(conexao)
+        return conexao
+
+    @medir_io("sqlite_inserir")
+    def inserir(self, pedido: dict) -> dict:
+        conexao = self._conexao()
+        with conexao:
+            cursor = conexao.execute(
+                "INSERT INTO pedidos (id, client_id, product_id, product_name, quantity, status) "
+                "VALUES (:id, :client_id, :product_id, :product_name, :quantity, :status)",
+                {campo: pedido.get(campo) for campo in CAMPOS_PEDIDO},
+            )
+        self._nova_versao()
+        pedido = {campo: pedido.get(campo) for campo in CAMPOS_PEDIDO}
+        pedido["id"] = cursor.lastrowid
+        return pedido
+
+    @medir_io("sqlite_inserir_lote")
+    def inserir_lote(self, pedidos: List[dict]) -> List[dict]:
+        # Uma única transação para o lote; os ids já vêm atribuídos pelo gerador
+        pedidos = [{campo: pedido.get(campo) for campo in CAMPOS_PEDIDO} for pedido in pedidos]
+        conexao = self._conexao()
+        with conexao:
+            conexao.executemany(
+                "INSERT INTO pedidos (id, client_id, product_id, product_name, quantity, status) "
+                "VALUES (:id, :client_id, :product_id, :product_name, :quantity, :status)",
+                pedidos,
+            )
+        self._nova_versao()
+        return pedidos
+
+    @medir_io("sqlite_obter")
+    def obter(self, pedido_id: int) -> Optional[dict]:
+        linha = self._conexao().execute("SELECT * FROM pedidos WHERE id = ?", (pedido_id,)).fetchone()
+        return dict(linha) if linha else None
+
+    def _podar_eventos(self, conexao: sqlite3.Connection):
+        # Chamado dentro da transação de escrita, no máximo uma vez por PEDIDOS_INTERVALO_PODA
+        agora = time.time()
+        with self._poda_lock:
+            if agora < self._proxima_poda:
+                return
+            self._proxima_poda = agora + PEDIDOS_INTERVALO_PODA
+        conexao.execute("DELETE FROM eventos_processados WHERE processado_em < ?", (agora - DEDUP_TTL,))
+
+    def _aplicar_status(self, conexao: sqlite3.Connection, evento: dict, id_evento: Optional[str]) -> Optional[bool]:
+        if id_evento is not None:
+            cursor = conexao.execute(
+                "INSERT OR IGNORE INTO eventos_processados (id, processado_em) VALUES (?, ?)",
+                (id_evento, time.time()),
+            )
+            if cursor.rowcount == 0:
+                return None
+        cursor = conexao.execute(
+            f"UPDATE pedidos SET status = ? WHERE id = ? AND {_ORDEM_STATUS_SQL} < ?",
+            (evento["status"], evento["id"], ordem_status(evento["status"])),
+        )
+        if cursor.rowcount > 0:
+            return True
+        cursor = conexao.execute(
+            "INSERT OR IGNORE INTO pedidos (id, client_id, product_id, product_name, quantity, status) "
+            "VALUES (:id, :client_id, :product_id, :product_name, :quantity, :status)",
+            {campo: evento.get(campo) for campo in CAMPOS_PEDIDO},
+        )
+        # Sem inserção o pedido existia, mas já estava num status igual ou mais adiante
+        return cursor.rowcount == 0
+
+    @medir_io("sqlite_atualizar_status")
+    def atualizar_status(self, evento: dict, id_evento: Optional[str] = None) -> Optional[bool]:
+        conexao = self._conexao()
+        with conexao:
+            self._podar_eventos(conexao)
+            resultado = self._aplicar_status(conexao, evento, id_evento)
+        if resultado is not None:
+            self._nova_versao()
+        return resultado
+
+    @medir_io("sqlite_atualizar_status_lote")
+    def atualizar_status_lote(self, atualizacoes: List[tuple]) -> List[Optional[bool]]:
+        # Uma única transação por lote. Ela é confirmada com synchronous=FULL (fsync no commit),
+        # um custo que passa a ser dividido entre todos os eventos do lote.
+        conexao = self._conexao()
+        if not getattr(self._local, "sincrono", False):
+            conexao.execute("PRAGMA synchronous=FULL")
+            self._local.sincrono = True
+        with conexao:
+            self._podar_eventos(conexao)
+            resultados = [self._aplicar_status(conexao, evento, id_evento) for evento, id_evento in atualizacoes]
+        if any(resultado is not None for resultado in resultados):
+            self._nova_versao()
+        return resultados
+
+    def _consulta(self, client_id, status, cursor, limite, decrescente):
+        condicoes, parametros = [], []
+        if client_id is not None:
+            condicoes.append("client_id = ?")
+            parametros.append(client_id)
+        if status is not None:
+            condicoes.append("status = ?")
+            parametros.append(status)
+        if cursor is not None:
+            condicoes.append("id < ?" if decrescente else "id > ?")
+            parametros.append(cursor)
+
+        sql = "SELECT * FROM pedidos"
+        if condicoes:
+            sql += " WHERE " + " AND ".join(condicoes)
+        sql += " ORDER BY id DESC" if decrescente else " ORDER BY id"
+        if limite is not None:
+            sql += " LIMIT ?"
+            parametros.append(limite)
+        return sql, parametros
+
+    @medir_io("sqlite_listar")
+    def listar(self, client_id=None, status=None, cursor=None, limite=None, decrescente=False) -> List[dict]:
+        sql, parametros = self._consulta(client_id, status, cursor, limite, decrescente)
+        return [dict(linha) for linha in self._conexao().execute(sql, parametros).fetchall()]
+
+    def iterar(self, client_id=None, status=None, cursor=None, limite=None, decrescente=False) -> Iterator[dict]:
+        # Conexão própria: o gerador pode ser consumido por threads diferentes (streaming)
+        sql, parametros = self._consulta(client_id, status, cursor, limite, decrescente)
+        conexao = sqlite3.connect(self._caminho, timeout=30, check_same_thread=False)
+        conexao.row_factory = sqlite3.Row
+        try:
+            resultado = conexao.execute(sql, parametros)
+            while True:
+                linhas = resultado.fetchmany(500)
+                if not linhas:
+                    return
+                for linha in linhas:
+                    yield dict(linha)
+        finally:
+            conexao.close()
+
+    @medir_io("sqlite_contar")
+    def contar(self) -> int:
+        return self._conexao().execute("SELECT COUNT(*) FROM pedidos").fetchone()[0]
+
+    def eventos_processados(self) -> List[list]:
+        linhas = self._conexao().execute(
+            "SELECT id, processado_em FROM eventos_processados WHERE processado_em >= ? ORDER BY processado_em",
+            (time.time() - DEDUP_TTL,),
+        ).fetchall()
+        return [[linha["id"], linha["processado_em"]] for linha in linhas]
+
+    def importar(self, pedidos: List[dict]) -> int:
+        conexao = self._conexao()
+        with conexao:
+            cursor = conexao.executemany(
+                "INSERT OR IGNORE INTO pedidos (id, client_id, product_id, product_name, quantity, status) "
+                "VALUES (:id, :client_id, :product_id, :product_name, :quantity, :status)",
+                [{campo: pedido.get(campo) for campo in CAMPOS_PEDIDO} for pedido in pedidos],
+            )
+        self._nova_versao()
+        return cursor.rowcount
+
+    def fechar(self):
+        with self._conexoes_lock:
+            for conexao in self._conexoes:
+                conexao.close()
+            self._conexoes.clear()
+        self._local = threading.local()
+
+###################################################################
+
+def migrar_pedidos_json(repositorio: RepositorioPedidos, caminho_json: str = PEDIDOS_JSON_LEGADO) -> int:
+    # Importa o pedidos.json legado uma única vez: só roda com o repositório vazio
+    if not os.path.exists(caminho_json) or repositorio.contar() > 0:
+        return 0
+
+    with open(caminho_json, 'r') as file:
+        conteudo = file.read().strip()
+    if not conteudo:
+        return 0
+
+    try:
+        pedidos = json.loads(conteudo)
+    except json.JSONDecodeError:
+        print(f"Erro ao decodificar JSON no arquivo {caminho_json}. Migração ignorada.")
+        return 0
+
+    if isinstance(repositorio, RepositorioPedidosSQLite):
+        importados = repositorio.importar(pedidos)
+    else:
+        for pedido in pedidos:
+            repositorio.inserir(pedido)
+        importados = len(pedidos)
+
+    print(f"{importados} pedidos migrados de {caminho_json}.")
+    return importados
+
+def criar_repositorio_pedidos(backend: str = PEDIDOS_BACKEND) -> RepositorioPedidos:
+    if backend == "sqlite":
+        repositorio = RepositorioPedidosSQLite()
+    elif backend == "memoria":
+        repositorio = RepositorioPedidosMemoria()
+    else:
+        raise ValueError(f"Backend de pedidos desconhecido: {backend}")
+
+    migrar_pedidos_json(repositorio)
+    return repositorio
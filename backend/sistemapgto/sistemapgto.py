@@ -1,8 +1,22 @@
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Header, Request
 from pydantic import BaseModel
+from typing import List, Optional
+import os
 import random
+import time
+
+from comum.metricas import instrumentar_app
+from comum.rastreamento import criar_rastreador
 
 app = FastAPI()
+# Latência por rota e GET /metrics no formato do Prometheus
+instrumentar_app(app)
+
+# Com uma semente fixa a sequência de aprovações se repete entre execuções (usado nos benchmarks)
+SISTEMAPGTO_SEMENTE = os.getenv("SISTEMAPGTO_SEMENTE")
+gerador_decisoes = random.Random(int(SISTEMAPGTO_SEMENTE) if SISTEMAPGTO_SEMENTE is not None else None)
+
+rastreador = criar_rastreador("sistemapgto")
 
 class Pagamento(BaseModel):
     transacao_id: str
@@ -13,11 +27,13 @@ class Pagamento(BaseModel):
 
 ###################################################################
 
-@app.post("/webhook/pagamento")
-async def webhook_pagamento(pagamento: Pagamento):
-    status = "aprovado" if random.choice([True, False]) else "recusado"
+def autorizar(pagamento: Pagamento, correlacao: Optional[str] = None) -> dict:
+    inicio = time.time()
+    status = "aprovado" if gerador_decisoes.choice([True, False]) else "recusado"
+    rastreador.registrar(correlacao, "sistemapgto.autorizar", inicio,
+                         transacao_id=pagamento.transacao_id, status=status)
 
-    resposta = {
+    return {
         "transacao_id": pagamento.transacao_id,
         "client_id": pagamento.client_id,
         "product_id": pagamento.product_id,
@@ -26,9 +42,33 @@ async def webhook_pagamento(pagamento: Pagamento):
         "status": status,
     }
 
+@app.post("/webhook/pagamento")
+async def webhook_pagamento(pagamento: Pagamento, x_correlation_id: Optional[str] = Header(None)):
+    resposta = autorizar(pagamento, x_correlation_id)
+
     print(f"Pagamento processado: {resposta}")
     return resposta
 
+# Vários pagamentos numa chamada; cada transação recebe sua própria decisão.
+# X-Correlation-ID traz uma correlação por pagamento, separadas por vírgula e na ordem do lote.
+@app.post("/webhook/pagamento/lote")
+async def webhook_pagamento_lote(pagamentos: List[Pagamento], x_correlation_id: Optional[str] = Header(None)):
+    correlacoes = x_correlation_id.split(",") if x_correlation_id else []
+    correlacoes += [""] * (len(pagamentos) - len(correlacoes))
+    resultados = [autorizar(pagamento, correlacao or None) for pagamento, correlacao in zip(pagamentos, correlacoes)]
+
+    aprovados = sum(1 for resultado in resultados if resultado["status"] == "aprovado")
+    print(f"Lote de {len(resultados)} pagamentos processado: {aprovados} aprovados")
+    return {"resultados": resultados}
+
 @app.get("/")
 def root():
     return {"message": "Sistema de Pagamento Webhook está rodando!"}
+
+@app.on_event("startup")
+def iniciar_recursos():
+    rastreador.iniciar()
+
+@app.on_event("shutdown")
+def encerrar_recursos():
+    rastreador.parar()
@@ -1,6 +1,6 @@
 import { Injectable } from '@angular/core';
 import { HttpClient, HttpHeaders } from '@angular/common/http';
-import { Observable } from 'rxjs';
+import { EMPTY, Observable, expand, reduce } from 'rxjs';
 import { Cart, Products } from './models';
 
 @Injectable({
@@ -22,16 +22,32 @@ export class AppService {
     return this.http.get(`${this.apiUrl}/produtos`, { headers });
   }
 
-  updateCart(): Observable<any> {
+  updateCart(client_id: number = 1): Observable<any> {
     const headers = this.headers;
 
-    return this.http.get(`${this.apiUrl}/carrinho`, { headers });
+    return this.http.get(`${this.apiUrl}/carrinho/${client_id}`, { headers });
   }
 
   updateOrders(): Observable<any> {
     const headers = this.headers;
+    const pagina = (cursor?: string) =>
+      this.http.get<any[]>(`${this.apiUrl}/pedidos`, {
+        headers,
+        observe: 'response',
+        params: cursor
+          ? { ordem: 'desc', limite: 1000, cursor }
+          : { ordem: 'desc', limite: 1000 },
+      });
 
-    return this.http.get(`${this.apiUrl}/pedidos`, { headers });
+    // A API devolve uma página por vez: segue o X-Proximo-Cursor até a última
+    // e entrega todos os pedidos juntos, os mais recentes primeiro
+    return pagina().pipe(
+      expand((resposta) => {
+        const cursor = resposta.headers.get('X-Proximo-Cursor');
+        return cursor ? pagina(cursor) : EMPTY;
+      }),
+      reduce((pedidos: any[], resposta) => pedidos.concat(resposta.body ?? []), [])
+    );
   }
 
   addToCart(item: Products) {
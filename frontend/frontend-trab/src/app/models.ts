@@ -13,7 +13,7 @@ export interface Orders {
   product_id: string;
   product_name: string;
   quantity: number;
-  status: 'pendente' | 'aprovado' | 'recusado';
+  status: 'pendente' | 'aprovado' | 'recusado' | 'enviado' | 'sem_estoque';
 }
 
 export interface Cart {
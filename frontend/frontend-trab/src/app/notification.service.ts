@@ -24,6 +24,13 @@ export class NotificacaoService {
 
       // Evento de erro
       this.eventSource.onerror = (error) => {
+        // Enquanto o navegador tenta reconectar (enviando Last-Event-ID),
+        // o servidor reenvia só as notificações perdidas
+        if (this.eventSource?.readyState === EventSource.CONNECTING) {
+          console.warn('SSE desconectado, reconectando...');
+          return;
+        }
+
         console.error('Erro no SSE:', error);
         observer.error(error);
 